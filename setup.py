@@ -32,6 +32,10 @@ with open('README.md') as f:
 
 fExt = [Extension(name='simpegEM1D.m_rTE_Fortran', # Name of the package to import
                   sources=['simpegEM1D/Fortran/m_rTE_Fortran.f90'],
+                  # Private helpers of the module; f2py would wrap them
+                  f2py_options=['skip:', 'sqrt_sp', 'exp_sp', ':'],
+                  # OpenMP parallel rTE kernels, see EM1D.n_thread
+                  extra_f90_compile_args=['-fopenmp'],
                 #   extra_f90_compile_args=['-ffree-line-length-none',
                 #                       '-O3', 
                 #                       '-finline-functions', 
@@ -42,7 +46,8 @@ fExt = [Extension(name='simpegEM1D.m_rTE_Fortran', # Name of the package to impo
                                       '-O3', 
                                       '-finline-functions', 
                                       '-funroll-all-loops',
-                                      '-g0'],
+                                      '-g0',
+                                      '-lgomp'],
                   )
         ]
 
@@ -0,0 +1,338 @@
+import warnings
+import numpy as np
+from . import RTEfun_vec
+from . import RTEfun_numba
+
+try:
+    from simpegEM1D.m_rTE_Fortran import rte_fortran
+except ImportError:
+    rte_fortran = None
+
+
+class BaseKernelBackend(object):
+    """
+        Base class of the rTE kernel backends used by EM1D.
+
+        A backend evaluates the reflection coefficients (rTE) and their
+        sensitivity to the layer conductivities (drTE) at every
+        (frequency, wavenumber) point. The complex conductivity is
+        given per frequency, sig.shape = (n_layer, n_frequency).
+        A trailing sounding axis on `sig` and `chi`
+        (e.g. sig.shape = (n_layer, n_frequency, n_sounding)) evaluates
+        a stack of soundings sharing `f` and `lamda`; the outputs get the
+        same trailing axis.
+
+        rte_forward follows the precision of the inputs: float32 `lamda`
+        and complex64 `sig` give complex64 rTE (see EM1D.precision).
+        Sensitivities are always evaluated in double precision.
+
+        Backends only need rte_forward_single and rte_sensitivity_single;
+        the remaining methods have generic implementations.
+    """
+
+    name = None
+
+    def set_num_threads(self, n_thread):
+        pass
+
+    def rte_forward_single(self, f, lamda, sig, chi, depth, half_switch):
+        raise NotImplementedError()
+
+    def rte_sensitivity_single(self, f, lamda, sig, chi, depth, half_switch):
+        raise NotImplementedError()
+
+    def rte_forward_sensitivity_single(
+        self, f, lamda, sig, chi, depth, half_switch
+    ):
+        return (
+            self.rte_forward_single(f, lamda, sig, chi, depth, half_switch),
+            self.rte_sensitivity_single(
+                f, lamda, sig, chi, depth, half_switch
+            )
+        )
+
+    def _stack(self, fun, f, lamda, sig, chi, *args):
+        """
+            Evaluate fun for every sounding of a stack and stack the
+            outputs along a trailing sounding axis
+        """
+        if sig.ndim == 2:
+            return fun(f, lamda, sig, chi, *args)
+        out = [
+            fun(f, lamda, sig[:, :, i], chi[:, i], *args)
+            for i in range(sig.shape[2])
+        ]
+        if isinstance(out[0], tuple):
+            return tuple(
+                np.asfortranarray(np.stack(o, axis=-1)) for o in zip(*out)
+            )
+        return np.asfortranarray(np.stack(out, axis=-1))
+
+    def rte_forward(self, f, lamda, sig, chi, depth, half_switch):
+        """
+            Reflection coefficients; size = lamda.shape (+ (n_sounding,))
+        """
+        return self._stack(
+            self.rte_forward_single, f, lamda, sig, chi, depth, half_switch
+        )
+
+    def rte_sensitivity(self, f, lamda, sig, chi, depth, half_switch):
+        """
+            Sensitivity of the reflection coefficients;
+            size = (n_layer,) + lamda.shape (+ (n_sounding,))
+        """
+        return self._stack(
+            self.rte_sensitivity_single, f, lamda, sig, chi, depth,
+            half_switch
+        )
+
+    def rte_forward_sensitivity(self, f, lamda, sig, chi, depth, half_switch):
+        """
+            Reflection coefficients and their sensitivity
+        """
+        return self._stack(
+            self.rte_forward_sensitivity_single, f, lamda, sig, chi, depth,
+            half_switch
+        )
+
+    def rte_jvec(self, f, lamda, sig, chi, depth, half_switch, v):
+        """
+            sum_k drTE[k, :, :]*v[k]; size = lamda.shape
+        """
+        drTE = self.rte_sensitivity_single(
+            f, lamda, sig, chi, depth, half_switch
+        )
+        return np.tensordot(v, drTE, axes=1)
+
+    def rte_jtvec(self, f, lamda, sig, chi, depth, half_switch, g):
+        """
+            sum_{i, j} drTE[:, i, j]*g[i, j]; size = (n_layer,)
+        """
+        drTE = self.rte_sensitivity_single(
+            f, lamda, sig, chi, depth, half_switch
+        )
+        return np.tensordot(drTE, g, axes=2)
+
+
+class FortranBackend(BaseKernelBackend):
+    """
+        Compiled Fortran kernels (m_rTE_Fortran), parallelized with OpenMP
+        and releasing the GIL
+    """
+
+    name = 'fortran'
+
+    def set_num_threads(self, n_thread):
+        rte_fortran.set_num_threads(int(n_thread))
+
+    def rte_forward(self, f, lamda, sig, chi, depth, half_switch):
+        if lamda.dtype == np.float32:
+            return self.rte_forward_single_precision(
+                f, lamda, sig, chi, depth, half_switch
+            )
+        rTE = np.empty(
+            lamda.shape+sig.shape[2:], dtype=np.complex128, order='F'
+        )
+        if sig.ndim == 3:
+            rte_fortran.rte_forward_multiple(
+                f, lamda, sig, chi, depth, half_switch, rTE
+            )
+        else:
+            rte_fortran.rte_forward(
+                f, lamda, sig, chi, depth, half_switch, rTE
+            )
+        return rTE
+
+    def rte_forward_single_precision(
+        self, f, lamda, sig, chi, depth, half_switch
+    ):
+        rTE = np.empty(
+            lamda.shape+sig.shape[2:], dtype=np.complex64, order='F'
+        )
+        if sig.ndim == 3:
+            rte_fortran.rte_forward_single_precision_multiple(
+                f, lamda, sig, chi, depth, half_switch, rTE
+            )
+        else:
+            rte_fortran.rte_forward_single_precision(
+                f, lamda, sig, chi, depth, half_switch, rTE
+            )
+        return rTE
+
+    def rte_sensitivity(self, f, lamda, sig, chi, depth, half_switch):
+        drTE = np.zeros(
+            (sig.shape[0],)+lamda.shape+sig.shape[2:], dtype=np.complex128,
+            order='F'
+        )
+        if sig.ndim == 3:
+            rte_fortran.rte_sensitivity_multiple(
+                f, lamda, sig, chi, depth, half_switch, drTE
+            )
+        else:
+            rte_fortran.rte_sensitivity(
+                f, lamda, sig, chi, depth, half_switch, drTE
+            )
+        return drTE
+
+    def rte_forward_sensitivity(self, f, lamda, sig, chi, depth, half_switch):
+        rTE = np.empty(
+            lamda.shape+sig.shape[2:], dtype=np.complex128, order='F'
+        )
+        drTE = np.zeros(
+            (sig.shape[0],)+rTE.shape, dtype=np.complex128, order='F'
+        )
+        if sig.ndim == 3:
+            rte_fortran.rte_forward_sensitivity_multiple(
+                f, lamda, sig, chi, depth, half_switch, rTE, drTE
+            )
+        else:
+            rte_fortran.rte_forward_sensitivity(
+                f, lamda, sig, chi, depth, half_switch, rTE, drTE
+            )
+        return rTE, drTE
+
+    rte_forward_single = rte_forward
+    rte_sensitivity_single = rte_sensitivity
+
+    def rte_jvec(self, f, lamda, sig, chi, depth, half_switch, v):
+        drTEv = np.empty(lamda.shape, dtype=np.complex128, order='F')
+        rte_fortran.rte_jvec(
+            f, lamda, sig, chi, depth, half_switch,
+            v.astype(np.complex128), drTEv
+        )
+        return drTEv
+
+    def rte_jtvec(self, f, lamda, sig, chi, depth, half_switch, g):
+        Jtv = np.zeros(sig.shape[0], dtype=np.complex128)
+        return rte_fortran.rte_jtvec(
+            f, lamda, sig, chi, depth, half_switch,
+            np.asfortranarray(g, dtype=np.complex128), Jtv
+        )
+
+
+class NumbaBackend(BaseKernelBackend):
+    """
+        JIT compiled loops of RTEfun_numba, parallelized over frequencies
+    """
+
+    name = 'numba'
+
+    def set_num_threads(self, n_thread):
+        import numba
+        numba.set_num_threads(
+            max(1, min(int(n_thread), numba.config.NUMBA_NUM_THREADS))
+        )
+
+    def rte_forward_single(self, f, lamda, sig, chi, depth, half_switch):
+        rTE = np.empty(lamda.shape, dtype=sig.dtype)
+        RTEfun_numba.rTEfunfwd(
+            f, lamda, sig, np.asarray(chi, dtype=lamda.dtype), depth,
+            half_switch, rTE
+        )
+        return rTE
+
+    def rte_forward_sensitivity_single(
+        self, f, lamda, sig, chi, depth, half_switch
+    ):
+        rTE = np.empty(lamda.shape, dtype=np.complex128)
+        drTE = np.zeros((sig.shape[0],)+lamda.shape, dtype=np.complex128)
+        RTEfun_numba.rTEfunjac(
+            f, lamda, sig, np.asarray(chi, dtype=float), depth,
+            half_switch, rTE, drTE
+        )
+        return rTE, drTE
+
+    def rte_sensitivity_single(self, f, lamda, sig, chi, depth, half_switch):
+        return self.rte_forward_sensitivity_single(
+            f, lamda, sig, chi, depth, half_switch
+        )[1]
+
+    def rte_jvec(self, f, lamda, sig, chi, depth, half_switch, v):
+        drTEv = np.empty(lamda.shape, dtype=np.complex128)
+        RTEfun_numba.rTEfunjvec(
+            f, lamda, sig, np.asarray(chi, dtype=float), depth,
+            half_switch, v.astype(np.complex128), drTEv
+        )
+        return drTEv
+
+    def rte_jtvec(self, f, lamda, sig, chi, depth, half_switch, g):
+        Jtv = np.zeros(sig.shape[0], dtype=np.complex128)
+        RTEfun_numba.rTEfunjtvec(
+            f, lamda, sig, np.asarray(chi, dtype=float), depth,
+            half_switch, np.asarray(g, dtype=np.complex128), Jtv
+        )
+        return Jtv
+
+
+class NumpyBackend(BaseKernelBackend):
+    """
+        Vectorized python kernels of RTEfun_vec; always available
+    """
+
+    name = 'numpy'
+
+    def rte_forward_single(self, f, lamda, sig, chi, depth, half_switch):
+        return RTEfun_vec.rTEfunfwd(
+            sig.shape[0], f, lamda, sig, chi, depth, half_switch
+        )
+
+    def rte_sensitivity_single(self, f, lamda, sig, chi, depth, half_switch):
+        return RTEfun_vec.rTEfunjac(
+            sig.shape[0], f, lamda, sig, chi, depth, half_switch
+        )
+
+    def rte_jvec(self, f, lamda, sig, chi, depth, half_switch, v):
+        return RTEfun_vec.rTEfunjvec(
+            sig.shape[0], f, lamda, sig, chi, depth, half_switch, v
+        )
+
+    def rte_jtvec(self, f, lamda, sig, chi, depth, half_switch, g):
+        return RTEfun_vec.rTEfunjtvec(
+            sig.shape[0], f, lamda, sig, chi, depth, half_switch, g
+        )
+
+
+# Registered backends, in order of preference for the fallback
+BACKENDS = {}
+BACKEND_ORDER = []
+
+
+def register_backend(backend, available=True):
+    """
+        Add a backend (a BaseKernelBackend instance) to the registry.
+        Unavailable backends are skipped.
+    """
+    if available:
+        BACKENDS[backend.name] = backend
+        if backend.name not in BACKEND_ORDER:
+            BACKEND_ORDER.append(backend.name)
+
+
+def get_backend(name=None):
+    """
+        Backend registered as `name`; falls back to the first available
+        backend (fortran, numba, numpy) with a warning if it is missing.
+        None returns the preferred backend.
+    """
+    if name in BACKENDS:
+        return BACKENDS[name]
+    fallback = BACKENDS[BACKEND_ORDER[0]]
+    if name is not None:
+        warnings.warn(
+            "Kernel backend '{}' is not available; using '{}'".format(
+                name, fallback.name
+            )
+        )
+    return fallback
+
+
+def available_backends():
+    """
+        Names of the registered backends, in order of preference
+    """
+    return list(BACKEND_ORDER)
+
+
+register_backend(FortranBackend(), available=rte_fortran is not None)
+register_backend(NumbaBackend(), available=RTEfun_numba.njit is not None)
+register_backend(NumpyBackend())
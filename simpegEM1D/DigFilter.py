@@ -1,8 +1,11 @@
 import numpy as np
 from scipy.constants import mu_0
-from scipy.interpolate import interp1d
+from scipy.interpolate import interp1d, CubicSpline
 from scipy.constants import pi
 from SimPEG import Utils
+from empymod.transform import get_spline_values
+from empymod import filters
+from empymod.utils import check_time
 
 
 def EvalDigitalFilt(base, weight, fun, r):
@@ -2616,3 +2619,216 @@ def LoadWeights():
 
     return WT0, WT1, YBASE
 
+
+def get_dlf_weights(filt, r, pts_per_dec):
+    """
+        Wavenumbers shared by all offsets and the weights of the lagged
+        convolution (pts_per_dec < 0) or splined (pts_per_dec > 0)
+        Hankel DLF on them.
+
+        The interpolation of either DLF is linear in the kernel, so it is
+        folded into the filter weights; for a kernel evaluated at lambd,
+
+            Hz(r[i]) = np.dot(kernel, weights[i_bessel][i, :])/r[i]
+
+        Parameters
+        ----------
+        filt: empymod.filters.DigitalFilter
+            Hankel filter
+        r: ndarray
+            Distinct offsets (m); size = (n_offset,)
+        pts_per_dec: int
+            Points per decade of the splined DLF, or negative for
+            the lagged convolution DLF
+
+        Returns
+        -------
+        lambd: ndarray
+            Wavenumbers (1/m); size = (n_wavenumber,)
+        weights: tuple of ndarray
+            J0 and J1 weights; size = (n_offset x n_wavenumber)
+    """
+    lambd, int_pts = get_spline_values(filt, r, pts_per_dec)
+    lambd = lambd.ravel()
+    n_base = filt.base.size
+
+    if pts_per_dec < 0:
+        # The filter slides one wavenumber per offset in int_pts,
+        # then the transformed kernel is interpolated at r
+        n_int = int_pts.size
+        spline = CubicSpline(
+            np.log(int_pts[::-1]), np.eye(n_int)[::-1], axis=0
+        )(np.log(r))
+        i_lag = np.arange(n_int).reshape([-1, 1])
+        i_wavenumber = i_lag + np.arange(n_base)
+        weights = []
+        for weight in (filt.j0, filt.j1):
+            lag = np.zeros((n_int, lambd.size))
+            lag[i_lag, i_wavenumber] = weight
+            weights.append(np.dot(spline, lag))
+    else:
+        # The kernel is interpolated at the filter wavenumbers of each r
+        spline = CubicSpline(
+            np.log(lambd), np.eye(lambd.size), axis=0
+        )(np.log(filt.base/r.reshape([-1, 1])))
+        weights = [np.matmul(weight, spline) for weight in (filt.j0, filt.j1)]
+
+    return lambd, tuple(weights)
+
+
+def get_ffht_filter_weights(values, filt, time, frequency, pts_per_dec):
+    """
+        Weights sum_n values[n]*fEM(filt.base[n]/time) of a response fEM
+        evaluated at the frequencies of empymod.utils.check_time, with
+        the interpolation of the splined DLF (pts_per_dec > 0) folded in;
+        size = (n_time x n_frequency). The standard DLF (pts_per_dec = 0)
+        has one set of frequencies per time. The interpolation is
+        evaluated for blocks of times to bound the memory.
+    """
+    n_base = filt.base.size
+    weights = np.zeros((time.size, frequency.size))
+    if pts_per_dec == 0:
+        for i in range(time.size):
+            weights[i, i*n_base:(i+1)*n_base] = values
+    elif pts_per_dec > 0:
+        spline = CubicSpline(
+            np.log(2*pi*frequency), np.eye(frequency.size), axis=0
+        )
+        n_block = max(1, int(2**20/(n_base*frequency.size)))
+        for i in range(0, time.size, n_block):
+            weights[i:i+n_block] = np.matmul(
+                values,
+                spline(np.log(filt.base/time[i:i+n_block].reshape([-1, 1])))
+            )
+    else:
+        raise NotImplementedError(
+            "The lagged convolution DLF is not available"
+        )
+    return weights
+
+
+def get_ffht_weights(filt, time, frequency, pts_per_dec):
+    """
+        Weights of the sine transform DLF (empymod.transform.ffht) from
+        frequency to time, with the interpolation of the splined DLF
+        (pts_per_dec > 0) folded in; for a response evaluated at the
+        frequencies of empymod.utils.check_time,
+
+            ffht(fEM, time, frequency, ftarg) = np.dot(weights, fEM.imag)
+
+        so that several responses are transformed by a single product.
+
+        Parameters
+        ----------
+        filt: empymod.filters.DigitalFilter
+            Sine and cosine filter
+        time: ndarray
+            Times (s); size = (n_time,)
+        frequency: ndarray
+            Frequencies (Hz); size = (n_frequency,)
+        pts_per_dec: int
+            Points per decade of the splined DLF, or 0 for the standard
+            DLF
+
+        Returns
+        -------
+        weights: ndarray
+            Real weights; size = (n_time x n_frequency)
+    """
+    weights = get_ffht_filter_weights(
+        filt.sin, filt, time, frequency, pts_per_dec
+    )
+    return -weights/time.reshape([-1, 1])
+
+
+def get_ffht_integral_weights(filt, time, frequency, pts_per_dec):
+    """
+        Weights of the integral of the sine transform DLF from the time
+        to infinity, evaluated as a cosine transform DLF of fEM/omega;
+
+            -int_time^inf ffht(fEM, t, frequency, ftarg) dt
+                = np.dot(weights, fEM.imag)
+
+        The response to a linear current ramp from t_a to t_b is the
+        difference of the integrals at t_a and t_b, without quadrature.
+        Parameters and size as get_ffht_weights; the standard DLF
+        (pts_per_dec = 0) needs the frequencies of the integral times.
+    """
+    return get_ffht_filter_weights(
+        filt.cos/filt.base, filt, time, frequency, pts_per_dec
+    )
+
+
+# Candidates of the adaptive frequency sampling (get_ffht_sampling)
+FFHT_FILTERS = [
+    'key_81_CosSin_2009', 'key_101_CosSin_2012', 'key_201_CosSin_2012',
+    'key_241_CosSin_2009'
+]
+FFHT_PTS_PER_DEC = [0, 1, 2, 3, 5, 10, 20]
+
+
+def get_ffht_error(filt, time, frequency, pts_per_dec, n_test=7):
+    """
+        Relative error of the sine transform DLF at the times, estimated
+        on the analytic diffusion responses
+
+            fEM = exp(-a*sqrt(i*omega)),
+            f(t) = a/(2*sqrt(pi)) * t**-1.5 * exp(-a**2/(4*t)),
+
+        with n_test peak times (a**2/6) from half a decade before to half
+        a decade after the times; the largest error of the test responses.
+    """
+    weights = get_ffht_weights(filt, time, frequency, pts_per_dec)
+    omega = 2*pi*frequency
+    error = 0.
+    for t_peak in np.logspace(
+        np.log10(time.min())-0.5, np.log10(time.max())+0.5, n_test
+    ):
+        a = np.sqrt(6*t_peak)
+        response = a/(2*np.sqrt(pi)) * time**-1.5 * np.exp(-a**2/(4*time))
+        response_dlf = 2/pi * np.dot(
+            weights, np.exp(-a*np.sqrt(1j*omega)).imag
+        )
+        error = max(
+            error,
+            np.linalg.norm(response_dlf-response)/np.linalg.norm(response)
+        )
+    return error
+
+
+def get_ffht_sampling(
+    time, accuracy, filter_names=FFHT_FILTERS, pts_per_dec=FFHT_PTS_PER_DEC
+):
+    """
+        Filter and points per decade of the sine transform DLF with the
+        fewest frequencies (kernel evaluations) whose estimated error
+        (get_ffht_error) at the times is below the relative accuracy;
+        the most accurate candidate if none is.
+
+        Returns
+        -------
+        frequency: ndarray
+            Frequencies (Hz) of empymod.utils.check_time
+        ftarg: tuple
+            (filter, pts_per_dec, 'sin')
+        error: float
+            Estimated relative error
+    """
+    candidates = []
+    for name in filter_names:
+        filt = getattr(filters, name)()
+        for n in pts_per_dec:
+            _, frequency, _, ftarg = check_time(
+                time, 0, 'sin', {'pts_per_dec': n, 'fftfilt': filt}, 0
+            )
+            candidates.append((frequency, ftarg))
+    candidates.sort(key=lambda candidate: candidate[0].size)
+
+    best = None
+    for frequency, ftarg in candidates:
+        error = get_ffht_error(ftarg[0], time, frequency, ftarg[1])
+        if best is None or error < best[2]:
+            best = (frequency, ftarg, error)
+        if error <= accuracy:
+            return frequency, ftarg, error
+    return best
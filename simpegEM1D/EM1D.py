@@ -1,15 +1,248 @@
 from SimPEG import Maps, Utils, Problem, Props
 import numpy as np
-from .Survey import BaseEM1DSurvey
+from .Survey import BaseEM1DSurvey, dipole_coupling
 from scipy.constants import mu_0
 from .RTEfun_vec import rTEfunfwd, rTEfunjac
+from .DigFilter import get_dlf_weights
 from scipy.interpolate import InterpolatedUnivariateSpline as iuSpline
+from scipy.interpolate import CubicSpline
 
 from empymod import filters
 from empymod.transform import dlf, get_spline_values
 from empymod.utils import check_hankel
 
-from simpegEM1D.m_rTE_Fortran import rte_fortran
+from .Backends import get_backend
+
+
+def to_single_precision(*arrays):
+    """
+        Fortran ordered float32 (or complex64) copies of the arrays
+    """
+    return [
+        np.asfortranarray(
+            x, dtype=np.complex64 if np.iscomplexobj(x) else np.float32
+        ) for x in arrays
+    ]
+
+
+def sounding_axis(lamda, sig):
+    """
+        Wavenumbers broadcast against the trailing sounding axis of a
+        stack of soundings (sig.shape = (n_layer, n_frequency, n_sounding)),
+        which share lamda
+    """
+    if sig.ndim == 3:
+        return lamda[:, :, np.newaxis]
+    return lamda
+
+
+class HankelPlan(object):
+    """
+        Model independent arrays of the Hz kernels. The wavenumbers,
+        frequencies, DLF weights and wavenumber coefficient depend on the
+        geometry only; the propagation factors also depend on the height.
+        EM1D.hankel_plan keeps one plan across model updates.
+    """
+
+    def __init__(
+        self, geometry, r, lambd, f, dlf_weights,
+        coefficient_wavenumber, i_bessel, total_loop
+    ):
+        self.geometry = geometry
+        self.r = r
+        self.lambd = lambd
+        self.f = f
+        self.frequency = f[:, 0]
+        self.dlf_weights = dlf_weights
+        self.coefficient_wavenumber = coefficient_wavenumber
+        self.i_bessel = i_bessel
+        self.total_loop = total_loop
+        self.h = None
+        self.z = None
+        self._single_precision = None
+        self._rte_interpolation = {}
+        # Coarse grid density of the last interpolated rTE (see
+        # EM1D.coarse_rTE); None if rTE was evaluated exactly
+        self.rte_pts_per_dec = None
+
+    def matches(self, geometry):
+        """
+            True if the plan was built for this geometry
+        """
+        return all(
+            np.array_equal(a, b) for a, b in zip(self.geometry, geometry)
+        )
+
+    def set_height(self, h, z):
+        """
+            Update the propagation factors if the source height (h) or the
+            receiver height (z) changed
+        """
+        if np.array_equal(h, self.h) and np.array_equal(z, self.z):
+            return
+        self.h, self.z = np.copy(h), np.copy(z)
+        self._single_precision = None
+        u0 = self.lambd
+
+        # Kernel factors multiplying drTE and rTE
+        self.sensitivity_factor = (
+            np.exp(-u0*(z+h)) * self.coefficient_wavenumber
+        )
+        if self.total_loop:
+            self.response_factor = self.sensitivity_factor + (
+                np.exp(u0*(z-h)) * self.coefficient_wavenumber
+            )
+        else:
+            self.response_factor = self.sensitivity_factor
+        # z-h is fixed by the system, only exp(-u0*(z+h)) depends on h
+        self.height_factor = -2*u0 * self.sensitivity_factor
+
+    def single_precision(self):
+        """
+            Wavenumbers, frequencies and response factor in single
+            precision; kept until the height changes
+        """
+        if self._single_precision is None:
+            self._single_precision = to_single_precision(
+                self.lambd, self.f, self.response_factor
+            )
+        return self._single_precision
+
+    def rte_interpolation(self, pts_per_dec):
+        """
+            Interpolation of rTE from a coarse grid with pts_per_dec
+            wavenumbers per decade; kept with the plan
+        """
+        if pts_per_dec not in self._rte_interpolation:
+            self._rte_interpolation[pts_per_dec] = RTEInterpolation(
+                self.lambd, self.f, pts_per_dec
+            )
+        return self._rte_interpolation[pts_per_dec]
+
+
+class ReceiverPlan(HankelPlan):
+    """
+        Hankel plan of a set of receivers of the same source
+        (EM1D.forward_receivers). The kernel rows are the distinct
+        source-receiver offsets at each frequency; receivers at the same
+        offset share their rows, and receivers at the same height share
+        their propagation factors.
+    """
+
+    def __init__(
+        self, geometry, r, lambd, f, dlf_weights, i_row, i_height, dz
+    ):
+        HankelPlan.__init__(
+            self, geometry, r, lambd, f, dlf_weights, None, None, False
+        )
+        # Rows of each receiver, size = (n_receiver x n_frequency)
+        self.i_row = i_row
+        # Height of each receiver among the distinct heights
+        self.i_height = i_height
+        # Distinct receiver heights relative to the source
+        self.dz = dz
+
+    def set_height(self, h):
+        """
+            Update the propagation factors if the source height changed;
+            the receivers move with the source.
+            size = (n_height x n_row x n_filter)
+        """
+        if np.array_equal(h, self.h):
+            return
+        self.h = np.copy(h)
+        self.z = h + self.dz
+        self.propagation = np.exp(
+            -self.lambd*(self.z.reshape([-1, 1, 1])+h)
+        )
+
+
+class RTEInterpolation(object):
+    """
+        Cubic spline interpolation of rTE to the wavenumbers of a Hankel
+        plan, from a coarse grid uniformly spaced in log(lambd) and shared
+        by all rows of the same frequency.
+
+        log(rTE) is interpolated rather than rTE: away from the transition
+        at lambd ~ |k|, rTE follows power laws of lambd that are
+        interpolated (almost) exactly.
+    """
+
+    def __init__(self, lambd, f, pts_per_dec):
+        x = np.log(lambd)
+        n_coarse = int(np.ceil(
+            (x.max()-x.min())/np.log(10)*pts_per_dec
+        ))
+        # Odd number of points for RTEInterpolation.interpolation_error
+        n_coarse = max(n_coarse + n_coarse % 2 + 1, 5)
+        self.x = np.linspace(x.min(), x.max(), n_coarse)
+        frequency, self.i_row, self.i_frequency = np.unique(
+            f[:, 0], return_index=True, return_inverse=True
+        )
+        self.lambd = np.asfortranarray(
+            np.tile(np.exp(self.x), (frequency.size, 1))
+        )
+        self.f = np.empty(self.lambd.shape, order='F')
+        self.f[:, :] = frequency.reshape([-1, 1])
+        # size = (n_frequency, n_filter, n_coarse)
+        self.weights = CubicSpline(self.x, np.eye(n_coarse), axis=0)(x)
+
+    def log(self, rTE):
+        """
+            Complex logarithm with the phase unwrapped along the
+            wavenumbers
+        """
+        return np.log(abs(rTE)) + 1j*np.unwrap(np.angle(rTE), axis=-1)
+
+    def half_grid_misfit(self, a):
+        """
+            Misfit of the spline through every other point of the coarse
+            grid at the remaining points; the wavenumber axis is last
+        """
+        spline = CubicSpline(self.x[::2], a[..., ::2], axis=-1)
+        return abs(spline(self.x[1::2]) - a[..., 1::2])
+
+    def interpolation_error(self, log_rTE, drTE_rTE=None):
+        """
+            Estimated relative error of the interpolated rTE (and drTE).
+
+            The spline error is O(h^4), so the error of the spline through
+            all points is about 16 times smaller than the half grid misfit;
+            it is divided by 8 to stay on the safe side. The misfit of
+            log(rTE) is the relative error of rTE. The misfit of drTE/rTE
+            is relative to its largest value over the layers and
+            wavenumbers of each frequency.
+        """
+        error = self.half_grid_misfit(log_rTE).max()
+        if drTE_rTE is not None:
+            misfit = self.half_grid_misfit(drTE_rTE).max(axis=(0, 2))
+            peak = abs(drTE_rTE).max(axis=(0, 2))
+            active = peak > 0.
+            if active.any():
+                error = max(error, (misfit[active]/peak[active]).max())
+        return error/8.
+
+    def interpolate(self, a):
+        """
+            Coarse grid values (..., n_distinct_frequency, n_coarse)
+            interpolated to the plan wavenumbers; size = (...,) +
+            lambd.shape
+        """
+        return np.einsum(
+            'ijk,...ik->...ij', self.weights, a[..., self.i_frequency, :]
+        )
+
+    def interpolate_adjoint(self, g):
+        """
+            Adjoint of RTEInterpolation.interpolate for g of size
+            lambd.shape
+        """
+        out = np.zeros(self.lambd.shape, dtype=complex)
+        np.add.at(
+            out, self.i_frequency, np.einsum('ijk,ij->ik', self.weights, g)
+        )
+        return out
+
 
 class EM1D(Problem.BaseProblem):
     """
@@ -21,11 +254,26 @@ class EM1D(Problem.BaseProblem):
     chi = None
     hankel_filter = 'key_101_2009'  # Default: Hankel filter
     hankel_pts_per_dec = None       # Default: Standard DLF
+                                    # (<0: lagged convolution, >0: splined)
     verbose = False
+    n_thread = 1                    # OpenMP threads used by the rTE kernels
+    kernel_backend = None           # rTE kernels: 'fortran', 'numba', 'numpy'
+                                    # (None: first available)
+    precision = 'double'            # 'single': complex64 response
+                                    # (see EM1D.forward)
+    rte_interpolation_tol = None    # Interpolated rTE: relative tolerance
+                                    # (None: exact; see EM1D.coarse_rTE)
+    rte_pts_per_dec = 4             # Coarse grid of the interpolated rTE
+                                    # (start of the refinement)
+    rte_interpolation_error = None  # Estimated error of the last rTE
     fix_Jmatrix = False
+    matrix_free = False             # Jvec and Jtvec without forming J sigma
     _Jmatrix_sigma = None
     _Jmatrix_height = None
     _pred = None
+    _hankel_plan = None
+    _receiver_plan = None
+    _rTE = None
 
     sigma, sigmaMap, sigmaDeriv = Props.Invertible(
         "Electrical conductivity at infinite frequency(S/m)"
@@ -69,8 +317,226 @@ class EM1D(Problem.BaseProblem):
         if self.verbose:
             print(">> Use "+self.hankel_filter+" filter for Hankel Transform")
 
-        if self.hankel_pts_per_dec != 0:
-            raise NotImplementedError()
+    @property
+    def backend(self):
+        """
+            Kernel backend selected by kernel_backend; falls back to the
+            first available one (see Backends.get_backend)
+        """
+        return get_backend(self.kernel_backend)
+
+    def set_num_threads(self, n_thread=None):
+        """
+            Set the number of threads used by the rTE kernels.
+
+            For the Fortran backend, the setting applies to kernels called
+            from the current python thread only; it has no effect if the
+            extension was built without OpenMP. None keeps the default
+            (OMP_NUM_THREADS).
+        """
+        if n_thread is not None:
+            self.n_thread = n_thread
+        if self.n_thread is not None:
+            self.backend.set_num_threads(self.n_thread)
+
+    def rte_interpolation(self, lamda, pts_per_dec=None):
+        """
+            Interpolation of rTE from a coarse wavenumber grid with
+            pts_per_dec points per decade (rte_pts_per_dec by default), or
+            None if rTE is evaluated exactly at lamda. Only rTE at the
+            wavenumbers of the Hankel plan is interpolated, and only while
+            the coarse grid is coarser than the filter.
+        """
+        plan = self._hankel_plan
+        if (
+            self.rte_interpolation_tol is None or plan is None or
+            lamda is not plan.lambd
+        ):
+            return None
+        if pts_per_dec is None:
+            pts_per_dec = self.rte_pts_per_dec
+        filter_pts_per_dec = 1./np.log10(
+            self.fhtfilt.base[1]/self.fhtfilt.base[0]
+        )
+        if pts_per_dec >= filter_pts_per_dec:
+            return None
+        return plan.rte_interpolation(pts_per_dec)
+
+    def coarse_rTE(self, lamda, sig, chi, depth, sensitivity=False):
+        """
+            rTE (and drTE) on the coarse wavenumber grid of the
+            interpolated rTE.
+
+            With rte_interpolation_tol set, rTE at the wavenumbers of the
+            Hankel plan is evaluated once per frequency on a coarse grid
+            uniformly spaced in log(lambd) (rte_pts_per_dec points per
+            decade) and interpolated to the filter wavenumbers; drTE is
+            interpolated as drTE/rTE. The grid is refined until the
+            estimated relative error of the interpolated kernels, stored
+            in rte_interpolation_error, is below the tolerance. If it gets
+            as dense as the filter, the kernels are evaluated exactly.
+            Every evaluation starts from rte_pts_per_dec; the density
+            reached is kept in the rte_pts_per_dec of the Hankel plan.
+
+            The tolerance applies to the kernels. The Hankel DLF of the
+            VMD sums terms much larger than Hz at low frequencies, so its
+            error on Hz and J can be an order of magnitude larger than the
+            tolerance.
+
+            rTE of a stack of soundings is always evaluated exactly.
+
+            Returns
+            -------
+            (interpolation, log_rTE, drTE/rTE) on the coarse grid, or None
+            if the kernels are evaluated exactly; drTE/rTE is None unless
+            sensitivity is True
+        """
+        if sig.ndim == 3:
+            return None
+        pts_per_dec = self.rte_pts_per_dec
+        interpolation = self.rte_interpolation(lamda, pts_per_dec)
+        while interpolation is not None:
+            sig_coarse = np.asfortranarray(sig[:, interpolation.i_row])
+            if sensitivity:
+                rTE, drTE = self.backend.rte_forward_sensitivity(
+                    interpolation.f, interpolation.lambd, sig_coarse, chi,
+                    depth, self.survey.half_switch
+                )
+                drTE_rTE = drTE/rTE
+            else:
+                rTE = self.backend.rte_forward(
+                    interpolation.f, interpolation.lambd, sig_coarse, chi,
+                    depth, self.survey.half_switch
+                )
+                drTE_rTE = None
+            log_rTE = interpolation.log(rTE)
+            self.rte_interpolation_error = interpolation.interpolation_error(
+                log_rTE, drTE_rTE
+            )
+            if self.rte_interpolation_error <= self.rte_interpolation_tol:
+                self._hankel_plan.rte_pts_per_dec = pts_per_dec
+                return interpolation, log_rTE, drTE_rTE
+
+            pts_per_dec = int(np.ceil(1.5*pts_per_dec))
+            if self.verbose:
+                print (
+                    ">> Refine the interpolated rTE: {} points per "
+                    "decade".format(pts_per_dec)
+                )
+            interpolation = self.rte_interpolation(lamda, pts_per_dec)
+
+        if self.rte_interpolation_tol is not None:
+            self.rte_interpolation_error = 0.
+            plan = self._hankel_plan
+            if plan is not None and lamda is plan.lambd:
+                plan.rte_pts_per_dec = None
+        return None
+
+    def compute_rTE(self, f, lamda, sig, chi, depth):
+        """
+            Reflection coefficients (rTE) from the kernel backend.
+
+            The complex conductivity is given per frequency,
+            sig.shape = (n_layer, n_frequency), and is shared by every
+            wavenumber of the filter.
+
+            A trailing sounding axis on `sig` and `chi`
+            (e.g. sig.shape = (n_layer, n_frequency, n_sounding))
+            evaluates a stack of soundings sharing `f` and `lamda` with a
+            single call.
+        """
+        self.set_num_threads()
+        coarse = self.coarse_rTE(lamda, sig, chi, depth)
+        if coarse is not None:
+            interpolation, log_rTE, _ = coarse
+            return np.exp(interpolation.interpolate(log_rTE))
+        return self.backend.rte_forward(
+            f, lamda, sig, chi, depth, self.survey.half_switch
+        )
+
+    def compute_drTE(self, f, lamda, sig, chi, depth):
+        """
+            Sensitivity of the reflection coefficients (drTE/dsigma) from
+            the kernel backend; size = (n_layer,) + lamda.shape.
+        """
+        if sig.ndim == 2 and self.rte_interpolation(lamda) is not None:
+            return self.compute_rTE_drTE(f, lamda, sig, chi, depth)[1]
+        self.set_num_threads()
+        return self.backend.rte_sensitivity(
+            f, lamda, sig, chi, depth, self.survey.half_switch
+        )
+
+    def compute_rTE_drTE(self, f, lamda, sig, chi, depth):
+        """
+            Reflection coefficients and their sensitivity from a single
+            pass of the fused kernel.
+        """
+        self.set_num_threads()
+        coarse = self.coarse_rTE(lamda, sig, chi, depth, sensitivity=True)
+        if coarse is not None:
+            interpolation, log_rTE, drTE_rTE = coarse
+            rTE = np.exp(interpolation.interpolate(log_rTE))
+            return rTE, rTE * interpolation.interpolate(drTE_rTE)
+        return self.backend.rte_forward_sensitivity(
+            f, lamda, sig, chi, depth, self.survey.half_switch
+        )
+
+    def compute_drTE_vec(self, f, lamda, sig, chi, depth, v):
+        """
+            Sensitivity of the reflection coefficients times a vector,
+            sum_k drTE[k, :, :]*v[k]; size = lamda.shape.
+            drTE itself is never formed by the compiled backends.
+        """
+        self.set_num_threads()
+        coarse = self.coarse_rTE(lamda, sig, chi, depth, sensitivity=True)
+        if coarse is not None:
+            interpolation, log_rTE, drTE_rTE = coarse
+            return np.exp(interpolation.interpolate(log_rTE)) * (
+                interpolation.interpolate(np.tensordot(v, drTE_rTE, axes=1))
+            )
+        return self.backend.rte_jvec(
+            f, lamda, sig, chi, depth, self.survey.half_switch, v
+        )
+
+    def compute_drTE_tvec(self, f, lamda, sig, chi, depth, g):
+        """
+            Adjoint of the sensitivity of the reflection coefficients,
+            sum_{i, j} drTE[:, i, j]*g[i, j]; size = (n_layer,).
+            drTE itself is never formed by the compiled backends.
+        """
+        self.set_num_threads()
+        coarse = self.coarse_rTE(lamda, sig, chi, depth, sensitivity=True)
+        if coarse is not None:
+            interpolation, log_rTE, drTE_rTE = coarse
+            rTE = np.exp(interpolation.interpolate(log_rTE))
+            return np.tensordot(
+                drTE_rTE, interpolation.interpolate_adjoint(g*rTE), axes=2
+            )
+        return self.backend.rte_jtvec(
+            f, lamda, sig, chi, depth, self.survey.half_switch, g
+        )
+
+    def response_rTE(self, f, lamda, sig, chi, depth):
+        """
+            rTE of the response at the wavenumbers of the Hankel plan.
+
+            rTE does not depend on the source and receiver heights, so it
+            is kept until the model or the kernel inputs change and the
+            sensitivity to height reuses the rTE of the response.
+        """
+        key = (
+            lamda, sig, chi, depth, self.survey.half_switch,
+            self.rte_interpolation_tol
+        )
+        if self._rTE is not None:
+            cached_key, rTE = self._rTE
+            if cached_key[0] is lamda and all(
+                np.array_equal(a, b) for a, b in zip(cached_key[1:], key[1:])
+            ):
+                return rTE
+        rTE = self.compute_rTE(f, lamda, sig, chi, depth)
+        self._rTE = (key, rTE)
+        return rTE
 
     def hz_kernel_vertical_magnetic_dipole(
         self, lamda, f, n_layer, sig, chi, depth, h, z,
@@ -82,21 +548,15 @@ class EM1D(Problem.BaseProblem):
             vertical magnetic diopole (VMD) source in (kx,ky) domain
 
         """
-        u0 = lamda
-        coefficient_wavenumber = 1/(4*np.pi)*lamda**3/u0
-
-        n_frequency = self.survey.n_frequency
-        n_layer = self.survey.n_layer
-        n_filter = self.n_filter
+        u0 = sounding_axis(lamda, sig)
+        coefficient_wavenumber, _ = self.coefficient_wavenumber(u0)
 
         if output_type == 'sensitivity_sigma':
-            drTE = np.zeros([n_layer, n_frequency, n_filter], dtype=np.complex128, order='F')
-            rte_fortran.rte_sensitivity(f, lamda, sig, chi, depth, self.survey.half_switch, drTE, n_layer, n_frequency, n_filter)
+            drTE = self.compute_drTE(f, lamda, sig, chi, depth)
 
             kernel = drTE * np.exp(-u0*(z+h)) * coefficient_wavenumber
         else:
-            rTE = np.empty([n_frequency, n_filter], dtype=np.complex128, order='F')
-            rte_fortran.rte_forward(f, lamda, sig, chi, depth, self.survey.half_switch, rTE, n_layer, n_frequency, n_filter) 
+            rTE = self.compute_rTE(f, lamda, sig, chi, depth)
 
             kernel = rTE * np.exp(-u0*(z+h)) * coefficient_wavenumber
             if output_type == 'sensitivity_height':
@@ -132,33 +592,31 @@ class EM1D(Problem.BaseProblem):
 
         """
 
-        n_frequency = self.survey.n_frequency
-        n_layer = self.survey.n_layer
-        n_filter = self.n_filter
-
         w = 2*np.pi*f
-        u0 = lamda
-        radius = np.empty([n_frequency, n_filter], order='F')
-        radius[:, :] = np.tile(a.reshape([-1, 1]), (1, n_filter))
+        u0 = sounding_axis(lamda, sig)
+        # Loop radius is either a scalar or varies along the frequency axis
+        # (u0 may carry an extra sounding axis)
+        radius = np.reshape(
+            np.asarray(a, dtype=u0.dtype), [-1]+[1]*(u0.ndim-1)
+        )
 
-        coefficient_wavenumber = I*radius*0.5*lamda**2/u0
+        coefficient_wavenumber = I*radius*0.5*u0**2/u0
 
         if output_type == 'sensitivity_sigma':
-            drTE = np.zeros([n_layer, n_frequency, n_filter], dtype=np.complex128, order='F')
-            rte_fortran.rte_sensitivity(f, lamda, sig, chi, depth, self.survey.half_switch, drTE, n_layer, n_frequency, n_filter)
+            drTE = self.compute_drTE(f, lamda, sig, chi, depth)
 
             kernel = drTE * np.exp(-u0*(z+h)) * coefficient_wavenumber
         else:
-            rTE = np.empty([n_frequency, n_filter], dtype=np.complex128, order='F')
-            rte_fortran.rte_forward(f, lamda, sig, chi, depth, self.survey.half_switch, rTE, n_layer, n_frequency, n_filter) 
+            rTE = self.compute_rTE(f, lamda, sig, chi, depth)
 
-            if flag == 'secondary':
+            if flag == 'secondary' or output_type == 'sensitivity_height':
                 kernel = rTE * np.exp(-u0*(z+h)) * coefficient_wavenumber
             else:
                 kernel = rTE * (
                     np.exp(-u0*(z+h)) + np.exp(u0*(z-h))
                 ) * coefficient_wavenumber
 
+            # z-h is fixed by the system, only exp(-u0*(z+h)) depends on h
             if output_type == 'sensitivity_height':
                 kernel *= -2*u0
 
@@ -174,21 +632,15 @@ class EM1D(Problem.BaseProblem):
             horizontal electric diopole (HED) source in (kx,ky) domain
 
         """
-        n_frequency = self.survey.n_frequency
-        n_layer = self.survey.n_layer
-        n_filter = self.n_filter
-
-        u0 = lamda
-        coefficient_wavenumber = 1/(4*np.pi)*lamda**2/u0
+        u0 = sounding_axis(lamda, sig)
+        coefficient_wavenumber = 1/(4*np.pi)*u0**2/u0
 
         if output_type == 'sensitivity_sigma':
-            drTE = np.zeros([n_layer, n_frequency, n_filter], dtype=np.complex128, order='F')
-            rte_fortran.rte_sensitivity(f, lamda, sig, chi, depth, self.survey.half_switch, drTE, n_layer, n_frequency, n_filter)
+            drTE = self.compute_drTE(f, lamda, sig, chi, depth)
 
             kernel = drTE * np.exp(-u0*(z+h)) * coefficient_wavenumber
         else:
-            rTE = np.empty([n_frequency, n_filter], dtype=np.complex128, order='F')
-            rte_fortran.rte_forward(f, lamda, sig, chi, depth, self.survey.half_switch, rTE, n_layer, n_frequency, n_filter) 
+            rTE = self.compute_rTE(f, lamda, sig, chi, depth)
 
             kernel = rTE * np.exp(-u0*(z+h)) * coefficient_wavenumber
             if output_type == 'sensitivity_height':
@@ -198,7 +650,9 @@ class EM1D(Problem.BaseProblem):
 
     # make it as a property?
 
-    def sigma_cole(self):
+    def sigma_cole(
+        self, sigma=None, eta=None, tau=None, c=None, frequency=None
+    ):
         """
         Computes Pelton's Cole-Cole conductivity model
         in frequency domain.
@@ -206,193 +660,478 @@ class EM1D(Problem.BaseProblem):
         Parameter
         ---------
 
-        n_filter: int
-            the number of filter values
-        f: ndarray
-            frequency (Hz)
+        sigma, eta, tau, c: ndarray (n_layer,) or (n_sounding x n_layer),
+            optional
+            Cole-Cole parameters; the physical properties of
+            the problem are used when these are not given.
+        frequency: ndarray (n_frequency,), optional
+            Frequencies (Hz); those of the survey by default.
 
         Return
         ------
 
-        sigma_complex: ndarray (n_layer x n_frequency x n_filter)
-            Cole-Cole conductivity values at given frequencies
+        sigma_complex: ndarray (n_layer x n_frequency),
+            or (n_layer x n_frequency x n_sounding)
+            Cole-Cole conductivity values at given frequencies;
+            the kernels share these across the filter wavenumbers.
 
         """
-        n_layer = self.survey.n_layer
-        n_frequency = self.survey.n_frequency
-        n_filter = self.n_filter
-        f = self.survey.frequency
-
-        sigma = np.tile(self.sigma.reshape([-1, 1]), (1, n_frequency))
-        if np.isscalar(self.eta):
-            eta = self.eta
-            tau = self.tau
-            c = self.c
-        else:
-            eta = np.tile(self.eta.reshape([-1, 1]), (1, n_frequency))
-            tau = np.tile(self.tau.reshape([-1, 1]), (1, n_frequency))
-            c = np.tile(self.c.reshape([-1, 1]), (1, n_frequency))
-
-        w = np.tile(
-            2*np.pi*f,
-            (n_layer, 1)
-        )
-        
-        sigma_complex = np.empty([n_layer, n_frequency], dtype=np.complex128, order='F')
-        sigma_complex[:, :] = (
+        if frequency is None:
+            frequency = self.survey.frequency
+        w = 2*np.pi*frequency
+
+        if sigma is None:
+            sigma = self.sigma
+        if eta is None:
+            eta, tau, c = self.eta, self.tau, self.c
+
+        # Append the frequency axis to the Cole-Cole parameters
+        sigma, eta, tau, c = [
+            np.asarray(x, dtype=float)[..., np.newaxis]
+            for x in (sigma, eta, tau, c)
+        ]
+
+        sigma_complex = (
             sigma -
             sigma*eta/(1+(1-eta)*(1j*w*tau)**c)
         )
 
-        sigma_complex_tensor = np.empty([n_layer, n_frequency, n_filter], dtype=np.complex128, order='F')
-        sigma_complex_tensor[:, :, :] = np.tile(sigma_complex.reshape(
-            (n_layer, n_frequency, 1)), (1, 1, n_filter)
-        )
+        if sigma_complex.ndim == 3:
+            # Sounding axis goes last
+            sigma_complex = np.moveaxis(sigma_complex, 0, -1)
 
-        return sigma_complex_tensor
+        return np.asfortranarray(sigma_complex, dtype=np.complex128)
 
     @property
     def n_filter(self):
         """ Length of filter """
         return self.fhtfilt.base.size
 
-    def forward(self, m, output_type='response'):
+    def kernel_inputs(self):
         """
-            Return Bz or dBzdt
+            Offsets (or loop radius), wavenumbers, frequencies, heights,
+            susceptibility and complex conductivity of the current model,
+            as used by the Hz kernels.
         """
+        plan = self.hankel_plan()
 
-        self.model = m
+        # h is an inversion parameter
+        if self.hMap is not None:
+            h = self.h
+        else:
+            h = self.survey.h
+
+        z = h + self.survey.dz
+
+        plan.set_height(h, z)
+
+        chi = self.chi
+
+        if np.isscalar(self.chi):
+            chi = np.ones_like(self.sigma) * self.chi
+
+        sig = self.sigma_cole(frequency=plan.frequency)
+
+        return plan.r, plan.lambd, plan.f, plan.h, plan.z, chi, sig
 
+    def hankel_plan(self):
+        """
+            Hankel plan of the current geometry. The plan is cached and
+            only rebuilt when the frequencies, offsets, source or filter
+            change; kernel_inputs updates its propagation factors when the
+            height changes.
+        """
         n_frequency = self.survey.n_frequency
-        flag = self.survey.field_type
-        n_layer = self.survey.n_layer
-        depth = self.survey.depth
-        I = self.survey.I
-        n_filter = self.n_filter
 
         # Get lambd and offset, will depend on pts_per_dec
         if self.survey.src_type == "VMD":
             r = self.survey.offset
+            if r.size == 1:
+                # One offset for every frequency (EM1DSurveyTD)
+                r = r * np.ones(n_frequency)
         else:
             # a is the radius of the loop
             r = self.survey.a * np.ones(n_frequency)
 
-        # Use function from empymod
-        # size of lambd is (n_frequency x n_filter)
-        lambd = np.empty([self.survey.frequency.size, n_filter], order='F')
-        lambd[:, :], _ = get_spline_values(self.fhtfilt, r, self.hankel_pts_per_dec)
-
-        # lambd, _ = get_spline_values(self.fhtfilt, r, self.hankel_pts_per_dec)
-        
-        # TODO: potentially store
-        f = np.empty([self.survey.frequency.size, n_filter], order='F')
-        f[:,:] = np.tile(self.survey.frequency.reshape([-1, 1]), (1, n_filter))
-        # h is an inversion parameter
-        if self.hMap is not None:
-            h = self.h
+        total_loop = (
+            self.survey.src_type == 'CircularLoop' and
+            self.survey.field_type != 'secondary'
+        )
+        geometry = (
+            self.survey.src_type, total_loop, self.survey.coils,
+            self.survey.frequency.copy(), np.copy(r),
+            self.survey.I, self.survey.a,
+            self.hankel_filter, self.hankel_pts_per_dec
+        )
+
+        plan = self._hankel_plan
+        if plan is None or not plan.matches(geometry):
+            if self.verbose:
+                print (">> Build Hankel plan")
+            lambd, f, dlf_weights = self.wavenumbers(r)
+            coefficient_wavenumber, i_bessel = self.coefficient_wavenumber(
+                lambd
+            )
+            plan = HankelPlan(
+                geometry, r, lambd, f, dlf_weights,
+                coefficient_wavenumber, i_bessel, total_loop
+            )
+            self._hankel_plan = plan
+
+        return plan
+
+    def wavenumbers(self, r, frequency=None):
+        """
+            Wavenumbers at which the kernels are evaluated, and the
+            frequencies of their rows; the frequencies of the survey by
+            default, otherwise one per offset.
+
+            The standard DLF evaluates the kernels on a separate set of
+            wavenumbers for each frequency/offset pair; size of lambd is
+            (n_frequency x n_filter). The lagged convolution
+            (hankel_pts_per_dec < 0) and splined (hankel_pts_per_dec > 0)
+            DLF evaluate them once per distinct frequency, on wavenumbers
+            shared by all offsets; size of lambd is
+            (n_distinct_frequency x n_wavenumber).
+
+            Returns lambd, f and the weights of the lagged or splined DLF
+            (None for the standard DLF), kept by the plans and passed to
+            EM1D.hankel_transform.
+        """
+        if frequency is None:
+            frequency = self.survey.frequency
+
+        if self.hankel_pts_per_dec == 0:
+            lambd, _ = get_spline_values(self.fhtfilt, r, 0)
+            dlf_weights = None
         else:
-            h = self.survey.h
+            frequency, i_frequency = np.unique(frequency, return_inverse=True)
+            r_unique, i_offset = np.unique(r, return_inverse=True)
+            wavenumber, weights = get_dlf_weights(
+                self.fhtfilt, r_unique, self.hankel_pts_per_dec
+            )
+            lambd = np.tile(wavenumber, (frequency.size, 1))
+            dlf_weights = (i_frequency, i_offset, weights)
 
-        z = h + self.survey.dz
+        lambd = np.asfortranarray(lambd)
+        f = np.empty(lambd.shape, order='F')
+        f[:, :] = frequency.reshape([-1, 1])
 
-        chi = self.chi
+        return lambd, f, dlf_weights
 
-        if np.isscalar(self.chi):
-            chi = np.ones_like(self.sigma) * self.chi
+    def hankel_transform(self, PJ, lambd, r, dlf_weights=None):
+        """
+            Hankel DLF of the kernels PJ = (PJ0, PJ1, PJ0b) evaluated at
+            the wavenumbers of EM1D.wavenumbers; the filter axis is last.
+            dlf_weights are the weights of the same plan as lambd
+            (see EM1D.wavenumbers).
+            Leading axes of the kernels (layers, soundings) are kept;
+            size = (..., n_frequency)
+
+            Single precision (complex64) kernels are transformed with
+            float32 filter weights.
+        """
+        # Real precision of the kernels
+        dtype = np.finfo(
+            np.result_type(*[kernel for kernel in PJ if kernel is not None])
+        ).dtype
+        if self.hankel_pts_per_dec == 0 and dtype == np.float64:
+            return dlf(PJ, lambd, r, self.fhtfilt, self.hankel_pts_per_dec,
+                       factAng=None, ab=33)
+
+        out = 0.
+        if self.hankel_pts_per_dec == 0:
+            weights = (self.fhtfilt.j0, self.fhtfilt.j1)
+            for kernel, weight in zip(PJ[:2], weights):
+                if kernel is not None:
+                    out = out + np.dot(kernel, weight.astype(dtype))
+        else:
+            i_frequency, i_offset, weights = dlf_weights
+            for kernel, weight in zip(PJ[:2], weights):
+                if kernel is not None:
+                    out = out + np.dot(
+                        kernel, weight.T.astype(dtype, copy=False)
+                    )[..., i_frequency, i_offset]
+        return out/r.astype(dtype)
+
+    def hankel_transform_adjoint(self, w, i_bessel, r, dlf_weights=None):
+        """
+            Adjoint of EM1D.hankel_transform for a single kernel:
+            g such that sum(kernel*g) = np.dot(w, Hz); size = lambd.shape
+        """
+        if self.hankel_pts_per_dec == 0:
+            if i_bessel == 0:
+                filter_weight = self.fhtfilt.j0
+            else:
+                filter_weight = self.fhtfilt.j1
+            return (w/r).reshape([-1, 1]) * filter_weight
 
-        # TODO: potentially store
-        sig = self.sigma_cole()
+        i_frequency, i_offset, weights = dlf_weights
+        wr = np.zeros(
+            (i_frequency.max()+1, weights[i_bessel].shape[0]), dtype=complex
+        )
+        np.add.at(wr, (i_frequency, i_offset), w/r)
+        return np.dot(wr, weights[i_bessel])
 
-        if output_type == 'response':
-            # for simulation
-            if self.survey.src_type == 'VMD':
-                hz = self.hz_kernel_vertical_magnetic_dipole(
-                    lambd, f, n_layer,
-                    sig, chi, depth, h, z,
-                    flag, output_type=output_type
+    def kernel_transform(self, kernel, lambd, r, i_bessel, dlf_weights=None):
+        """
+            Hankel DLF of the Hz kernels with the Bessel function
+            i_bessel; i_bessel = None for the coil configurations
+        """
+        if i_bessel is None:
+            return self.coil_transform(kernel, lambd, r, dlf_weights)
+        PJ = [None, None, None]
+        PJ[i_bessel] = kernel
+        return self.hankel_transform(tuple(PJ), lambd, r, dlf_weights)
+
+    def kernel_transform_adjoint(
+        self, w, lambd, r, i_bessel, dlf_weights=None
+    ):
+        """
+            Adjoint of EM1D.kernel_transform; size = lambd.shape
+        """
+        if i_bessel is None:
+            coefficient = self.survey.coupling_coefficients
+            return (
+                lambd**2 * (
+                    self.hankel_transform_adjoint(
+                        coefficient[0]*w, 0, r, dlf_weights
+                    ) +
+                    self.hankel_transform_adjoint(
+                        coefficient[1]*w, 1, r, dlf_weights
+                    )
+                ) +
+                lambd * self.hankel_transform_adjoint(
+                    coefficient[2]*w, 1, r, dlf_weights
                 )
+            )
+        return self.hankel_transform_adjoint(w, i_bessel, r, dlf_weights)
 
-                # kernels for each bessel function
-                # (j0, j1, j2)
-                PJ = (hz, None, None)  # PJ0
+    def coil_transform(self, kernel, lambd, r, dlf_weights=None):
+        """
+            H of the coil configurations of EM1DSurveyFD from the kernels
+            rTE (or drTE) * exp(-u0*(z+h)). The transforms T0, T1 and T2
+            of the kernels (see Survey.dipole_coupling) are combined with
+            the coupling coefficients of each frequency, so all coils
+            share the rTE evaluation, also when the lagged DLF shares
+            wavenumbers across frequencies.
+        """
+        T0 = self.hankel_transform(
+            (kernel*lambd**2, None, None), lambd, r, dlf_weights
+        )
+        T1, T2 = self.hankel_transform(
+            (None, np.stack((kernel*lambd**2, kernel*lambd)), None), lambd, r,
+            dlf_weights
+        )
+        coefficient = self.survey.coupling_coefficients
+        return coefficient[0]*T0 + coefficient[1]*T1 + coefficient[2]*T2
 
-            elif self.survey.src_type == 'CircularLoop':
-                hz = self.hz_kernel_circular_loop(
-                    lambd, f, n_layer,
-                    sig, chi, depth, h, z, I, r,
-                    flag, output_type=output_type
-                )
+    def coefficient_wavenumber(self, lambd):
+        """
+            Wavenumber coefficient of the Hz kernels, and the index of the
+            Bessel function (0: J0, 1: J1, None: coil configurations) used
+            by the DLF
+        """
+        u0 = lambd
+        if self.survey.coils:
+            # Coil configurations transform the kernels with both Bessel
+            # functions (see EM1D.coil_transform)
+            coefficient_wavenumber = np.ones_like(lambd)
+            i_bessel = None
+        elif self.survey.src_type == 'VMD':
+            coefficient_wavenumber = 1/(4*np.pi)*lambd**3/u0
+            i_bessel = 0
+        elif self.survey.src_type == 'CircularLoop':
+            coefficient_wavenumber = (
+                self.survey.I*self.survey.a*0.5*lambd**2/u0
+            )
+            i_bessel = 1
+        else:
+            raise Exception("Src options are only VMD or CircularLoop!!")
+        return coefficient_wavenumber, i_bessel
 
-                # kernels for each bessel function
-                # (j0, j1, j2)
-                PJ = (None, hz, None)  # PJ1
-
-            # TODO: This has not implemented yet!
-            elif self.survey.src_type == "piecewise_line":
-                # Need to compute y
-                hz = self.hz_kernel_horizontal_electric_dipole(
-                    lambd, f, n_layer,
-                    sig, chi, depth, h, z, I, r,
-                    flag, output_type=output_type
-                )
-                # kernels for each bessel function
-                # (j0, j1, j2)
-                PJ = (None, hz, None)  # PJ1
+    def fused_kernels(self, lambd, f, sig, chi, h, z, sensitivity=True):
+        """
+            Hz kernels for the response, the sensitivity to conductivity
+            and the sensitivity to height, from a single pass of the
+            fused rTE kernel. The height sensitivity reuses rTE of the
+            response; without sensitivity, only rTE is evaluated and the
+            sensitivity to conductivity is None.
+        """
+        u0 = sounding_axis(lambd, sig)
+        if sensitivity:
+            rTE, drTE = self.compute_rTE_drTE(
+                f, lambd, sig, chi, self.survey.depth
+            )
+        else:
+            rTE = self.compute_rTE(f, lambd, sig, chi, self.survey.depth)
+        coefficient_wavenumber, i_bessel = self.coefficient_wavenumber(u0)
+        propagation = np.exp(-u0*(z+h))
+
+        hz_sigma = None
+        if sensitivity:
+            hz_sigma = drTE * propagation * coefficient_wavenumber
+        hz_secondary = rTE * propagation * coefficient_wavenumber
+        if (
+            self.survey.src_type == 'CircularLoop' and
+            self.survey.field_type != 'secondary'
+        ):
+            hz = hz_secondary + (
+                rTE * np.exp(u0*(z-h)) * coefficient_wavenumber
+            )
+        else:
+            hz = hz_secondary
+        # z-h is fixed by the system, only exp(-u0*(z+h)) depends on h
+        hz_height = -2*u0 * hz_secondary
 
-            else:
-                raise Exception("Src options are only VMD or CircularLoop!!")
+        return hz, hz_sigma, hz_height, i_bessel
 
-        elif output_type == 'sensitivity_sigma':
+    def forward_and_jacobian(self, m):
+        """
+            Predicted data, sensitivity to conductivity (J sigma) and
+            sensitivity to height (J height) from a single pass.
+            The rTE kernel evaluates the response and its sensitivity
+            together and one Hankel DLF transforms all kernels.
+            Fills the _pred, _Jmatrix_sigma and _Jmatrix_height caches.
+        """
+        self.model = m
 
-            # for simulation
-            if self.survey.src_type == 'VMD':
-                hz = self.hz_kernel_vertical_magnetic_dipole(
-                    lambd, f, n_layer,
-                    sig, chi, depth, h, z,
-                    flag, output_type=output_type
-                )
+        r, lambd, f, h, z, chi, sig = self.kernel_inputs()
+        plan = self._hankel_plan
+        rTE, drTE = self.compute_rTE_drTE(
+            f, lambd, sig, chi, self.survey.depth
+        )
+        hz = rTE * plan.response_factor
+        hz_sigma = drTE * plan.sensitivity_factor
+        hz_height = rTE * plan.height_factor
+
+        # HzFHT size = (n_layer+2, n_frequency)
+        HzFHT = self.kernel_transform(
+            np.concatenate(
+                (hz[np.newaxis, :, :], hz_height[np.newaxis, :, :], hz_sigma)
+            ), lambd, r, plan.i_bessel, plan.dlf_weights
+        )
 
-                PJ = (hz, None, None)  # PJ0
+        self.survey._pred = Utils.mkvc(self.survey.projectFields(HzFHT[0, :]))
+        self._pred = self.survey._pred
 
-            elif self.survey.src_type == 'CircularLoop':
+        self._Jmatrix_height = (
+            self.survey.projectFields(HzFHT[1, :])
+        ).reshape([-1, 1])
 
-                hz = self.hz_kernel_circular_loop(
-                    lambd, f, n_layer,
-                    sig, chi, depth, h, z, I, r,
-                    flag, output_type=output_type
-                )
+        self._Jmatrix_sigma = self.survey.projectFields(HzFHT[2:, :].T)
+        if self._Jmatrix_sigma.ndim == 1:
+            self._Jmatrix_sigma = self._Jmatrix_sigma.reshape([-1, 1])
 
-                PJ = (None, hz, None)  # PJ1
+        return self._pred, self._Jmatrix_sigma, self._Jmatrix_height
 
-            else:
-                raise Exception("Src options are only VMD or CircularLoop!!")
+    def forward_and_height(self, m):
+        """
+            Predicted data and sensitivity to height (J height) from a
+            single rTE evaluation; one Hankel DLF transforms both kernels.
+            Fills the _pred and _Jmatrix_height caches.
+        """
+        self.model = m
 
-            r = np.tile(r, (n_layer, 1))
+        r, lambd, f, h, z, chi, sig = self.kernel_inputs()
+        plan = self._hankel_plan
+        rTE = self.response_rTE(f, lambd, sig, chi, self.survey.depth)
 
-        elif output_type == 'sensitivity_height':
+        # HzFHT size = (2, n_frequency)
+        HzFHT = self.kernel_transform(
+            np.stack((rTE * plan.response_factor, rTE * plan.height_factor)),
+            lambd, r, plan.i_bessel, plan.dlf_weights
+        )
 
-            # for simulation
-            if self.survey.src_type == 'VMD':
-                hz = self.hz_kernel_vertical_magnetic_dipole(
-                    lambd, f, n_layer,
-                    sig, chi, depth, h, z,
-                    flag, output_type=output_type
-                )
+        self.survey._pred = Utils.mkvc(self.survey.projectFields(HzFHT[0, :]))
+        self._pred = self.survey._pred
 
-                PJ = (hz, None, None)  # PJ0
+        self._Jmatrix_height = (
+            self.survey.projectFields(HzFHT[1, :])
+        ).reshape([-1, 1])
 
-            elif self.survey.src_type == 'CircularLoop':
+        return self._pred, self._Jmatrix_height
 
-                hz = self.hz_kernel_circular_loop(
-                    lambd, f, n_layer,
-                    sig, chi, depth, h, z, I, r,
-                    flag, output_type=output_type
-                )
+    def Jvec_sigma(self, m, v):
+        """
+            Sensitivity of the data to the conductivity times a vector,
+            computed without forming the sensitivity.
+        """
+        self.model = m
+        r, lambd, f, h, z, chi, sig = self.kernel_inputs()
+        plan = self._hankel_plan
+
+        drTEv = self.compute_drTE_vec(f, lambd, sig, chi, self.survey.depth, v)
+
+        dHzv = self.kernel_transform(
+            drTEv * plan.sensitivity_factor, lambd, r, plan.i_bessel,
+            plan.dlf_weights
+        )
+
+        return Utils.mkvc(self.survey.projectFields(dHzv))
+
+    def Jtvec_sigma(self, m, v):
+        """
+            Adjoint of the sensitivity of the data to the conductivity
+            times a vector, computed without forming the sensitivity.
+        """
+        self.model = m
+        r, lambd, f, h, z, chi, sig = self.kernel_inputs()
+        plan = self._hankel_plan
+
+        # Adjoint of the projection, then of the Hankel DLF
+        w = self.survey.projectFieldsAdjoint(v)
+        g = plan.sensitivity_factor * self.kernel_transform_adjoint(
+            w, lambd, r, plan.i_bessel, plan.dlf_weights
+        )
+
+        Jtv = self.compute_drTE_tvec(f, lambd, sig, chi, self.survey.depth, g)
+
+        return Jtv.real
+
+    def forward(self, m, output_type='response'):
+        """
+            Return Bz or dBzdt
+
+            Only rTE (or drTE) depends on the model; the wavenumbers and
+            the remaining kernel factors come from the cached Hankel plan.
+
+            With precision='single' the response (rTE, Hankel DLF and, for
+            EM1DSurveyTD, the frequency to time transform) is evaluated in
+            complex64 with half the memory traffic. The rTE recursion is
+            accurate to about 1e-7, but the Hankel DLF sums terms about 1e3
+            times larger than the secondary field, so the error relative to
+            double precision, ||d_single - d_double|| / ||d_double||, is
+            about 1e-4 and stays below 1e-3. This is well below the noise of
+            field data; use it for forward screening only. Sensitivities are
+            always evaluated in double precision.
+        """
 
-                PJ = (None, hz, None)  # PJ1
+        self.model = m
+
+        depth = self.survey.depth
 
+        r, lambd, f, h, z, chi, sig = self.kernel_inputs()
+        plan = self._hankel_plan
+
+        if output_type == 'response':
+            if self.precision == 'single':
+                lambd, f, response_factor = plan.single_precision()
+                sig, chi, depth = to_single_precision(sig, chi, depth)
+                rTE = self.compute_rTE(f, lambd, sig, chi, depth)
+                hz = rTE * response_factor
             else:
-                raise Exception("Src options are only VMD or CircularLoop!!")
+                rTE = self.response_rTE(f, lambd, sig, chi, depth)
+                hz = rTE * plan.response_factor
+
+        elif output_type == 'sensitivity_sigma':
+            drTE = self.compute_drTE(f, lambd, sig, chi, depth)
+            hz = drTE * plan.sensitivity_factor
+
+        elif output_type == 'sensitivity_height':
+            # dHz/dh = -2*u0 * the secondary kernel; rTE of the response
+            rTE = self.response_rTE(f, lambd, sig, chi, depth)
+            hz = rTE * plan.height_factor
 
         # Carry out Hankel DLF
         # ab=66 => 33 (vertical magnetic src and rec)
@@ -401,14 +1140,265 @@ class EM1D(Problem.BaseProblem):
         # For sensitivity
         # HzFHT size = (n_layer, n_frequency)
 
-        HzFHT = dlf(PJ, lambd, r, self.fhtfilt, self.hankel_pts_per_dec,
-                    factAng=None, ab=33)
+        HzFHT = self.kernel_transform(
+            hz, lambd, r, plan.i_bessel, plan.dlf_weights
+        )
 
         if output_type == "sensitivity_sigma":
             return HzFHT.T
 
         return HzFHT
 
+    def forward_multiple(
+        self, sigma, h, z, chi=None, eta=None, tau=None, c=None,
+        output_type='response'
+    ):
+        """
+            Return Hz for a stack of soundings sharing the survey of this
+            problem (frequencies, offsets or loop radius, and layering).
+            Only the physical properties and the heights change between
+            soundings, so the wavenumbers of the Hankel plan are shared and
+            rTE (or drTE) of every sounding is evaluated with a single call
+            to the batched Fortran kernel.
+
+            Parameters
+            ----------
+            sigma: ndarray (n_sounding x n_layer)
+                Conductivity (S/m)
+            h: ndarray (n_sounding,)
+                Source height (m)
+            z: ndarray (n_sounding,)
+                Receiver height (m)
+            chi, eta, tau, c: ndarray (n_sounding x n_layer), optional
+                Susceptibility and Cole-Cole parameters
+
+            Returns
+            -------
+            response: (n_sounding x n_frequency)
+            sensitivity_sigma: (n_sounding x n_frequency x n_layer)
+            sensitivity_height: (n_sounding x n_frequency)
+            forward_and_jacobian: tuple of the three above, from a single
+            pass of the fused kernel
+            forward_and_height: tuple of the response and the sensitivity
+            to height, from a single rTE evaluation
+        """
+
+        sigma = np.atleast_2d(sigma)
+        n_frequency = self.survey.n_frequency
+        flag = self.survey.field_type
+        n_layer = self.survey.n_layer
+        depth = self.survey.depth
+        I = self.survey.I
+
+        # Same wavenumbers for every sounding;
+        # size of lambd is (n_frequency x n_filter)
+        plan = self.hankel_plan()
+        r, lambd, f = plan.r, plan.lambd, plan.f
+
+        if chi is None:
+            chi = np.zeros_like(sigma)
+        chi = np.asfortranarray(np.atleast_2d(chi).T, dtype=float)
+
+        # size of sig is (n_layer x n_frequency x n_sounding)
+        sig = self.sigma_cole(
+            sigma=sigma, eta=eta, tau=tau, c=c, frequency=plan.frequency
+        )
+
+        h = np.asarray(h, dtype=float)
+        z = np.asarray(z, dtype=float)
+
+        if output_type == 'response' and self.precision == 'single':
+            lambd, f, sig, chi, h, z = to_single_precision(
+                lambd, f, sig, chi, h, z
+            )
+
+        if output_type == 'forward_and_jacobian':
+            hz, hz_sigma, hz_height, i_bessel = self.fused_kernels(
+                lambd, f, sig, chi, h, z
+            )
+            hz = np.concatenate(
+                (hz[np.newaxis], hz_height[np.newaxis], hz_sigma)
+            )
+        elif output_type == 'forward_and_height':
+            hz, _, hz_height, i_bessel = self.fused_kernels(
+                lambd, f, sig, chi, h, z, sensitivity=False
+            )
+            hz = np.stack((hz, hz_height))
+        elif self.survey.src_type == 'VMD':
+            hz = self.hz_kernel_vertical_magnetic_dipole(
+                lambd, f, n_layer,
+                sig, chi, depth, h, z,
+                flag, output_type=output_type
+            )
+            i_bessel = plan.i_bessel  # PJ0, or both for coils
+        elif self.survey.src_type == 'CircularLoop':
+            hz = self.hz_kernel_circular_loop(
+                lambd, f, n_layer,
+                sig, chi, depth, h, z, I, self.survey.a,
+                flag, output_type=output_type
+            )
+            i_bessel = 1  # PJ1
+        else:
+            raise Exception("Src options are only VMD or CircularLoop!!")
+
+        # Move the sounding axis first so that the filter axis is last
+        hz = np.moveaxis(hz, -1, 0)
+
+        # HzFHT size = (n_sounding x n_frequency)
+        # or (n_sounding x n_layer x n_frequency) for sensitivity
+        HzFHT = self.kernel_transform(
+            hz, plan.lambd, r, i_bessel, plan.dlf_weights
+        )
+
+        if output_type == "sensitivity_sigma":
+            return np.swapaxes(HzFHT, 1, 2)
+        elif output_type == "forward_and_jacobian":
+            return (
+                HzFHT[:, 0, :], np.swapaxes(HzFHT[:, 2:, :], 1, 2),
+                HzFHT[:, 1, :]
+            )
+        elif output_type == "forward_and_height":
+            return HzFHT[:, 0, :], HzFHT[:, 1, :]
+
+        return HzFHT
+
+    def receiver_plan(self, rx_locations):
+        """
+            Hankel plan of the receivers of EM1D.forward_receivers; cached
+            and only rebuilt when the receivers, the source, the
+            frequencies or the filter change.
+        """
+        src_location = np.asarray(self.survey.src_location, dtype=float)
+        geometry = (
+            self.survey.frequency.copy(), np.copy(rx_locations),
+            src_location.copy(), self.hankel_filter, self.hankel_pts_per_dec
+        )
+
+        plan = self._receiver_plan
+        if plan is None or not plan.matches(geometry):
+            if self.verbose:
+                print (">> Build receiver plan")
+            n_frequency = self.survey.n_frequency
+            offset = rx_locations[:, :2] - src_location[:2]
+            r = np.sqrt((offset**2).sum(axis=1))
+            if np.any(r == 0.):
+                raise Exception("Receivers must be offset from the source")
+            r_unique, i_offset = np.unique(r, return_inverse=True)
+            dz, i_height = np.unique(
+                rx_locations[:, 2] - src_location[2], return_inverse=True
+            )
+            # One row per distinct offset and frequency
+            r_row = np.repeat(r_unique, n_frequency)
+            lambd, f, dlf_weights = self.wavenumbers(
+                r_row, frequency=np.tile(self.survey.frequency, r_unique.size)
+            )
+            i_row = (
+                i_offset.reshape([-1, 1])*n_frequency + np.arange(n_frequency)
+            )
+            plan = ReceiverPlan(
+                geometry, r_row, lambd, f, dlf_weights,
+                i_row, i_height, dz
+            )
+            self._receiver_plan = plan
+
+        return plan
+
+    def forward_receivers(
+        self, m, rx_locations, rx_components='z', src_orientation='z',
+        output_type='response'
+    ):
+        """
+            Return the secondary H of several receivers of the dipole
+            source of the survey. The receivers share the source, the layered
+            model and the frequencies of the survey, so rTE (or drTE) is
+            evaluated once for the distinct source-receiver offsets (once
+            per frequency with the lagged or splined DLF) and the fields
+            of every receiver and component come from one batched Hankel
+            DLF of each Bessel function.
+
+            The receivers move with the source when its height is
+            inverted for.
+
+            Parameters
+            ----------
+            m: model
+            rx_locations: ndarray (n_receiver x 3)
+                Receiver locations (x, y, z)
+            rx_components: str or list of str
+                Component ('x', 'y' or 'z') of each receiver, or one
+                component for all
+            src_orientation: str
+                Orientation of the source dipole ('x', 'y' or 'z')
+
+            Returns
+            -------
+            response: (n_receiver x n_frequency)
+            sensitivity_sigma: (n_receiver x n_frequency x n_layer)
+            sensitivity_height: (n_receiver x n_frequency)
+        """
+        if self.survey.src_type != 'VMD':
+            raise Exception("Multiple receivers are only available for VMD")
+
+        self.model = m
+
+        rx_locations = np.atleast_2d(np.asarray(rx_locations, dtype=float))
+        n_receiver = rx_locations.shape[0]
+        if isinstance(rx_components, str):
+            rx_components = [rx_components] * n_receiver
+        if len(rx_components) != n_receiver:
+            raise Exception("Give one component per receiver")
+        src_location = np.asarray(self.survey.src_location, dtype=float)
+        coefficient = dipole_coupling(
+            [src_orientation] * n_receiver, rx_components,
+            rx_locations[:, 0] - src_location[0],
+            rx_locations[:, 1] - src_location[1]
+        )
+
+        plan = self.receiver_plan(rx_locations)
+
+        # h is an inversion parameter
+        if self.hMap is not None:
+            plan.set_height(self.h)
+        else:
+            plan.set_height(self.survey.h)
+
+        chi = self.chi
+        if np.isscalar(self.chi):
+            chi = np.ones_like(self.sigma) * self.chi
+        sig = self.sigma_cole(frequency=plan.frequency)
+        depth = self.survey.depth
+        lambd, f = plan.lambd, plan.f
+
+        # kernel size = ([n_layer,] n_height, n_row, n_filter)
+        if output_type == 'sensitivity_sigma':
+            drTE = self.compute_drTE(f, lambd, sig, chi, depth)
+            kernel = drTE[:, np.newaxis] * plan.propagation
+        else:
+            rTE = self.compute_rTE(f, lambd, sig, chi, depth)
+            kernel = rTE * plan.propagation
+            if output_type == 'sensitivity_height':
+                kernel *= -2*lambd
+        kernel *= lambd
+
+        T0 = self.hankel_transform(
+            (kernel*lambd, None, None), lambd, plan.r, plan.dlf_weights
+        )
+        T1, T2 = self.hankel_transform(
+            (None, np.stack((kernel*lambd, kernel)), None), lambd, plan.r,
+            plan.dlf_weights
+        )
+
+        # T size = (3, [n_layer,] n_receiver, n_frequency)
+        T = np.stack((T0, T1, T2))[
+            ..., plan.i_height.reshape([-1, 1]), plan.i_row
+        ]
+        H = np.einsum('kj,k...jf->...jf', coefficient, T)
+
+        if output_type == 'sensitivity_sigma':
+            return np.moveaxis(H, 0, -1)
+
+        return H
+
     # @profile
     def fields(self, m):
         f = self.forward(m, output_type='response')
@@ -468,9 +1458,12 @@ class EM1D(Problem.BaseProblem):
             Computing Jacobian^T multiplied by vector.
         """
 
-        J_sigma = self.getJ_sigma(m, f=f)
+        if self.matrix_free:
+            Jv = self.Jvec_sigma(m, self.sigmaMap.deriv(m, v))
+        else:
+            J_sigma = self.getJ_sigma(m, f=f)
+            Jv = np.dot(J_sigma, self.sigmaMap.deriv(m, v))
         J_height = self.getJ_height(m, f=f)
-        Jv = np.dot(J_sigma, self.sigmaMap.deriv(m, v))
         if self.hMap is not None:
             Jv += np.dot(J_height, self.hMap.deriv(m, v))
         return Jv
@@ -480,9 +1473,12 @@ class EM1D(Problem.BaseProblem):
             Computing Jacobian^T multiplied by vector.
         """
 
-        J_sigma = self.getJ_sigma(m, f=f)
+        if self.matrix_free:
+            Jtv = self.sigmaDeriv.T*self.Jtvec_sigma(m, v)
+        else:
+            J_sigma = self.getJ_sigma(m, f=f)
+            Jtv = self.sigmaDeriv.T*np.dot(J_sigma.T, v)
         J_height = self.getJ_height(m, f=f)
-        Jtv = self.sigmaDeriv.T*np.dot(J_sigma.T, v)
         if self.hMap is not None:
             Jtv += self.hDeriv.T*np.dot(J_height.T, v)
         return Jtv
@@ -495,6 +1491,8 @@ class EM1D(Problem.BaseProblem):
                 toDelete += ['_Jmatrix_sigma']
             if self._Jmatrix_height is not None:
                 toDelete += ['_Jmatrix_height']
+        if self._rTE is not None:
+            toDelete += ['_rTE']
         return toDelete
 
     def depth_of_investigation_christiansen_2012(self, std, thres_hold=0.8):
@@ -48,24 +48,115 @@ def set_mesh_1d(hz):
     return Mesh.TensorMesh([hz], x0=[0])
 
 
-def run_simulation_FD(args):
+def set_problem(mesh_1d, invert_height, precision):
     """
-        args
+        EM1D problem of a sounding: the model is log(sigma), followed by
+        the height if invert_height
+    """
+    expmap = Maps.ExpMap(mesh_1d)
+    if not invert_height:
+        # Use Exponential Map
+        # This is hard-wired at the moment
+        return EM1D(
+            mesh_1d, sigmaMap=expmap, hankel_filter='key_101_2009',
+            precision=precision
+        )
+    wires = Maps.Wires(('sigma', mesh_1d.nC), ('h', 1))
+    return EM1D(
+        mesh_1d, sigmaMap=expmap * wires.sigma, hMap=wires.h,
+        hankel_filter='key_101_2009', precision=precision
+    )
 
-        rx_location: Recevier location (x, y, z)
-        src_location: Source location (x, y, z)
-        topo: Topographic location (x, y, z)
-        hz: Thickeness of the vertical layers
-        offset: Source-Receiver offset
-        frequency: Frequency (Hz)
-        field_type:
-        rx_type:
-        src_type:
-        sigma:
-        jac_switch :
+
+def set_location(prob, rx_location, src_location, topo):
+    """
+        Move the survey of a problem to the locations of another sounding
+        of the same system; the Hankel plan updates its propagation
+        factors from the new height on the next evaluation
+    """
+    prob.survey.rx_location = rx_location
+    prob.survey.src_location = src_location
+    prob.survey.topo = topo
+    return prob
+
+
+def same_static_args(args_a, args_b, skip_index=()):
+    """
+        True if two static_input_args are equal, but at skip_index
+    """
+    for i_arg, (a, b) in enumerate(zip(args_a, args_b)):
+        if i_arg in skip_index or a is b:
+            continue
+        try:
+            if not np.array_equal(a, b):
+                return False
+        except (TypeError, ValueError):
+            return False
+    return True
+
+
+def check_batch_args(args_list, skip_index):
+    """
+        Raise if the soundings of a batch do not share their arguments,
+        but at skip_index (locations, topography, physical properties and
+        height)
+    """
+    for i_sounding, args in enumerate(args_list[1:]):
+        if not same_static_args(args_list[0], args, skip_index):
+            raise Exception(
+                "Sounding {} of the batch does not share the system of the "
+                "first sounding; only the locations, the physical "
+                "properties and the height can differ".format(i_sounding+1)
+            )
+
+
+def run_simulation(
+    prob, sigma, eta, tau, c, chi, h, jac_switch, invert_height
+):
+    """
+        Outputs of jac_switch for the physical properties of a sounding,
+        from its problem paired with its survey (see set_simulation_FD
+        and set_simulation_TD). The problem only keeps its geometry
+        (Hankel plan, time transform plan) between calls, so that it
+        can be reused for the next model.
+    """
+    prob.eta = eta
+    prob.tau = tau
+    prob.c = c
+    if chi is not None:
+        prob.chi = chi
+    if not invert_height:
+        m = np.log(sigma)
+    else:
+        m = np.r_[np.log(sigma), h]
+    prob.model = m
+
+    if jac_switch == 'sensitivity_sigma':
+        output = prob.getJ_sigma(m) * Utils.sdiag(sigma)
+    elif jac_switch == 'sensitivity_height':
+        output = prob.getJ_height(m)
+    elif jac_switch == 'forward_and_jacobian':
+        resp, drespdsig, drespdh = prob.forward_and_jacobian(m)
+        output = resp, drespdsig * Utils.sdiag(sigma), drespdh
+    elif jac_switch == 'forward_and_height':
+        output = prob.forward_and_height(m)
+    else:
+        output = prob.survey.dpred(m)
+
+    # Release the model dependent caches (rTE and J)
+    for name in prob.deleteTheseOnModelUpdate:
+        delattr(prob, name)
+    return output
+
+
+def set_simulation_FD(args):
+    """
+        EM1D problem paired with the EM1DSurveyFD of the
+        run_simulation_FD arguments; depends on the model independent
+        arguments only
     """
 
-    rx_location, src_location, topo, hz, offset, frequency, field_type, rx_type, src_type, sigma, eta, tau, c, chi, h, jac_switch, invert_height, half_switch = args
+    rx_location, src_location, topo, hz, offset, frequency, field_type, rx_type, src_type, sigma, eta, tau, c, chi, h, jac_switch, invert_height, half_switch, precision, src_orientation, rx_orientation = args
     mesh_1d = set_mesh_1d(hz)
     depth = -mesh_1d.gridN[:-1]
     FDsurvey = EM1DSurveyFD(
@@ -80,51 +171,16 @@ def run_simulation_FD(args):
         depth=depth,
         half_switch=half_switch
     )
-    if not invert_height:
-        # Use Exponential Map
-        # This is hard-wired at the moment    
-        expmap = Maps.ExpMap(mesh_1d)
-        prob = EM1D(
-            mesh_1d, sigmaMap=expmap, chi=chi, hankel_filter='key_101_2009',
-            eta=eta, tau=tau, c=c
-        )
-        if prob.ispaired:
-            prob.unpair()
-        if FDsurvey.ispaired:
-            FDsurvey.unpair()
-        prob.pair(FDsurvey)
-        if jac_switch == 'sensitivity_sigma':
-            drespdsig = prob.getJ_sigma(np.log(sigma))
-            return drespdsig * prob.sigmaDeriv
-        else:
-            resp = FDsurvey.dpred(np.log(sigma))
-            return resp
-    else:
-        wires = Maps.Wires(('sigma', mesh_1d.nC),('h', 1))
-        expmap = Maps.ExpMap(mesh_1d)
-        sigmaMap = expmap * wires.sigma
-        prob = EM1D(
-            mesh_1d, sigmaMap=sigmaMap, hMap=wires.h, chi=chi, hankel_filter='key_101_2009',
-            eta=eta, tau=tau, c=c
-        )
-        if prob.ispaired:
-            prob.unpair()
-        if FDsurvey.ispaired:
-            FDsurvey.unpair()
-        prob.pair(FDsurvey)
-        m = np.r_[np.log(sigma), h]
-        if jac_switch == 'sensitivity_sigma':
-            drespdsig = prob.getJ_sigma(m)
-            return drespdsig * Utils.sdiag(sigma)
-        elif jac_switch == 'sensitivity_height':
-            drespdh = prob.getJ_height(m)
-            return drespdh
-        else:
-            resp = FDsurvey.dpred(m)
-            return resp
-        
-
-def run_simulation_TD(args):
+    if src_orientation is not None:
+        FDsurvey.src_orientation = src_orientation
+    if rx_orientation is not None:
+        FDsurvey.rx_orientation = rx_orientation
+    prob = set_problem(mesh_1d, invert_height, precision)
+    prob.pair(FDsurvey)
+    return prob
+
+
+def run_simulation_FD(args, prob=None):
     """
         args
 
@@ -132,26 +188,155 @@ def run_simulation_TD(args):
         src_location: Source location (x, y, z)
         topo: Topographic location (x, y, z)
         hz: Thickeness of the vertical layers
-        time: Time (s)
-        field_type: 'secondary'
+        offset: Source-Receiver offset
+        frequency: Frequency (Hz)
+        field_type:
         rx_type:
         src_type:
-        wave_type:
-        offset: Source-Receiver offset (for VMD)
-        a: Source-loop radius (for Circular Loop)
-        time_input_currents:
-        input_currents:
-        n_pulse:
-        base_frequency:
         sigma:
-        jac_switch:
+        jac_switch : 'forward', 'sensitivity_sigma', 'sensitivity_height'
+            or 'forward_and_jacobian' (tuple of the three from one pass)
+            or 'forward_and_height' (response and sensitivity_height from
+            one rTE evaluation)
+        precision: 'double' or 'single' (see EM1D.forward)
+        src_orientation, rx_orientation: dipole orientations of the
+            coils for each frequency (None: HCP)
+
+        prob: problem of set_simulation_FD(args) to reuse, or None
+    """
+
+    rx_location, src_location, topo, hz, offset, frequency, field_type, rx_type, src_type, sigma, eta, tau, c, chi, h, jac_switch, invert_height, half_switch, precision, src_orientation, rx_orientation = args
+    if prob is None:
+        prob = set_simulation_FD(args)
+    return run_simulation(
+        prob, sigma, eta, tau, c, chi, h, jac_switch, invert_height
+    )
+
+
+def run_simulation_FD_multiple(args_list, prob=None):
+    """
+        Batched version of run_simulation_FD.
+
+        args_list: list of run_simulation_FD arguments, one per sounding.
+        Soundings must share hz, offset, frequency, field_type, rx_type,
+        src_type, jac_switch, invert_height, half_switch, precision and
+        the coil orientations (an Exception is raised otherwise);
+        rTE (or drTE) of all soundings is computed with one kernel call
+        on the wavenumbers they share.
+        prob: problem of set_simulation_FD of one of the soundings to
+        reuse, or None
+
+        Returns a list with the output of run_simulation_FD for each sounding.
+    """
+
+    check_batch_args(args_list, (0, 1, 2, 9, 10, 11, 12, 13, 14))
+    jac_switch, invert_height = args_list[0][15:17]
+
+    rx_locations = np.vstack([args[0] for args in args_list])
+    src_locations = np.vstack([args[1] for args in args_list])
+    topo = np.vstack([args[2] for args in args_list])
+    sigma = np.vstack([args[9] for args in args_list])
+    eta = np.vstack([args[10] for args in args_list])
+    tau = np.vstack([args[11] for args in args_list])
+    c = np.vstack([args[12] for args in args_list])
+    chi = np.vstack([args[13] for args in args_list])
+
+    if invert_height:
+        h = np.array([args[14] for args in args_list], dtype=float)
+    else:
+        h = src_locations[:, 2] - topo[:, 2]
+    z = h + rx_locations[:, 2] - src_locations[:, 2]
+
+    if prob is None:
+        prob = set_simulation_FD(args_list[0])
+    FDsurvey = prob.survey
+
+    if jac_switch == 'sensitivity_sigma':
+        dudsig = prob.forward_multiple(
+            sigma, h, z, chi=chi, eta=eta, tau=tau, c=c,
+            output_type='sensitivity_sigma'
+        )
+        # Derivative with respect to log(sigma)
+        # One layer: projectFields flattens the column of each sounding
+        return [
+            FDsurvey.projectFields(dudsig[i_sounding]).reshape(
+                [-1, sigma.shape[1]]
+            ) * sigma[i_sounding, :]
+            for i_sounding in range(sigma.shape[0])
+        ]
+    elif jac_switch == 'sensitivity_height':
+        dudh = prob.forward_multiple(
+            sigma, h, z, chi=chi, eta=eta, tau=tau, c=c,
+            output_type='sensitivity_height'
+        )
+        return [
+            FDsurvey.projectFields(dudh[i_sounding]).reshape([-1, 1])
+            for i_sounding in range(sigma.shape[0])
+        ]
+    elif jac_switch == 'forward_and_height':
+        u, dudh = prob.forward_multiple(
+            sigma, h, z, chi=chi, eta=eta, tau=tau, c=c,
+            output_type='forward_and_height'
+        )
+        return [
+            (
+                Utils.mkvc(FDsurvey.projectFields(u[i_sounding])),
+                FDsurvey.projectFields(dudh[i_sounding]).reshape([-1, 1])
+            )
+            for i_sounding in range(sigma.shape[0])
+        ]
+    elif jac_switch == 'forward_and_jacobian':
+        u, dudsig, dudh = prob.forward_multiple(
+            sigma, h, z, chi=chi, eta=eta, tau=tau, c=c,
+            output_type='forward_and_jacobian'
+        )
+        return [
+            (
+                Utils.mkvc(FDsurvey.projectFields(u[i_sounding])),
+                FDsurvey.projectFields(dudsig[i_sounding]).reshape(
+                    [-1, sigma.shape[1]]
+                ) * sigma[i_sounding, :],
+                FDsurvey.projectFields(dudh[i_sounding]).reshape([-1, 1])
+            )
+            for i_sounding in range(sigma.shape[0])
+        ]
+    else:
+        u = prob.forward_multiple(
+            sigma, h, z, chi=chi, eta=eta, tau=tau, c=c,
+            output_type='response'
+        )
+        return [
+            Utils.mkvc(FDsurvey.projectFields(u[i_sounding]))
+            for i_sounding in range(sigma.shape[0])
+        ]
+
+
+def set_simulation_TD(args, transform_plans=None):
+    """
+        EM1D problem paired with the EM1DSurveyTD of the
+        run_simulation_TD arguments; depends on the model independent
+        arguments only. transform_plans: TransformPlanCache shared with
+        the surveys of other soundings, or None
     """
 
-    rx_location, src_location, topo, hz, time, field_type, rx_type, src_type, wave_type, offset, a, time_input_currents, input_currents, n_pulse, base_frequency, use_lowpass_filter, high_cut_frequency, moment_type, time_dual_moment, time_input_currents_dual_moment, input_currents_dual_moment, base_frequency_dual_moment, sigma, eta, tau, c, h, jac_switch, invert_height, half_switch = args
+    rx_location, src_location, topo, hz, time, field_type, rx_type, src_type, wave_type, offset, a, time_input_currents, input_currents, n_pulse, base_frequency, use_lowpass_filter, high_cut_frequency, moment_type, time_dual_moment, time_input_currents_dual_moment, input_currents_dual_moment, base_frequency_dual_moment, sigma, eta, tau, c, h, jac_switch, invert_height, half_switch, precision, transform_accuracy, time_gate, time_gate_dual_moment, gate_weighting, n_pulse_exact = args
 
     mesh_1d = set_mesh_1d(hz)
     depth = -mesh_1d.gridN[:-1]
 
+    # Optional transform settings are given to the constructor, which
+    # sets up the transform plan (see EM1DSurveyTD.set_frequency)
+    options = {}
+    if transform_accuracy is not None:
+        options['transform_accuracy'] = transform_accuracy
+    if time_gate is not None:
+        options['time_gate'] = time_gate
+        options['gate_weighting'] = gate_weighting
+    if time_gate_dual_moment is not None:
+        options['time_gate_dual_moment'] = time_gate_dual_moment
+    if n_pulse_exact is not None:
+        options['n_pulse_exact'] = n_pulse_exact
+
     TDsurvey = EM1DSurveyTD(
         rx_location=rx_location,
         src_location=src_location,
@@ -175,47 +360,151 @@ def run_simulation_TD(args):
         input_currents_dual_moment=input_currents_dual_moment,
         base_frequency_dual_moment=base_frequency_dual_moment,
         half_switch=half_switch,
+        transform_plans=transform_plans,
+        **options
     )
-    if not invert_height:
-        # Use Exponential Map
-        # This is hard-wired at the moment
-        expmap = Maps.ExpMap(mesh_1d)
-        prob = EM1D(
-            mesh_1d, sigmaMap=expmap, hankel_filter='key_101_2009',
-            eta=eta, tau=tau, c=c
+    prob = set_problem(mesh_1d, invert_height, precision)
+    prob.pair(TDsurvey)
+    return prob
+
+
+def run_simulation_TD(args, prob=None):
+    """
+        args
+
+        rx_location: Recevier location (x, y, z)
+        src_location: Source location (x, y, z)
+        topo: Topographic location (x, y, z)
+        hz: Thickeness of the vertical layers
+        time: Time (s)
+        field_type: 'secondary'
+        rx_type:
+        src_type:
+        wave_type:
+        offset: Source-Receiver offset (for VMD)
+        a: Source-loop radius (for Circular Loop)
+        time_input_currents:
+        input_currents:
+        n_pulse:
+        base_frequency:
+        sigma:
+        jac_switch: 'forward', 'sensitivity_sigma', 'sensitivity_height'
+            or 'forward_and_jacobian' (tuple of the three from one pass)
+            or 'forward_and_height' (response and sensitivity_height from
+            one rTE evaluation)
+        precision: 'double' or 'single' (see EM1D.forward)
+        transform_accuracy: relative accuracy of the frequency to time
+            transform (None: default sampling, see EM1DSurveyTD)
+        time_gate, time_gate_dual_moment: start and end time of the
+            gates, or None (see EM1DSurveyTD)
+        gate_weighting: 'boxcar' or 'linear_taper'
+        n_pulse_exact: pulses summed exactly, or None for every pulse
+            (see EM1DSurveyTD)
+
+        prob: problem of set_simulation_TD(args) to reuse, or None
+    """
+
+    rx_location, src_location, topo, hz, time, field_type, rx_type, src_type, wave_type, offset, a, time_input_currents, input_currents, n_pulse, base_frequency, use_lowpass_filter, high_cut_frequency, moment_type, time_dual_moment, time_input_currents_dual_moment, input_currents_dual_moment, base_frequency_dual_moment, sigma, eta, tau, c, h, jac_switch, invert_height, half_switch, precision, transform_accuracy, time_gate, time_gate_dual_moment, gate_weighting, n_pulse_exact = args
+
+    if prob is None:
+        prob = set_simulation_TD(args)
+    return run_simulation(
+        prob, sigma, eta, tau, c, None, h, jac_switch, invert_height
+    )
+
+
+def run_simulation_TD_multiple(args_list, prob=None):
+    """
+        Batched version of run_simulation_TD.
+
+        args_list: list of run_simulation_TD arguments, one per sounding.
+        Soundings must share all arguments but the locations, the
+        topography, the physical properties and the height (see
+        GlobalEM1DProblem.sounding_groups); an Exception is raised
+        otherwise. rTE (or drTE) of all soundings is computed with one
+        kernel call on the wavenumbers they share.
+        prob: problem of set_simulation_TD of one of the soundings to
+        reuse, or None
+
+        Returns a list with the output of run_simulation_TD for each sounding.
+    """
+
+    check_batch_args(args_list, (0, 1, 2, 22, 23, 24, 25, 26))
+    jac_switch, invert_height = args_list[0][27:29]
+
+    rx_locations = np.vstack([args[0] for args in args_list])
+    src_locations = np.vstack([args[1] for args in args_list])
+    topo = np.vstack([args[2] for args in args_list])
+    sigma = np.vstack([args[22] for args in args_list])
+    eta = np.vstack([args[23] for args in args_list])
+    tau = np.vstack([args[24] for args in args_list])
+    c = np.vstack([args[25] for args in args_list])
+
+    if invert_height:
+        h = np.array([args[26] for args in args_list], dtype=float)
+    else:
+        h = src_locations[:, 2] - topo[:, 2]
+    z = h + rx_locations[:, 2] - src_locations[:, 2]
+
+    if prob is None:
+        prob = set_simulation_TD(args_list[0])
+    TDsurvey = prob.survey
+
+    if jac_switch == 'sensitivity_sigma':
+        dudsig = prob.forward_multiple(
+            sigma, h, z, eta=eta, tau=tau, c=c,
+            output_type='sensitivity_sigma'
+        )
+        # Derivative with respect to log(sigma)
+        # One layer: projectFields flattens the column of each sounding
+        return [
+            TDsurvey.projectFields(dudsig[i_sounding]).reshape(
+                [-1, sigma.shape[1]]
+            ) * sigma[i_sounding, :]
+            for i_sounding in range(sigma.shape[0])
+        ]
+    elif jac_switch == 'sensitivity_height':
+        dudh = prob.forward_multiple(
+            sigma, h, z, eta=eta, tau=tau, c=c,
+            output_type='sensitivity_height'
         )
-        if prob.ispaired:
-            prob.unpair()
-        if TDsurvey.ispaired:
-            TDsurvey.unpair()
-        prob.pair(TDsurvey)
-        if jac_switch == 'sensitivity_sigma':
-            drespdsig = prob.getJ_sigma(np.log(sigma))
-            return drespdsig * prob.sigmaDeriv
-        else:
-            resp = TDsurvey.dpred(np.log(sigma))
-            return resp
+        return [
+            TDsurvey.projectFields(dudh[i_sounding]).reshape([-1, 1])
+            for i_sounding in range(sigma.shape[0])
+        ]
+    elif jac_switch == 'forward_and_height':
+        u, dudh = prob.forward_multiple(
+            sigma, h, z, eta=eta, tau=tau, c=c,
+            output_type='forward_and_height'
+        )
+        return [
+            (
+                Utils.mkvc(TDsurvey.projectFields(u[i_sounding])),
+                TDsurvey.projectFields(dudh[i_sounding]).reshape([-1, 1])
+            )
+            for i_sounding in range(sigma.shape[0])
+        ]
+    elif jac_switch == 'forward_and_jacobian':
+        u, dudsig, dudh = prob.forward_multiple(
+            sigma, h, z, eta=eta, tau=tau, c=c,
+            output_type='forward_and_jacobian'
+        )
+        return [
+            (
+                Utils.mkvc(TDsurvey.projectFields(u[i_sounding])),
+                TDsurvey.projectFields(dudsig[i_sounding]).reshape(
+                    [-1, sigma.shape[1]]
+                ) * sigma[i_sounding, :],
+                TDsurvey.projectFields(dudh[i_sounding]).reshape([-1, 1])
+            )
+            for i_sounding in range(sigma.shape[0])
+        ]
     else:
-        wires = Maps.Wires(('sigma', mesh_1d.nC),('h', 1))
-        expmap = Maps.ExpMap(mesh_1d)
-        sigmaMap = expmap * wires.sigma
-        prob = EM1D(
-            mesh_1d, sigmaMap=sigmaMap, hMap=wires.h, hankel_filter='key_101_2009',
-            eta=eta, tau=tau, c=c
+        u = prob.forward_multiple(
+            sigma, h, z, eta=eta, tau=tau, c=c,
+            output_type='response'
         )
-        if prob.ispaired:
-            prob.unpair()
-        if TDsurvey.ispaired:
-            TDsurvey.unpair()
-        prob.pair(TDsurvey)
-        m = np.r_[np.log(sigma), h]
-        if jac_switch == 'sensitivity_sigma':
-            drespdsig = prob.getJ_sigma(m)
-            return drespdsig * Utils.sdiag(sigma)
-        elif jac_switch == 'sensitivity_height':
-            drespdh = prob.getJ_height(m)
-            return drespdh
-        else:
-            resp = TDsurvey.dpred(m)
-            return resp        
-
+        return [
+            Utils.mkvc(TDsurvey.projectFields(u[i_sounding]))
+            for i_sounding in range(sigma.shape[0])
+        ]
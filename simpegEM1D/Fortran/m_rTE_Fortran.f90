@@ -1,4 +1,10 @@
 module rTE_Fortran
+!! The kernels are parallelized with OpenMP over the (frequency, filter)
+!! points, or over the soundings for the _multiple variants. Every kernel
+!! releases the GIL so that python threads can drive several calls at once.
+!! The complex conductivity is passed per frequency, sig(nLayers, nFrequencies),
+!! and is shared by every wavenumber of the filter.
+!$ use omp_lib
 
 implicit none
 
@@ -6,11 +12,26 @@ complex(kind=8), parameter :: j = complex(0.d0, 1.d0)
 real(kind=8), parameter :: pi = dacos(-1.d0)
 real(kind=8), parameter :: pi2 = 2.d0*pi
 real(kind=8), parameter :: mu0 = 4.d-7*pi ! H/m
+! Single precision constants
+complex(kind=4), parameter :: js = (0.0, 1.0)
+real(kind=4), parameter :: pi2s = real(pi2, kind=4)
+real(kind=4), parameter :: mu0s = real(mu0, kind=4)
 
 private
 
 public :: rTE_forward
 public :: rTE_sensitivity
+public :: rTE_forward_multiple
+public :: rTE_forward_single_precision
+public :: rTE_forward_single_precision_multiple
+public :: rTE_sensitivity_multiple
+public :: rTE_forward_sensitivity
+public :: rTE_forward_sensitivity_multiple
+public :: rTE_jvec
+public :: rTE_jtvec
+public :: rTE_point_sensitivity
+public :: set_num_threads
+public :: get_max_threads
 
 contains
 
@@ -25,7 +46,7 @@ subroutine rTE_forward(nLayers, nFrequencies, nFilter, frequencies, lambda, sig,
   !f2py intent(in) :: frequencies
   real(kind=8), intent(in) :: lambda(nFrequencies, nFilter)
   !f2py intent(in) :: lambda
-  complex(kind=8), intent(in) :: sig(nLayers, nFrequencies, nFilter)
+  complex(kind=8), intent(in) :: sig(nLayers, nFrequencies)
   !f2py intent(in) :: sig
   real(kind=8), intent(in) :: chi(nLayers)
   !f2py intent(in) :: chi
@@ -35,6 +56,7 @@ subroutine rTE_forward(nLayers, nFrequencies, nFilter, frequencies, lambda, sig,
   !f2py intent(in) :: halfSpace
   complex(kind=8), intent(inout) :: rTE(nFrequencies, nFilter)
   !f2py intent(in, out) :: rTE
+  !f2py threadsafe
 
   integer :: i, jj, k
   complex(kind=8) :: c, cm1, cp1
@@ -52,11 +74,12 @@ subroutine rTE_forward(nLayers, nFrequencies, nFilter, frequencies, lambda, sig,
   if (halfSpace .or. nLayers == 1) then
 
     cTmp = mu0 * (1.d0 + chi(1))
+    !$omp parallel do collapse(2) private(i, jj, omega, uTmp0, uTmp1, c, cm1, cp1)
     do jj = 1, nFilter
       do i = 1, nFrequencies
         omega = pi2 * frequencies(i, jj)
         uTmp0 = lambda(i, jj)
-        uTmp1 = sqrt(uTmp0**2.d0 + j * omega * cTmp * sig(1, i, jj))
+        uTmp1 = sqrt(uTmp0**2.d0 + j * omega * cTmp * sig(1, i))
         c = mu0 * uTmp1 / (cTmp * uTmp0)
 
         cm1 = 0.5d0 * (1.d0 - c)
@@ -65,6 +88,7 @@ subroutine rTE_forward(nLayers, nFrequencies, nFilter, frequencies, lambda, sig,
         rTE(i, jj) = cm1 / cp1
       enddo
     enddo
+    !$omp end parallel do
 
     return ! Early escape
   endif
@@ -76,6 +100,8 @@ subroutine rTE_forward(nLayers, nFrequencies, nFilter, frequencies, lambda, sig,
   enddo
   c1(nLayers) = 1.d0 + chi(nLayers)
 
+  !$omp parallel do collapse(2) private(i, jj, k, omega, tmp0, lam2, uTmp0, uTmp1, c, cm1, cp1, cTmp, h, &
+  !$omp& m0, m1, m2, m3, s0, s1, s2, s3, ss0, ss1, ss2, ss3)
   do jj = 1, nFilter
     do i = 1, nFrequencies
       omega = pi2 * frequencies(i, jj)
@@ -83,7 +109,7 @@ subroutine rTE_forward(nLayers, nFrequencies, nFilter, frequencies, lambda, sig,
       lam2 = lambda(i, jj)**2.d0
 
       ! Set up first layer
-      uTmp1 = sqrt(lam2 + j * tmp0 * c1(1) * sig(1, i, jj))
+      uTmp1 = sqrt(lam2 + j * tmp0 * c1(1) * sig(1, i))
       c = uTmp1 / (c1(1) * lambda(i, jj))
 
       s0 = 0.5d0 * (1.d0 + c)
@@ -93,8 +119,8 @@ subroutine rTE_forward(nLayers, nFrequencies, nFilter, frequencies, lambda, sig,
 
       do k = 1, nLayers - 1
         cTmp = j * tmp0
-        uTmp0 = sqrt(lam2 + cTmp * c1(k) * sig(k, i, jj))
-        uTmp1 = sqrt(lam2 + cTmp * c1(k + 1) * sig(k+1, i, jj))
+        uTmp0 = sqrt(lam2 + cTmp * c1(k) * sig(k, i))
+        uTmp1 = sqrt(lam2 + cTmp * c1(k + 1) * sig(k+1, i))
         c = (c1(k) * uTmp1) / (c1(k + 1) * uTmp0)
 
         h = thickness(k)
@@ -122,6 +148,7 @@ subroutine rTE_forward(nLayers, nFrequencies, nFilter, frequencies, lambda, sig,
       rTE(i, jj) = s2 / s3
     enddo
   enddo
+  !$omp end parallel do
 
   end subroutine
   !====================================================================!
@@ -137,7 +164,7 @@ subroutine rTE_forward(nLayers, nFrequencies, nFilter, frequencies, lambda, sig,
   !f2py intent(in) :: frequencies
   real(kind=8), intent(in) :: lambda(nFrequencies, nFilter)
   !f2py intent(in) :: lambda
-  complex(kind=8), intent(in) :: sig(nLayers, nFrequencies, nFilter)
+  complex(kind=8), intent(in) :: sig(nLayers, nFrequencies)
   !f2py intent(in) :: sig
   real(kind=8), intent(in) :: chi(nLayers)
   !f2py intent(in) :: chi
@@ -147,6 +174,7 @@ subroutine rTE_forward(nLayers, nFrequencies, nFilter, frequencies, lambda, sig,
   !f2py intent(in) :: halfSpace
   complex(kind=8), intent(inout) :: drTE(nLayers, nFrequencies, nFilter)
   !f2py intent(in, out) :: drTE
+  !f2py threadsafe
  
   real(kind=8) :: h0, h_1
   real(kind=8) :: lam, lam2
@@ -177,6 +205,7 @@ subroutine rTE_forward(nLayers, nFrequencies, nFilter, frequencies, lambda, sig,
   ! Half space model, provide early exit
   if (halfspace .or. nLayers == 1) then
     cTmp = 1.d0 + chi(1)
+    !$omp parallel do collapse(2) private(i, jj, w, lam, cTmp2, cTmp3, utemp1, const, M0sum01, M0sum11, dJ1sum11)
     do jj = 1, nFilter
       do i = 1, nFrequencies
 
@@ -186,7 +215,7 @@ subroutine rTE_forward(nLayers, nFrequencies, nFilter, frequencies, lambda, sig,
         cTmp3 = 1.d0 / (cTmp * lam)
 
         ! utemp0 = lambda
-        utemp1 = sqrt(lam**2.d0 + cTmp2 * sig(1, i, jj))
+        utemp1 = sqrt(lam**2.d0 + cTmp2 * sig(1, i))
         const = utemp1 * cTmp3
 
         ! Compute M1
@@ -200,6 +229,7 @@ subroutine rTE_forward(nLayers, nFrequencies, nFilter, frequencies, lambda, sig,
           
       enddo
     enddo
+    !$omp end parallel do
     return ! Early Exit
   endif
 
@@ -209,6 +239,8 @@ subroutine rTE_forward(nLayers, nFrequencies, nFilter, frequencies, lambda, sig,
   enddo
   c1(nLayers) = 1.d0 + chi(nLayers)
 
+  !$omp parallel do collapse(2) default(private) &
+  !$omp& shared(nLayers, nFrequencies, nFilter, frequencies, lambda, sig, thickness, c1, drTE)
   do jj = 1, nFilter
     do i = 1, nFrequencies
 
@@ -222,7 +254,7 @@ subroutine rTE_forward(nLayers, nFrequencies, nFilter, frequencies, lambda, sig,
       cTmp2 = j * w * mu0
 
       ! utemp0 = lambda
-      utemp1 = sqrt(lam2 + cTmp2 * c1t * sig(1, i, jj))
+      utemp1 = sqrt(lam2 + cTmp2 * c1t * sig(1, i))
 
       const = utemp1 * c3t
 
@@ -248,7 +280,7 @@ subroutine rTE_forward(nLayers, nFrequencies, nFilter, frequencies, lambda, sig,
       !!!!!!!!
 
       utemp0  = utemp1
-      utemp1  = sqrt(lam2 + cTmp2 * c2t * sig(2, i, jj))
+      utemp1  = sqrt(lam2 + cTmp2 * c2t * sig(2, i))
       const =  (c1t * utemp1) / (c2t * utemp0)
 
       h0 = thickness(1)
@@ -313,7 +345,7 @@ subroutine rTE_forward(nLayers, nFrequencies, nFilter, frequencies, lambda, sig,
         c2t = c1(k)
         c3t = c1(k + 1)
         utemp0  = utemp1
-        utemp1  = sqrt(lam2 + cTmp2 * c3t * sig(k + 1, i, jj))
+        utemp1  = sqrt(lam2 + cTmp2 * c3t * sig(k + 1, i))
         const =  (c2t * utemp1) / (c3t * utemp0)
 
         h0 = thickness(k)
@@ -344,7 +376,7 @@ subroutine rTE_forward(nLayers, nFrequencies, nFilter, frequencies, lambda, sig,
         dudsig = 0.5d0 * cTmp2 * c2t / utemp0
 
         h_1 = thickness(k - 1)
-        dJ_10Mtemp00 = sqrt(lam**2.0 + cTmp2 * c1t * sig(k - 1, i, jj))
+        dJ_10Mtemp00 = sqrt(lam**2.0 + cTmp2 * c1t * sig(k - 1, i))
         dJ_10Mtemp10 = c1t / (c2t * dJ_10Mtemp00)
         dJ_10Mtemp11 = exp(-2.d0 * dJ_10Mtemp00 * h_1)
 
@@ -392,7 +424,7 @@ subroutine rTE_forward(nLayers, nFrequencies, nFilter, frequencies, lambda, sig,
 
       h_1 = thickness(nLayers - 1)
 
-      dJ_10Mtemp00 = sqrt(lam2 + cTmp2 * c1t * sig(nLayers - 1, i, jj))
+      dJ_10Mtemp00 = sqrt(lam2 + cTmp2 * c1t * sig(nLayers - 1, i))
       dJ_10Mtemp11 = c1t / (c2t * dJ_10Mtemp00)
       dJ_10Mtemp01 = exp(-2.d0 * dJ_10Mtemp00 * h_1)
 
@@ -408,8 +440,8 @@ subroutine rTE_forward(nLayers, nFrequencies, nFilter, frequencies, lambda, sig,
 
       ! Second pass, Double loop
       ! k1 = 1
-      dJ1sum00 = (0.d0, 0.d0) ; dJ1sum10 = (0.d0, 0.d0)
-      dJ1sum01 = (0.d0, 0.d0) ; dJ1sum11 = (0.d0, 0.d0)
+      dJ1sum00 = dJ00(1) ; dJ1sum10 = dJ10(1)
+      dJ1sum01 = dJ01(1) ; dJ1sum11 = dJ11(1)
 
       dJ0sum00 = dJ1sum00 ; dJ0sum10 = dJ1sum10
       dJ0sum01 = dJ1sum01 ; dJ0sum11 = dJ1sum11
@@ -498,6 +530,599 @@ subroutine rTE_forward(nLayers, nFrequencies, nFilter, frequencies, lambda, sig,
       drTE(nLayers, i, jj) = (dJ1sum01 * M1sum11 - dJ1sum11 * M1sum01) * cTmp3
     enddo ! i = 1, nFrequencies
   enddo !jj = 1, nFilter
+  !$omp end parallel do
   end subroutine
   !====================================================================!
-end module
\ No newline at end of file
+
+  !====================================================================!
+  subroutine rTE_forward_multiple(nSoundings, nLayers, nFrequencies, nFilter, &
+    frequencies, lambda, sig, chi, depth, halfSpace, rTE)
+  !! Computes the TE portion for forward modelling of multiple soundings
+  !! sharing the same layering. Callable from python.
+  !! The soundings share frequencies and lambda; the last dimension of
+  !! the remaining arrays stacks the soundings.
+  !====================================================================!
+  integer, intent(in) :: nSoundings
+  integer, intent(in) :: nLayers
+  integer, intent(in) :: nFrequencies
+  integer, intent(in) :: nFilter
+  real(kind=8), intent(in) :: frequencies(nFrequencies, nFilter)
+  !f2py intent(in) :: frequencies
+  real(kind=8), intent(in) :: lambda(nFrequencies, nFilter)
+  !f2py intent(in) :: lambda
+  complex(kind=8), intent(in) :: sig(nLayers, nFrequencies, nSoundings)
+  !f2py intent(in) :: sig
+  real(kind=8), intent(in) :: chi(nLayers, nSoundings)
+  !f2py intent(in) :: chi
+  real(kind=8), intent(in) :: depth(nLayers)
+  !f2py intent(in) :: depth
+  logical, intent(in) :: halfspace
+  !f2py intent(in) :: halfSpace
+  complex(kind=8), intent(inout) :: rTE(nFrequencies, nFilter, nSoundings)
+  !f2py intent(in, out) :: rTE
+  !f2py threadsafe
+
+  integer :: iSounding
+
+  !$omp parallel do
+  do iSounding = 1, nSoundings
+    call rTE_forward(nLayers, nFrequencies, nFilter, &
+                     frequencies, lambda, &
+                     sig(:, :, iSounding), chi(:, iSounding), depth, &
+                     halfSpace, rTE(:, :, iSounding))
+  enddo
+  !$omp end parallel do
+
+  end subroutine
+  !====================================================================!
+
+!====================================================================!
+subroutine rTE_forward_single_precision(nLayers, nFrequencies, nFilter, frequencies, lambda, sig, chi, depth, halfSpace, rTE)
+  !! Single precision version of rTE_forward for fast forward modelling.
+  !! Callable from python.
+!====================================================================!
+  integer, intent(in) :: nLayers
+  integer, intent(in) :: nFrequencies
+  integer, intent(in) :: nFilter
+  real(kind=4), intent(in) :: frequencies(nFrequencies, nFilter)
+  !f2py intent(in) :: frequencies
+  real(kind=4), intent(in) :: lambda(nFrequencies, nFilter)
+  !f2py intent(in) :: lambda
+  complex(kind=4), intent(in) :: sig(nLayers, nFrequencies)
+  !f2py intent(in) :: sig
+  real(kind=4), intent(in) :: chi(nLayers)
+  !f2py intent(in) :: chi
+  real(kind=4), intent(in) :: depth(nLayers)
+  !f2py intent(in) :: depth
+  logical, intent(in) :: halfspace
+  !f2py intent(in) :: halfSpace
+  complex(kind=4), intent(inout) :: rTE(nFrequencies, nFilter)
+  !f2py intent(in, out) :: rTE
+  !f2py threadsafe
+
+  integer :: i, jj, k
+  complex(kind=4) :: c, cm1, cp1
+  complex(kind=4) :: m0, m1, m2, m3
+  complex(kind=4) :: s0, s1, s2, s3
+  complex(kind=4) :: ss0, ss1, ss2, ss3
+  real(kind=4) :: h
+  real(kind=4) :: lam2
+  real(kind=4) :: omega
+  real(kind=4) :: tmp0
+  complex(kind=4) :: uTmp0, uTmp1, cTmp
+  real(kind=4) :: thickness(nLayers - 1)
+  complex(kind=4) :: c1(nLayers)
+
+  if (halfSpace .or. nLayers == 1) then
+
+    cTmp = mu0s * (1.0 + chi(1))
+    !$omp parallel do collapse(2) private(i, jj, omega, uTmp0, uTmp1, c, cm1, cp1)
+    do jj = 1, nFilter
+      do i = 1, nFrequencies
+        omega = pi2s * frequencies(i, jj)
+        uTmp0 = lambda(i, jj)
+        uTmp1 = sqrt_sp(uTmp0**2 + js * omega * cTmp * sig(1, i))
+        c = mu0s * uTmp1 / (cTmp * uTmp0)
+
+        cm1 = 0.5 * (1.0 - c)
+        cp1 = 0.5 * (1.0 + c)
+        
+        rTE(i, jj) = cm1 / cp1
+      enddo
+    enddo
+    !$omp end parallel do
+
+    return ! Early escape
+  endif
+
+  
+  do k = 1, nLayers - 1
+    thickness(k) = -(depth(k+1) - depth(k))
+    c1(k) = 1.0 + chi(k)
+  enddo
+  c1(nLayers) = 1.0 + chi(nLayers)
+
+  !$omp parallel do collapse(2) private(i, jj, k, omega, tmp0, lam2, uTmp0, uTmp1, c, cm1, cp1, cTmp, h, &
+  !$omp& m0, m1, m2, m3, s0, s1, s2, s3, ss0, ss1, ss2, ss3)
+  do jj = 1, nFilter
+    do i = 1, nFrequencies
+      omega = pi2s * frequencies(i, jj)
+      tmp0 = omega * mu0s
+      lam2 = lambda(i, jj)**2
+
+      ! Set up first layer
+      uTmp1 = sqrt_sp(lam2 + js * tmp0 * c1(1) * sig(1, i))
+      c = uTmp1 / (c1(1) * lambda(i, jj))
+
+      s0 = 0.5 * (1.0 + c)
+      s1 = 0.5 * (1.0 - c)
+      s2 = s1
+      s3 = s0
+
+      do k = 1, nLayers - 1
+        ! u of layer k was computed at the previous layer
+        uTmp0 = uTmp1
+        uTmp1 = sqrt_sp(lam2 + js * tmp0 * c1(k + 1) * sig(k+1, i))
+        c = (c1(k) * uTmp1) / (c1(k + 1) * uTmp0)
+
+        h = thickness(k)
+
+        cTmp = exp_sp(-2.0 * uTmp0 * h)
+        cm1 = 0.5 * (1.0 - c)
+        cp1 = 0.5 * (1.0 + c)
+
+        m0 = cp1 * cTmp
+        m1 = cm1
+        m2 = cm1 * cTmp
+        m3 = cp1
+
+        ss0 = (s0 * m0) + (s2 * m1)
+        ss1 = (s1 * m0) + (s3 * m1)
+        ss2 = (s0 * m2) + (s2 * m3)
+        ss3 = (s1 * m2) + (s3 * m3)
+
+        s0 = ss0
+        s1 = ss1
+        s2 = ss2
+        s3 = ss3
+      enddo
+
+      rTE(i, jj) = s2 / s3
+    enddo
+  enddo
+  !$omp end parallel do
+
+  end subroutine
+  !====================================================================!
+
+  !====================================================================!
+  subroutine rTE_forward_single_precision_multiple(nSoundings, nLayers, nFrequencies, nFilter, &
+    frequencies, lambda, sig, chi, depth, halfSpace, rTE)
+  !! Single precision version of rTE_forward_multiple.
+  !! Computes the TE portion for forward modelling of multiple soundings
+  !! sharing the same layering. Callable from python.
+  !! The soundings share frequencies and lambda; the last dimension of
+  !! the remaining arrays stacks the soundings.
+  !====================================================================!
+  integer, intent(in) :: nSoundings
+  integer, intent(in) :: nLayers
+  integer, intent(in) :: nFrequencies
+  integer, intent(in) :: nFilter
+  real(kind=4), intent(in) :: frequencies(nFrequencies, nFilter)
+  !f2py intent(in) :: frequencies
+  real(kind=4), intent(in) :: lambda(nFrequencies, nFilter)
+  !f2py intent(in) :: lambda
+  complex(kind=4), intent(in) :: sig(nLayers, nFrequencies, nSoundings)
+  !f2py intent(in) :: sig
+  real(kind=4), intent(in) :: chi(nLayers, nSoundings)
+  !f2py intent(in) :: chi
+  real(kind=4), intent(in) :: depth(nLayers)
+  !f2py intent(in) :: depth
+  logical, intent(in) :: halfspace
+  !f2py intent(in) :: halfSpace
+  complex(kind=4), intent(inout) :: rTE(nFrequencies, nFilter, nSoundings)
+  !f2py intent(in, out) :: rTE
+  !f2py threadsafe
+
+  integer :: iSounding
+
+  !$omp parallel do
+  do iSounding = 1, nSoundings
+    call rTE_forward_single_precision(nLayers, nFrequencies, nFilter, &
+                                      frequencies, lambda, &
+                                      sig(:, :, iSounding), chi(:, iSounding), depth, &
+                                      halfSpace, rTE(:, :, iSounding))
+  enddo
+  !$omp end parallel do
+
+  end subroutine
+  !====================================================================!
+
+  !====================================================================!
+  subroutine rTE_sensitivity_multiple(nSoundings, nLayers, nFrequencies, nFilter, &
+    frequencies, lambda, sig, chi, depth, halfSpace, drTE)
+  !! Computes the sensitivity of the TE portion for multiple soundings
+  !! sharing the same layering. Callable from python.
+  !! The soundings share frequencies and lambda; the last dimension of
+  !! the remaining arrays stacks the soundings.
+  !====================================================================!
+  integer, intent(in) :: nSoundings
+  integer, intent(in) :: nLayers
+  integer, intent(in) :: nFrequencies
+  integer, intent(in) :: nFilter
+  real(kind=8), intent(in) :: frequencies(nFrequencies, nFilter)
+  !f2py intent(in) :: frequencies
+  real(kind=8), intent(in) :: lambda(nFrequencies, nFilter)
+  !f2py intent(in) :: lambda
+  complex(kind=8), intent(in) :: sig(nLayers, nFrequencies, nSoundings)
+  !f2py intent(in) :: sig
+  real(kind=8), intent(in) :: chi(nLayers, nSoundings)
+  !f2py intent(in) :: chi
+  real(kind=8), intent(in) :: depth(nLayers)
+  !f2py intent(in) :: depth
+  logical, intent(in) :: halfspace
+  !f2py intent(in) :: halfSpace
+  complex(kind=8), intent(inout) :: drTE(nLayers, nFrequencies, nFilter, nSoundings)
+  !f2py intent(in, out) :: drTE
+  !f2py threadsafe
+
+  integer :: iSounding
+
+  !$omp parallel do
+  do iSounding = 1, nSoundings
+    call rTE_sensitivity(nLayers, nFrequencies, nFilter, &
+                         frequencies, lambda, &
+                         sig(:, :, iSounding), chi(:, iSounding), depth, &
+                         halfSpace, drTE(:, :, :, iSounding))
+  enddo
+  !$omp end parallel do
+
+  end subroutine
+  !====================================================================!
+
+  !====================================================================!
+  subroutine set_num_threads(nThreads)
+  !! Sets the number of OpenMP threads used by the kernels called from the
+  !! current thread. Has no effect when compiled without OpenMP.
+  !====================================================================!
+  integer, intent(in) :: nThreads
+  !f2py intent(in) :: nThreads
+
+  !$ call omp_set_num_threads(max(nThreads, 1))
+
+  end subroutine
+  !====================================================================!
+
+  !====================================================================!
+  function get_max_threads() result(nThreads)
+  !! Returns the number of OpenMP threads the kernels will use, or 1 when
+  !! compiled without OpenMP.
+  !====================================================================!
+  integer :: nThreads
+
+  nThreads = 1
+  !$ nThreads = omp_get_max_threads()
+
+  end function
+  !====================================================================!
+
+  !====================================================================!
+  subroutine rTE_forward_sensitivity(nLayers, nFrequencies, nFilter, frequencies, lambda, sig, chi, depth, halfSpace, &
+    rTE, drTE)
+  !! Computes the TE portion and its sensitivity in a single pass over the
+  !! propagation matrices. Callable from python.
+  !====================================================================!
+  integer, intent(in) :: nLayers
+  integer, intent(in) :: nFrequencies
+  integer, intent(in) :: nFilter
+  real(kind=8), intent(in) :: frequencies(nFrequencies, nFilter)
+  !f2py intent(in) :: frequencies
+  real(kind=8), intent(in) :: lambda(nFrequencies, nFilter)
+  !f2py intent(in) :: lambda
+  complex(kind=8), intent(in) :: sig(nLayers, nFrequencies)
+  !f2py intent(in) :: sig
+  real(kind=8), intent(in) :: chi(nLayers)
+  !f2py intent(in) :: chi
+  real(kind=8), intent(in) :: depth(nLayers)
+  !f2py intent(in) :: depth
+  logical, intent(in) :: halfspace
+  !f2py intent(in) :: halfSpace
+  complex(kind=8), intent(inout) :: rTE(nFrequencies, nFilter)
+  !f2py intent(in, out) :: rTE
+  complex(kind=8), intent(inout) :: drTE(nLayers, nFrequencies, nFilter)
+  !f2py intent(in, out) :: drTE
+  !f2py threadsafe
+
+  integer :: i, jj, k, n
+  real(kind=8) :: thickness(nLayers - 1)
+  real(kind=8) :: c1(nLayers)
+
+  n = nLayers
+  if (halfSpace) n = 1
+
+  do k = 1, nLayers - 1
+    thickness(k) = -(depth(k+1) - depth(k))
+  enddo
+  c1 = 1.d0 + chi
+
+  !$omp parallel do collapse(2) private(i, jj)
+  do jj = 1, nFilter
+    do i = 1, nFrequencies
+      call rTE_point_sensitivity(n, pi2 * frequencies(i, jj), lambda(i, jj), &
+                                 sig(:, i), c1, thickness, rTE(i, jj), drTE(1:n, i, jj))
+    enddo
+  enddo
+  !$omp end parallel do
+
+  end subroutine
+  !====================================================================!
+
+  !====================================================================!
+  subroutine rTE_forward_sensitivity_multiple(nSoundings, nLayers, nFrequencies, nFilter, &
+    frequencies, lambda, sig, chi, depth, halfSpace, rTE, drTE)
+  !! Computes the TE portion and its sensitivity in a single pass for
+  !! multiple soundings sharing the same layering. Callable from python.
+  !! The soundings share frequencies and lambda; the last dimension of
+  !! the remaining arrays stacks the soundings.
+  !====================================================================!
+  integer, intent(in) :: nSoundings
+  integer, intent(in) :: nLayers
+  integer, intent(in) :: nFrequencies
+  integer, intent(in) :: nFilter
+  real(kind=8), intent(in) :: frequencies(nFrequencies, nFilter)
+  !f2py intent(in) :: frequencies
+  real(kind=8), intent(in) :: lambda(nFrequencies, nFilter)
+  !f2py intent(in) :: lambda
+  complex(kind=8), intent(in) :: sig(nLayers, nFrequencies, nSoundings)
+  !f2py intent(in) :: sig
+  real(kind=8), intent(in) :: chi(nLayers, nSoundings)
+  !f2py intent(in) :: chi
+  real(kind=8), intent(in) :: depth(nLayers)
+  !f2py intent(in) :: depth
+  logical, intent(in) :: halfspace
+  !f2py intent(in) :: halfSpace
+  complex(kind=8), intent(inout) :: rTE(nFrequencies, nFilter, nSoundings)
+  !f2py intent(in, out) :: rTE
+  complex(kind=8), intent(inout) :: drTE(nLayers, nFrequencies, nFilter, nSoundings)
+  !f2py intent(in, out) :: drTE
+  !f2py threadsafe
+
+  integer :: iSounding
+
+  !$omp parallel do
+  do iSounding = 1, nSoundings
+    call rTE_forward_sensitivity(nLayers, nFrequencies, nFilter, &
+                                 frequencies, lambda, &
+                                 sig(:, :, iSounding), chi(:, iSounding), depth, &
+                                 halfSpace, rTE(:, :, iSounding), drTE(:, :, :, iSounding))
+  enddo
+  !$omp end parallel do
+
+  end subroutine
+  !====================================================================!
+
+  !====================================================================!
+  subroutine rTE_jvec(nLayers, nFrequencies, nFilter, frequencies, lambda, sig, chi, depth, halfSpace, v, drTEv)
+  !! Computes the sensitivity of the TE portion times a vector,
+  !! drTEv = sum_k drTE(k, :, :) * v(k), without forming drTE. Callable from python.
+  !====================================================================!
+  integer, intent(in) :: nLayers
+  integer, intent(in) :: nFrequencies
+  integer, intent(in) :: nFilter
+  real(kind=8), intent(in) :: frequencies(nFrequencies, nFilter)
+  !f2py intent(in) :: frequencies
+  real(kind=8), intent(in) :: lambda(nFrequencies, nFilter)
+  !f2py intent(in) :: lambda
+  complex(kind=8), intent(in) :: sig(nLayers, nFrequencies)
+  !f2py intent(in) :: sig
+  real(kind=8), intent(in) :: chi(nLayers)
+  !f2py intent(in) :: chi
+  real(kind=8), intent(in) :: depth(nLayers)
+  !f2py intent(in) :: depth
+  logical, intent(in) :: halfspace
+  !f2py intent(in) :: halfSpace
+  complex(kind=8), intent(in) :: v(nLayers)
+  !f2py intent(in) :: v
+  complex(kind=8), intent(inout) :: drTEv(nFrequencies, nFilter)
+  !f2py intent(in, out) :: drTEv
+  !f2py threadsafe
+
+  integer :: i, jj, k, n
+  real(kind=8) :: thickness(nLayers - 1)
+  real(kind=8) :: c1(nLayers)
+  complex(kind=8) :: rTEk, drTE(nLayers)
+
+  n = nLayers
+  if (halfSpace) n = 1
+
+  do k = 1, nLayers - 1
+    thickness(k) = -(depth(k+1) - depth(k))
+  enddo
+  c1 = 1.d0 + chi
+
+  !$omp parallel do collapse(2) private(i, jj, rTEk, drTE)
+  do jj = 1, nFilter
+    do i = 1, nFrequencies
+      call rTE_point_sensitivity(n, pi2 * frequencies(i, jj), lambda(i, jj), &
+                                 sig(:, i), c1, thickness, rTEk, drTE)
+      drTEv(i, jj) = sum(drTE(1:n) * v(1:n))
+    enddo
+  enddo
+  !$omp end parallel do
+
+  end subroutine
+  !====================================================================!
+
+  !====================================================================!
+  subroutine rTE_jtvec(nLayers, nFrequencies, nFilter, frequencies, lambda, sig, chi, depth, halfSpace, g, Jtv)
+  !! Computes the adjoint of the sensitivity of the TE portion,
+  !! Jtv(k) = sum_{i, jj} drTE(k, i, jj) * g(i, jj), without forming drTE. Callable from python.
+  !====================================================================!
+  integer, intent(in) :: nLayers
+  integer, intent(in) :: nFrequencies
+  integer, intent(in) :: nFilter
+  real(kind=8), intent(in) :: frequencies(nFrequencies, nFilter)
+  !f2py intent(in) :: frequencies
+  real(kind=8), intent(in) :: lambda(nFrequencies, nFilter)
+  !f2py intent(in) :: lambda
+  complex(kind=8), intent(in) :: sig(nLayers, nFrequencies)
+  !f2py intent(in) :: sig
+  real(kind=8), intent(in) :: chi(nLayers)
+  !f2py intent(in) :: chi
+  real(kind=8), intent(in) :: depth(nLayers)
+  !f2py intent(in) :: depth
+  logical, intent(in) :: halfspace
+  !f2py intent(in) :: halfSpace
+  complex(kind=8), intent(in) :: g(nFrequencies, nFilter)
+  !f2py intent(in) :: g
+  complex(kind=8), intent(inout) :: Jtv(nLayers)
+  !f2py intent(in, out) :: Jtv
+  !f2py threadsafe
+
+  integer :: i, jj, k, n
+  real(kind=8) :: thickness(nLayers - 1)
+  real(kind=8) :: c1(nLayers)
+  complex(kind=8) :: rTEk, drTE(nLayers)
+
+  n = nLayers
+  if (halfSpace) n = 1
+
+  do k = 1, nLayers - 1
+    thickness(k) = -(depth(k+1) - depth(k))
+  enddo
+  c1 = 1.d0 + chi
+
+  Jtv = (0.d0, 0.d0)
+
+  !$omp parallel do collapse(2) private(i, jj, rTEk, drTE) reduction(+:Jtv)
+  do jj = 1, nFilter
+    do i = 1, nFrequencies
+      call rTE_point_sensitivity(n, pi2 * frequencies(i, jj), lambda(i, jj), &
+                                 sig(:, i), c1, thickness, rTEk, drTE)
+      Jtv(1:n) = Jtv(1:n) + drTE(1:n) * g(i, jj)
+    enddo
+  enddo
+  !$omp end parallel do
+
+  end subroutine
+  !====================================================================!
+
+  !====================================================================!
+  subroutine rTE_point_sensitivity(nLayers, omega, lam, sig, c1, thickness, rTE, drTE)
+  !! TE portion and its sensitivity to the conductivity of every layer at a
+  !! single (frequency, wavenumber) point. Prefix and suffix products of the
+  !! propagation matrices keep the cost linear in the number of layers.
+  !! Callable from python.
+  !====================================================================!
+  integer, intent(in) :: nLayers
+  real(kind=8), intent(in) :: omega
+  real(kind=8), intent(in) :: lam
+  complex(kind=8), intent(in) :: sig(nLayers)
+  real(kind=8), intent(in) :: c1(nLayers)
+  real(kind=8), intent(in) :: thickness(nLayers - 1)
+  complex(kind=8), intent(out) :: rTE
+  complex(kind=8), intent(out) :: drTE(nLayers)
+
+  complex(kind=8) :: u(nLayers), dudsig(nLayers)
+  complex(kind=8) :: M(2, 2, nLayers), q(2, nLayers)
+  complex(kind=8) :: P(2, 2), S(2, 2), dM0(2, 2), dM1(2, 2), dJ(2, 2), dS(2)
+  complex(kind=8) :: c, e, a, b
+  integer :: k
+
+  do k = 1, nLayers
+    u(k) = sqrt(lam**2.d0 + j * omega * mu0 * c1(k) * sig(k))
+    dudsig(k) = 0.5d0 * j * omega * mu0 * c1(k) / u(k)
+  enddo
+
+  ! Propagation matrices, M(:, :, k) depends on u(k - 1) and u(k)
+  c = u(1) / (c1(1) * lam)
+  M(1, 1, 1) = 0.5d0 * (1.d0 + c) ; M(1, 2, 1) = 0.5d0 * (1.d0 - c)
+  M(2, 1, 1) = 0.5d0 * (1.d0 - c) ; M(2, 2, 1) = 0.5d0 * (1.d0 + c)
+  S = M(:, :, 1)
+
+  do k = 2, nLayers
+    c = (c1(k - 1) * u(k)) / (c1(k) * u(k - 1))
+    e = exp(-2.d0 * u(k - 1) * thickness(k - 1))
+    M(1, 1, k) = 0.5d0 * (1.d0 + c) * e ; M(1, 2, k) = 0.5d0 * (1.d0 - c) * e
+    M(2, 1, k) = 0.5d0 * (1.d0 - c)     ; M(2, 2, k) = 0.5d0 * (1.d0 + c)
+    S = matmul(S, M(:, :, k))
+  enddo
+  rTE = S(1, 2) / S(2, 2)
+
+  ! Suffix products, q(:, k) = M(:, :, k + 2) ... M(:, :, nLayers) * [0, 1]
+  q(1, nLayers) = (0.d0, 0.d0) ; q(2, nLayers) = (1.d0, 0.d0)
+  if (nLayers > 1) q(:, nLayers - 1) = q(:, nLayers)
+  do k = nLayers - 2, 1, -1
+    q(:, k) = matmul(M(:, :, k + 2), q(:, k + 1))
+  enddo
+
+  ! Prefix products, P = M(:, :, 1) ... M(:, :, k - 1)
+  P(1, 1) = (1.d0, 0.d0) ; P(1, 2) = (0.d0, 0.d0)
+  P(2, 1) = (0.d0, 0.d0) ; P(2, 2) = (1.d0, 0.d0)
+
+  do k = 1, nLayers
+    ! dM(k)/du(k)
+    a = 0.5d0 * (M(1, 1, k) - M(1, 2, k)) / u(k)
+    b = 0.5d0 * (M(2, 2, k) - M(2, 1, k)) / u(k)
+    dM0(1, 1) = a  ; dM0(1, 2) = -a
+    dM0(2, 1) = -b ; dM0(2, 2) = b
+
+    if (k < nLayers) then
+      ! dM(k + 1)/du(k)
+      a = 0.5d0 * (M(1, 1, k + 1) - M(1, 2, k + 1)) / u(k)
+      b = 0.5d0 * (M(2, 2, k + 1) - M(2, 1, k + 1)) / u(k)
+      dM1(1, 1) = -a - 2.d0 * thickness(k) * M(1, 1, k + 1)
+      dM1(1, 2) =  a - 2.d0 * thickness(k) * M(1, 2, k + 1)
+      dM1(2, 1) =  b
+      dM1(2, 2) = -b
+      dJ = matmul(dM0, M(:, :, k + 1)) + matmul(M(:, :, k), dM1)
+    else
+      dJ = dM0
+    endif
+
+    dS = dudsig(k) * matmul(P, matmul(dJ, q(:, k)))
+    drTE(k) = (dS(1) * S(2, 2) - S(1, 2) * dS(2)) / S(2, 2)**2.d0
+
+    P = matmul(P, M(:, :, k))
+  enddo
+
+  end subroutine
+  !====================================================================!
+  !====================================================================!
+  elemental function sqrt_sp(z) result(w)
+  !! Principal square root of a single precision complex number. Faster
+  !! than the intrinsic, which is slower in single than in double precision.
+  !====================================================================!
+  complex(kind=4), intent(in) :: z
+  complex(kind=4) :: w
+  real(kind=4) :: a, b, t
+
+  a = real(z)
+  b = aimag(z)
+  t = sqrt(0.5 * (sqrt(a * a + b * b) + abs(a)))
+  if (t == 0.0) then
+    w = (0.0, 0.0)
+  else if (a >= 0.0) then
+    w = cmplx(t, 0.5 * b / t, kind=4)
+  else
+    w = cmplx(0.5 * abs(b) / t, sign(t, b), kind=4)
+  endif
+
+  end function
+  !====================================================================!
+
+  !====================================================================!
+  elemental function exp_sp(z) result(w)
+  !! Exponential of a single precision complex number, see sqrt_sp.
+  !====================================================================!
+  complex(kind=4), intent(in) :: z
+  complex(kind=4) :: w
+  real(kind=4) :: r
+
+  r = exp(real(z))
+  w = cmplx(r * cos(aimag(z)), r * sin(aimag(z)), kind=4)
+
+  end function
+  !====================================================================!
+
+end module
@@ -7,11 +7,23 @@ else:
     PARALLEL = True
     import multiprocessing
 
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    # Python < 3.8: outputs are pickled back from the workers
+    shared_memory = None
+
+import time
+import weakref
 import numpy as np
 import scipy.sparse as sp
 from SimPEG import Problem, Props, Utils, Maps, Survey
-from .Survey import EM1DSurveyFD, EM1DSurveyTD
-from .EM1DSimulation import run_simulation_FD, run_simulation_TD
+from .Survey import EM1DSurveyFD, EM1DSurveyTD, TransformPlanCache
+from .EM1DSimulation import (
+    run_simulation_FD, run_simulation_TD, run_simulation_FD_multiple,
+    run_simulation_TD_multiple, set_simulation_FD, set_simulation_TD,
+    set_location, same_static_args
+)
 import properties
 import warnings
 
@@ -20,6 +32,266 @@ def dot(args):
     return np.dot(args[0], args[1])
 
 
+# Outputs of run_simulation for each jac_switch: predicted data ('pred')
+# and sensitivity blocks ('J_sigma', 'J_height')
+SOUNDING_OUTPUTS = {
+    'forward': ('pred',),
+    'forward_and_height': ('pred', 'J_height'),
+    'forward_and_jacobian': ('pred', 'J_sigma', 'J_height'),
+    'sensitivity_sigma': ('J_sigma',),
+    'sensitivity_height': ('J_height',)
+}
+
+
+class SharedSoundingBuffers(object):
+    """
+        Shared memory buffers of the predicted data and the sensitivity
+        blocks of all soundings, laid out by data_index: the rows of
+        sounding i start at data_index[i][0], with one value per row for
+        'pred' and 'J_height' and n_layer values per row for 'J_sigma'
+        (the CSR data of the block diagonal J). The workers write their
+        outputs in place (see run_chunk).
+    """
+
+    def __init__(self, data_index, n_layer, invert_height):
+        self.n_layer = n_layer
+        self.start = np.array([index[0] for index in data_index], dtype=int)
+        self.size = np.array([index.size for index in data_index], dtype=int)
+        self.nD = int(self.size.sum())
+        self.width = {'pred': 1, 'J_sigma': n_layer}
+        if invert_height:
+            self.width['J_height'] = 1
+        self.shared_memory = {}
+        self.arrays = {}
+        for name, width in self.width.items():
+            shm = shared_memory.SharedMemory(
+                create=True, size=self.nD*width*8
+            )
+            self.shared_memory[name] = shm
+            self.arrays[name] = np.ndarray(
+                self.nD*width, dtype=float, buffer=shm.buf
+            )
+        # Sounding of each row
+        self.row_sounding = np.repeat(np.arange(self.start.size), self.size)
+
+    @property
+    def layout(self):
+        """
+            Names and widths of the buffers and rows of the soundings,
+            sent to the workers (see init_worker)
+        """
+        return {
+            'names': {
+                name: (shm.name, self.width[name])
+                for name, shm in self.shared_memory.items()
+            },
+            'start': self.start,
+            'size': self.size
+        }
+
+    def gather(self, name, blocks=False):
+        """
+            Copy of an output of all soundings: the predicted data, or
+            the block diagonal sensitivity as a CSR matrix (a list of the
+            blocks if blocks is True)
+        """
+        values = self.arrays[name].copy()
+        width = self.width[name]
+        if name == 'pred':
+            return values
+        if blocks:
+            return [
+                values[start*width:(start+size)*width].reshape((size, width))
+                for start, size in zip(self.start, self.size)
+            ]
+        n_sounding = self.start.size
+        indices = (
+            self.row_sounding.reshape([-1, 1])*width + np.arange(width)
+        ).flatten()
+        indptr = np.arange(self.nD+1)*width
+        return sp.csr_matrix(
+            (values, indices, indptr), shape=(self.nD, n_sounding*width)
+        )
+
+    def close(self):
+        """
+            Release the shared memory
+        """
+        self.arrays = {}
+        for shm in self.shared_memory.values():
+            shm.close()
+            shm.unlink()
+        self.shared_memory = {}
+
+
+def release_pool(pool, sounding_buffers=None):
+    """
+        Terminate a worker pool and release its output buffers; called by
+        GlobalEM1DProblem.shutdown, or when the problem is garbage
+        collected
+    """
+    pool.terminate()
+    pool.join()
+    if sounding_buffers is not None:
+        sounding_buffers.close()
+
+
+# Static data of the soundings in a worker process (see init_worker)
+_worker = {}
+
+
+def init_worker(simulation_function, static_args, model_args_index,
+                jac_switch_index, buffer_layout=None,
+                simulation_function_multiple=None,
+                simulations=None):
+    """
+        Keep the simulation functions and the model independent input
+        arguments of every sounding in the worker process, and attach
+        the output buffers (see SharedSoundingBuffers); sent once when
+        the pool is created. The problems of the soundings are kept in
+        simulations (see SimulationCache and get_simulation), or built
+        on every call if None.
+    """
+    _worker['simulation_function'] = simulation_function
+    _worker['simulation_function_multiple'] = simulation_function_multiple
+    _worker['simulations'] = simulations
+    _worker['static_args'] = static_args
+    _worker['model_args_index'] = model_args_index
+    _worker['jac_switch_index'] = jac_switch_index
+    _worker['buffers'] = {}
+    if buffer_layout is not None:
+        _worker['start'] = buffer_layout['start']
+        _worker['size'] = buffer_layout['size']
+        for name, (shm_name, width) in buffer_layout['names'].items():
+            shm = shared_memory.SharedMemory(name=shm_name)
+            _worker['buffers'][name] = (
+                shm, np.ndarray(shm.size//8, dtype=float, buffer=shm.buf),
+                width
+            )
+
+
+def set_sounding_args(
+    static_args, model_args_index, model_args, jac_switch_index, jac_switch
+):
+    """
+        Input arguments of run_simulation of a sounding from its model
+        independent arguments, its model arguments and jac_switch
+    """
+    args = list(static_args)
+    for i_arg, value in zip(model_args_index, model_args):
+        args[i_arg] = value
+    args[jac_switch_index] = jac_switch
+    return tuple(args)
+
+
+class SimulationCache(object):
+    """
+        Problems paired with their survey (set_simulation_function),
+        shared by the soundings of the same system: the soundings whose
+        input arguments only differ at skip_index (locations, model and
+        jac_switch) use the same problem, moved to their locations
+        (set_location). At most n_simulation problems are kept; the least
+        recently used one is dropped first. simulation_kwargs are passed
+        to set_simulation_function, e.g. the TransformPlanCache shared by
+        the TD surveys.
+    """
+
+    def __init__(
+        self, set_simulation_function, location_index, skip_index,
+        n_simulation=8, simulation_kwargs=None
+    ):
+        self.set_simulation_function = set_simulation_function
+        self.simulation_kwargs = simulation_kwargs or {}
+        self.location_index = location_index
+        self.skip_index = skip_index
+        self.n_simulation = n_simulation
+        # (args, problem), most recently used first
+        self.simulations = []
+
+    def get(self, args):
+        """
+            Problem of a sounding, at its locations
+        """
+        for i_simulation, (args_prob, prob) in enumerate(self.simulations):
+            if same_static_args(args_prob, args, self.skip_index):
+                if i_simulation > 0:
+                    self.simulations.insert(
+                        0, self.simulations.pop(i_simulation)
+                    )
+                return set_location(
+                    prob, *[args[i_arg] for i_arg in self.location_index]
+                )
+        prob = self.set_simulation_function(args, **self.simulation_kwargs)
+        self.simulations.insert(0, (args, prob))
+        del self.simulations[self.n_simulation:]
+        return prob
+
+
+def get_simulation(args):
+    """
+        Problem of a sounding from the SimulationCache of the worker;
+        None without one
+    """
+    if _worker['simulations'] is None:
+        return None
+    return _worker['simulations'].get(args)
+
+
+def run_chunk(task):
+    """
+        Simulate a chunk of soundings in a worker process from a task
+        (i_soundings, jac_switch, model_args of each sounding) and the
+        static data of init_worker. The soundings of a chunk share
+        their static arguments but the locations, so that
+        simulation_function_multiple evaluates them with one kernel
+        call; single soundings use simulation_function. The problems are
+        reused across soundings of the same system and across models
+        (see SimulationCache).
+    """
+    i_soundings, jac_switch, model_args_list = task
+    args_list = [
+        set_sounding_args(
+            _worker['static_args'][i_sounding], _worker['model_args_index'],
+            model_args, _worker['jac_switch_index'], jac_switch
+        ) for i_sounding, model_args in zip(i_soundings, model_args_list)
+    ]
+    if (
+        len(args_list) > 1 and
+        _worker['simulation_function_multiple'] is not None
+    ):
+        output = _worker['simulation_function_multiple'](
+            args_list, get_simulation(args_list[0])
+        )
+    else:
+        output = [
+            _worker['simulation_function'](args, get_simulation(args))
+            for args in args_list
+        ]
+    if not _worker['buffers']:
+        return output
+
+    # Write the outputs in the shared buffers instead of returning them
+    for i_sounding, output_sounding in zip(i_soundings, output):
+        if len(SOUNDING_OUTPUTS[jac_switch]) == 1:
+            output_sounding = (output_sounding,)
+        start = _worker['start'][i_sounding]
+        size = _worker['size'][i_sounding]
+        for name, value in zip(SOUNDING_OUTPUTS[jac_switch], output_sounding):
+            if name in _worker['buffers']:
+                _, array, width = _worker['buffers'][name]
+                value = np.asarray(value).flatten()
+                # Outputs of another size (e.g. dual moment data) would
+                # overwrite the rows of the next sounding
+                if value.size != size*width:
+                    raise Exception(
+                        "%s of sounding %i has %i values, %i expected "
+                        "from data_index" % (
+                            name, i_sounding, value.size, size*width
+                        )
+                    )
+                array[start*width:(start+size)*width] = value
+
+
 class GlobalEM1DProblem(Problem.BaseProblem):
     """
         The GlobalProblem allows you to run a whole bunch of SubProblems,
@@ -52,14 +324,35 @@ class GlobalEM1DProblem(Problem.BaseProblem):
 
     _Jmatrix_sigma = None
     _Jmatrix_height = None
+    _pool = None
+    _pool_survey = None
+    _pool_finalizer = None
+    _sounding_buffers = None
     run_simulation = None
+    _sounding_groups = None
+    simulation_function = None
+    simulation_function_multiple = None
+    set_simulation_function = None
+    model_args_index = ()
+    jac_switch_index = None
+    location_args_index = (0, 1, 2)
+    run_simulation_multiple = None
     n_cpu = None
+    chunk_size = None       # soundings per task; None sizes it from the cost
+    chunk_cost = 4000       # data x layers of an automatically sized chunk
+    n_chunk_per_cpu = 4     # least number of chunks per cpu (load balance)
+    n_simulation = 8        # problems kept per process (see SimulationCache)
+    _simulations = None
     hz = None
     parallel = False
+    batch_soundings = False
+    fused_jacobian = False
+    fused_height = False    # forward also fills J height (see forward)
     parallel_jvec_jtvec = False
     verbose = False
     fix_Jmatrix = False    
     invert_height = None
+    precision = 'double'    # 'single': complex64 forward (see EM1D.forward)
 
     def __init__(self, mesh, **kwargs):
         Utils.setKwargs(self, **kwargs)
@@ -76,11 +369,273 @@ class GlobalEM1DProblem(Problem.BaseProblem):
             print (">> Serial version is used")
         if self.hz is None:
             raise Exception("Input vertical thickness hz !")
+        if self.batch_soundings and self.run_simulation_multiple is None:
+            raise Exception(
+                "batch_soundings is not available for %s" %
+                self.__class__.__name__
+            )
         if self.hMap is None:
             self.invert_height = False
         else:
             self.invert_height = True
 
+    @property
+    def pool(self):
+        """
+            Worker pool of the parallel simulations; created on first use
+            and reused by fields, forward and getJ until shutdown. The
+            model independent input arguments of the soundings
+            (static_args) are sent once, when the pool is created, and
+            the workers keep one problem per system (see
+            SimulationCache), so that a model update only sends the
+            model. The pool is
+            recreated for a new survey; call shutdown after changing the
+            survey in place. The pool is also terminated when the problem
+            is garbage collected.
+        """
+        if self._pool is not None and self._pool_survey is not self.survey:
+            self.shutdown()
+        if self._pool is None:
+            static_args = self.static_args()
+            self._sounding_groups = self.sounding_groups(static_args)
+            buffer_layout = None
+            if shared_memory is not None:
+                self._sounding_buffers = SharedSoundingBuffers(
+                    self.data_index, self.n_layer, self.hMap is not None
+                )
+                buffer_layout = self._sounding_buffers.layout
+            self._pool = Pool(
+                self.n_cpu, initializer=init_worker,
+                initargs=(
+                    self.simulation_function, static_args,
+                    self.model_args_index, self.jac_switch_index,
+                    buffer_layout, self.simulation_function_multiple,
+                    self.simulation_cache()
+                )
+            )
+            self._pool_survey = self.survey
+            self._pool_finalizer = weakref.finalize(
+                self, release_pool, self._pool, self._sounding_buffers
+            )
+        return self._pool
+
+    def simulation_cache(self):
+        """
+            New SimulationCache of the soundings; None without
+            set_simulation_function
+        """
+        if self.set_simulation_function is None:
+            return None
+        skip_index = (
+            self.location_args_index + self.model_args_index +
+            (self.jac_switch_index,)
+        )
+        return SimulationCache(
+            self.set_simulation_function, self.location_args_index,
+            skip_index, self.n_simulation, self.simulation_kwargs()
+        )
+
+    def simulation_kwargs(self):
+        """
+            Keyword arguments of set_simulation_function, shared by the
+            problems of a SimulationCache
+        """
+        return {}
+
+    def get_simulation(self, args):
+        """
+            Problem of a sounding for the serial simulations, from the
+            SimulationCache of the problem (see simulation_cache)
+        """
+        if self._simulations is None:
+            self._simulations = self.simulation_cache()
+        if self._simulations is None:
+            return None
+        return self._simulations.get(args)
+
+    def input_args(self, i_sounding, jac_switch='forward'):
+        """
+            Input arguments of run_simulation for a sounding
+        """
+        return set_sounding_args(
+            self.static_input_args(i_sounding), self.model_args_index,
+            self.model_input_args(i_sounding), self.jac_switch_index,
+            jac_switch
+        )
+
+    def static_input_args(self, i_sounding):
+        """
+            input_args of a sounding that do not depend on the model;
+            None at model_args_index and jac_switch_index
+        """
+        raise NotImplementedError(
+            "{} must override static_input_args (see GlobalEM1DProblemFD "
+            "and GlobalEM1DProblemTD)".format(type(self).__name__)
+        )
+
+    def model_input_args(self, i_sounding):
+        """
+            input_args of a sounding at model_args_index
+        """
+        raise NotImplementedError(
+            "{} must override model_input_args (see GlobalEM1DProblemFD "
+            "and GlobalEM1DProblemTD)".format(type(self).__name__)
+        )
+
+    def static_args(self):
+        """
+            static_input_args of every sounding
+        """
+        return [self.static_input_args(i) for i in range(self.n_sounding)]
+
+    def sounding_groups(self, static_args=None):
+        """
+            Runs of consecutive soundings whose static_input_args only
+            differ by the locations (location_args_index); the soundings
+            of a run can be simulated together by run_simulation_multiple
+        """
+        if static_args is None:
+            static_args = self.static_args()
+        groups = [[0]]
+        for i_sounding in range(1, self.n_sounding):
+            if same_static_args(
+                static_args[groups[-1][0]], static_args[i_sounding],
+                self.location_args_index
+            ):
+                groups[-1].append(i_sounding)
+            else:
+                groups.append([i_sounding])
+        return groups
+
+    def get_chunk_size(self):
+        """
+            Number of soundings of a task of the worker pool: chunk_size,
+            or enough soundings for chunk_cost (number of data times
+            number of layers) while keeping n_chunk_per_cpu chunks per
+            cpu to balance the load
+        """
+        if self.chunk_size is not None:
+            return max(1, int(self.chunk_size))
+        n_cpu = 1 if self.n_cpu is None else self.n_cpu
+        cost = np.mean([index.size for index in self.data_index])*self.n_layer
+        chunk_size = int(np.ceil(self.chunk_cost/max(cost, 1.)))
+        n_max = max(1, self.n_sounding // (self.n_chunk_per_cpu*n_cpu))
+        return min(max(chunk_size, 1), n_max)
+
+    def get_chunks(self, groups=None):
+        """
+            Soundings of each task: the sounding_groups split in runs of
+            get_chunk_size soundings
+        """
+        if groups is None:
+            groups = self.sounding_groups()
+        chunk_size = self.get_chunk_size()
+        return [
+            group[i:i+chunk_size]
+            for group in groups for i in range(0, len(group), chunk_size)
+        ]
+
+    def chunk_task(self, i_soundings, jac_switch):
+        """
+            Message sent to the workers for a chunk of soundings: their
+            indices, jac_switch and their model arguments (see run_chunk)
+        """
+        return (
+            list(i_soundings), jac_switch,
+            [self.model_input_args(i) for i in i_soundings]
+        )
+
+    def run_simulation_batches(self, jac_switch):
+        """
+            Outputs of every sounding from run_simulation_multiple,
+            called once per sounding_groups
+        """
+        result = []
+        for group in self.sounding_groups():
+            result += self.run_simulation_multiple(
+                [self.input_args(i, jac_switch=jac_switch) for i in group]
+            )
+        return result
+
+    def map_soundings(self, jac_switch):
+        """
+            Outputs of every sounding computed by the worker pool; a dict
+            with the predicted data ('pred') and the block diagonal
+            sensitivities ('J_sigma', 'J_height', lists of the blocks if
+            parallel_jvec_jtvec) of jac_switch. The workers write them in
+            the shared buffers (see SharedSoundingBuffers); without shared
+            memory they are pickled back and stacked.
+        """
+        names = [
+            name for name in SOUNDING_OUTPUTS[jac_switch]
+            if name != 'J_height' or self.hMap is not None
+        ]
+        pool = self.pool
+        chunks = self.get_chunks(self._sounding_groups)
+        t_start = time.time()
+        result = pool.map(
+            run_chunk,
+            [self.chunk_task(chunk, jac_switch) for chunk in chunks]
+        )
+        if self.verbose:
+            print (
+                ">> %i soundings in %i chunks (chunk_size: %i): %.2e s" % (
+                    self.n_sounding, len(chunks), self.get_chunk_size(),
+                    time.time()-t_start
+                )
+            )
+        if self._sounding_buffers is None:
+            result = [output for outputs in result for output in outputs]
+        outputs = {}
+        for i_output, name in enumerate(SOUNDING_OUTPUTS[jac_switch]):
+            if name not in names:
+                continue
+            if self._sounding_buffers is not None:
+                outputs[name] = self._sounding_buffers.gather(
+                    name, blocks=self.parallel_jvec_jtvec
+                )
+                if name == 'pred' and self.precision == 'single':
+                    outputs[name] = outputs[name].astype(np.float32)
+                continue
+            if len(SOUNDING_OUTPUTS[jac_switch]) > 1:
+                values = [output[i_output] for output in result]
+            else:
+                values = result
+            if name == 'pred':
+                outputs[name] = np.hstack(values)
+            elif self.parallel_jvec_jtvec:
+                outputs[name] = values
+            else:
+                outputs[name] = sp.block_diag(values).tocsr()
+        return outputs
+
+    def shutdown(self):
+        """
+            Close the worker pool (see pool); a new pool is created if
+            the problem is used again
+        """
+        if self._pool_finalizer is not None:
+            self._pool_finalizer()
+            self._pool_finalizer = None
+        self._pool = None
+        self._sounding_buffers = None
+        self._sounding_groups = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
+
+    def __getstate__(self):
+        # Pools and their shared memory can not be pickled or copied
+        state = self.__dict__.copy()
+        state.pop('_pool', None)
+        state.pop('_pool_finalizer', None)
+        state.pop('_sounding_buffers', None)
+        state.pop('_simulations', None)
+        return state
+
     @property
     def n_layer(self):
         return self.hz.size
@@ -201,27 +756,86 @@ class GlobalEM1DProblem(Problem.BaseProblem):
         self.survey._pred = self.forward(m)
         return []
 
+    def forward_and_jacobian(self, m):
+        """
+            Compute the response, d F / d sigma and d F / d height of
+            every sounding from a single pass, and fill the
+            _pred, _Jmatrix_sigma and _Jmatrix_height caches.
+        """
+        self.model = m
+
+        if self.verbose:
+            print (">> Compute response and J")
+
+        if self.batch_soundings:
+            result = self.run_simulation_batches('forward_and_jacobian')
+        elif self.parallel:
+            outputs = self.map_soundings('forward_and_jacobian')
+            self.survey._pred = outputs['pred']
+            self._Jmatrix_sigma = outputs['J_sigma']
+            if self.hMap is not None:
+                self._Jmatrix_height = outputs['J_height']
+            return self.survey._pred
+        else:
+            result = [
+                self.run_simulation(self.input_args(i, jac_switch='forward_and_jacobian')) for i in range(self.n_sounding)
+            ]
+
+        self.survey._pred = np.hstack([output[0] for output in result])
+
+        self._Jmatrix_sigma = [output[1] for output in result]
+        if self.hMap is not None:
+            self._Jmatrix_height = [output[2] for output in result]
+
+        # _Jmatrix_sigma is block diagnoal matrix (sparse)
+        self._Jmatrix_sigma = sp.block_diag(self._Jmatrix_sigma).tocsr()
+        if self.hMap is not None:
+            self._Jmatrix_height = sp.block_diag(
+                self._Jmatrix_height
+            ).tocsr()
+
+        return self.survey._pred
+
     def forward(self, m):
+        """
+            Compute the response of every sounding. With fused_height,
+            when the height is inverted, d F / d height comes from the
+            same rTE evaluation and fills the _Jmatrix_height cache; this
+            only pays off when J is requested at every model, since line
+            search models drop it unused.
+        """
         self.model = m
 
         if self.verbose:
             print (">> Compute response")
 
-        if self.parallel:
-            pool = Pool(self.n_cpu)
+        if (
+            self.fused_height and self.hMap is not None and
+            self._Jmatrix_height is None and self.precision == 'double'
+        ):
+            jac_switch = 'forward_and_height'
+        else:
+            jac_switch = 'forward'
+
+        if self.batch_soundings:
+            result = self.run_simulation_batches(jac_switch)
+        elif self.parallel:
             # This assumes the same # of layer for each of soundings
-            result = pool.map(
-                self.run_simulation,
-                [
-                    self.input_args(i, jac_switch='forward') for i in range(self.n_sounding)
-                ]
-            )
-            pool.close()
-            pool.join()
+            outputs = self.map_soundings(jac_switch)
+            if jac_switch == 'forward_and_height':
+                self._Jmatrix_height = outputs['J_height']
+            return outputs['pred']
         else:
             result = [
-                self.run_simulation(self.input_args(i, jac_switch='forward')) for i in range(self.n_sounding)
+                self.run_simulation(self.input_args(i, jac_switch=jac_switch)) for i in range(self.n_sounding)
             ]
+
+        if jac_switch == 'forward_and_height':
+            self._Jmatrix_height = sp.block_diag(
+                [output[1] for output in result]
+            ).tocsr()
+            result = [output[0] for output in result]
+
         return np.hstack(result)
 
     def getJ_sigma(self, m):
@@ -230,21 +844,22 @@ class GlobalEM1DProblem(Problem.BaseProblem):
         """
         if self._Jmatrix_sigma is not None:
             return self._Jmatrix_sigma
+        if self.fused_jacobian:
+            # J sigma and J height from one pass, for the model of the
+            # first J request only (not for every fields call)
+            self.forward_and_jacobian(m)
+            return self._Jmatrix_sigma
         if self.verbose:
             print (">> Compute J sigma")
         self.model = m
-        if self.parallel:
-            pool = Pool(self.n_cpu)
-            self._Jmatrix_sigma = pool.map(
-                self.run_simulation,
-                [
-                    self.input_args(i, jac_switch='sensitivity_sigma') for i in range(self.n_sounding)
-                ]
-            )
-            pool.close()
-            pool.join()
-            if self.parallel_jvec_jtvec is False:
-                self._Jmatrix_sigma = sp.block_diag(self._Jmatrix_sigma).tocsr()
+        if self.batch_soundings:
+            self._Jmatrix_sigma = sp.block_diag(
+                self.run_simulation_batches('sensitivity_sigma')
+            ).tocsr()
+        elif self.parallel:
+            self._Jmatrix_sigma = self.map_soundings(
+                'sensitivity_sigma'
+            )['J_sigma']
         else:
             # _Jmatrix_sigma is block diagnoal matrix (sparse)
             self._Jmatrix_sigma = sp.block_diag(
@@ -263,23 +878,22 @@ class GlobalEM1DProblem(Problem.BaseProblem):
 
         if self._Jmatrix_height is not None:
             return self._Jmatrix_height
+        if self.fused_jacobian:
+            self.forward_and_jacobian(m)
+            return self._Jmatrix_height
         if self.verbose:
             print (">> Compute J height")
         
         self.model = m
 
-        if self.parallel:
-            pool = Pool(self.n_cpu)
-            self._Jmatrix_height = pool.map(
-                self.run_simulation,
-                [
-                    self.input_args(i, jac_switch="sensitivity_height") for i in range(self.n_sounding)
-                ]
-            )
-            pool.close()
-            pool.join()
-            if self.parallel_jvec_jtvec is False:
-                self._Jmatrix_height = sp.block_diag(self._Jmatrix_height).tocsr()
+        if self.batch_soundings:
+            self._Jmatrix_height = sp.block_diag(
+                self.run_simulation_batches('sensitivity_height')
+            ).tocsr()
+        elif self.parallel:
+            self._Jmatrix_height = self.map_soundings(
+                'sensitivity_height'
+            )['J_height']
         else:            
             self._Jmatrix_height = sp.block_diag(
                 [
@@ -370,9 +984,23 @@ class GlobalEM1DProblem(Problem.BaseProblem):
 
 
 class GlobalEM1DProblemFD(GlobalEM1DProblem):
-    
+
+    # Sent to the workers by reference (see init_worker)
+    simulation_function = staticmethod(run_simulation_FD)
+    simulation_function_multiple = staticmethod(run_simulation_FD_multiple)
+    set_simulation_function = staticmethod(set_simulation_FD)
+
+    # Positions of Sigma, Eta, Tau, C, Chi, H and jac_switch in input_args
+    model_args_index = (9, 10, 11, 12, 13, 14)
+    jac_switch_index = 15
+
     def run_simulation(self, args):
-        return run_simulation_FD(args)
+        return run_simulation_FD(args, self.get_simulation(args))
+
+    def run_simulation_multiple(self, args_list):
+        return run_simulation_FD_multiple(
+            args_list, self.get_simulation(args_list[0])
+        )
 
     @property
     def frequency(self):
@@ -382,28 +1010,56 @@ class GlobalEM1DProblemFD(GlobalEM1DProblem):
     def switch_real_imag(self):
         return self.survey.switch_real_imag
 
-    def input_args(self, i_sounding, jac_switch='forward'):
+    @property
+    def src_orientation(self):
+        return self.survey.src_orientation
+
+    @property
+    def rx_orientation(self):
+        return self.survey.rx_orientation
+
+    def static_input_args(self, i_sounding):
         output = (
             self.rx_locations[i_sounding, :],
             self.src_locations[i_sounding, :],
             self.topo[i_sounding, :], self.hz,
             self.offset, self.frequency,
             self.field_type, self.rx_type, self.src_type,
+            None, None, None, None, None, None, None,
+            self.invert_height,
+            self.half_switch,
+            self.precision,
+            self.src_orientation,
+            self.rx_orientation
+        )
+        return output
+
+    def model_input_args(self, i_sounding):
+        return (
             self.Sigma[i_sounding, :],
             self.Eta[i_sounding, :],
             self.Tau[i_sounding, :],
-            self.C[i_sounding, :],                                    
+            self.C[i_sounding, :],
             self.Chi[i_sounding, :],
-            self.H[i_sounding],
-            jac_switch,
-            self.invert_height,
-            self.half_switch
+            self.H[i_sounding]
         )
-        return output 
 
 
 class GlobalEM1DProblemTD(GlobalEM1DProblem):
 
+    # Sent to the workers by reference (see init_worker)
+    simulation_function = staticmethod(run_simulation_TD)
+    simulation_function_multiple = staticmethod(run_simulation_TD_multiple)
+    set_simulation_function = staticmethod(set_simulation_TD)
+
+    # Positions of Sigma, Eta, Tau, C, H and jac_switch in input_args
+    model_args_index = (22, 23, 24, 25, 26)
+    jac_switch_index = 27
+
+    def simulation_kwargs(self):
+        # The surveys of the soundings share their transform plans
+        return {'transform_plans': TransformPlanCache()}
+
     @property
     def wave_type(self):
         return self.survey.wave_type
@@ -456,7 +1112,27 @@ class GlobalEM1DProblemTD(GlobalEM1DProblem):
     def base_frequency_dual_moment(self):
         return self.survey.base_frequency_dual_moment
 
-    def input_args(self, i_sounding, jac_switch='forward'):
+    @property
+    def transform_accuracy(self):
+        return self.survey.transform_accuracy
+
+    @property
+    def time_gate(self):
+        return self.survey.time_gate
+
+    @property
+    def time_gate_dual_moment(self):
+        return self.survey.time_gate_dual_moment
+
+    @property
+    def gate_weighting(self):
+        return self.survey.gate_weighting
+
+    @property
+    def n_pulse_exact(self):
+        return self.survey.n_pulse_exact
+
+    def static_input_args(self, i_sounding):
         output = (
             self.rx_locations[i_sounding, :],
             self.src_locations[i_sounding, :],
@@ -480,19 +1156,34 @@ class GlobalEM1DProblemTD(GlobalEM1DProblem):
             self.time_input_currents_dual_moment[i_sounding],
             self.input_currents_dual_moment[i_sounding],
             self.base_frequency_dual_moment[i_sounding],
+            None, None, None, None, None, None,
+            self.invert_height,
+            self.half_switch,
+            self.precision,
+            self.transform_accuracy,
+            self.time_gate[i_sounding],
+            self.time_gate_dual_moment[i_sounding],
+            self.gate_weighting,
+            self.n_pulse_exact
+        )
+        return output
+
+    def model_input_args(self, i_sounding):
+        return (
             self.Sigma[i_sounding, :],
             self.Eta[i_sounding, :],
             self.Tau[i_sounding, :],
             self.C[i_sounding, :],
-            self.H[i_sounding],                                                
-            jac_switch,
-            self.invert_height,
-            self.half_switch            
+            self.H[i_sounding]
         )
-        return output
 
     def run_simulation(self, args):
-        return run_simulation_TD(args)
+        return run_simulation_TD(args, self.get_simulation(args))
+
+    def run_simulation_multiple(self, args_list):
+        return run_simulation_TD_multiple(
+            args_list, self.get_simulation(args_list[0])
+        )
 
     # def forward(self, m, f=None):
     #     self.model = m
@@ -607,6 +1298,17 @@ class GlobalEM1DSurveyFD(GlobalEM1DSurvey, EM1DSurveyFD):
         ):
             return int(self.n_frequency) * self.n_sounding
 
+    @property
+    def data_index(self):
+        # Same # of data for each of soundings
+        if getattr(self, '_data_index', None) is None:
+            n_data = self.nD // self.n_sounding
+            self._data_index = [
+                np.arange(n_data)+i_sounding*n_data
+                for i_sounding in range(self.n_sounding)
+            ]
+        return self._data_index
+
     def read_xyz_data(self, fname):
         """
         Read csv file format
@@ -681,6 +1383,30 @@ class GlobalEM1DSurveyTD(GlobalEM1DSurvey):
         dtype=float, default=None
     )
 
+    transform_accuracy = properties.Float(
+        "Relative accuracy of the frequency to time transform of every "
+        "sounding (see EM1DSurveyTD.transform_accuracy)"
+    )
+
+    # Start and end time of the gates of each sounding, (n_time x 2);
+    # None samples the responses at the time channels
+    time_gate = []
+
+    time_gate_dual_moment = []
+
+    gate_weighting = properties.StringChoice(
+        "Weighting of the responses over the time gates of every sounding "
+        "(see EM1DSurveyTD.gate_weighting)",
+        default="boxcar",
+        choices=["boxcar", "linear_taper"]
+    )
+
+    n_pulse_exact = properties.Integer(
+        "Number of pulses of the train of every sounding summed exactly "
+        "(see EM1DSurveyTD.n_pulse_exact)",
+        min=1
+    )
+
     def __init__(self, **kwargs):
         GlobalEM1DSurvey.__init__(self, **kwargs)
         self.set_parameters()
@@ -700,19 +1426,19 @@ class GlobalEM1DSurveyTD(GlobalEM1DSurvey):
             ) * 30
 
         if self.offset is None:
-            self.offset = np.empty((self.n_sounding, 1), dtype=float)
+            self.offset = np.zeros((self.n_sounding, 1), dtype=float)
 
         if self.I is None:
-            self.I = np.empty(self.n_sounding, dtype=float)
+            self.I = np.zeros(self.n_sounding, dtype=float)
 
         if self.a is None:
-            self.a = np.empty(self.n_sounding, dtype=float)
+            self.a = np.zeros(self.n_sounding, dtype=float)
 
         if self.use_lowpass_filter is None:
             self.use_lowpass_filter = np.zeros(self.n_sounding, dtype=bool)
 
         if self.high_cut_frequency is None:
-            self.high_cut_frequency = np.empty(self.n_sounding, dtype=float)
+            self.high_cut_frequency = np.zeros(self.n_sounding, dtype=float)
 
         if self.moment_type is None:
             self.moment_type = np.array(["single"], dtype=str).repeat(
@@ -722,35 +1448,44 @@ class GlobalEM1DSurveyTD(GlobalEM1DSurvey):
         # List
         if not self.time_input_currents:
             self.time_input_currents = [
-                np.empty(1, dtype=float) for i in range(self.n_sounding)
+                np.zeros(1, dtype=float) for i in range(self.n_sounding)
             ]
         # List
         if not self.input_currents:
             self.input_currents = [
-                np.empty(1, dtype=float) for i in range(self.n_sounding)
+                np.zeros(1, dtype=float) for i in range(self.n_sounding)
             ]
 
         # List
         if not self.time_dual_moment:
             self.time_dual_moment = [
-                np.empty(1, dtype=float) for i in range(self.n_sounding)
+                np.zeros(1, dtype=float) for i in range(self.n_sounding)
             ]
         # List
         if not self.time_input_currents_dual_moment:
             self.time_input_currents_dual_moment = [
-                np.empty(1, dtype=float) for i in range(self.n_sounding)
+                np.zeros(1, dtype=float) for i in range(self.n_sounding)
             ]
         # List
         if not self.input_currents_dual_moment:
             self.input_currents_dual_moment = [
-                np.empty(1, dtype=float) for i in range(self.n_sounding)
+                np.zeros(1, dtype=float) for i in range(self.n_sounding)
             ]
 
         if self.base_frequency_dual_moment is None:
-            self.base_frequency_dual_moment = np.empty(
+            self.base_frequency_dual_moment = np.zeros(
                 (self.n_sounding), dtype=float
             )
 
+        # List
+        if not self.time_gate:
+            self.time_gate = [None for i in range(self.n_sounding)]
+        # List
+        if not self.time_gate_dual_moment:
+            self.time_gate_dual_moment = [
+                None for i in range(self.n_sounding)
+            ]
+
     @property
     def nD_vec(self):
         # Need to generalize this for the dual moment data
@@ -49,6 +49,23 @@ class KnownSystems(properties.HasProperties):
     def __init__(self, name):
         self.name = name
 
+    @property
+    def time_gate(self):
+        """
+            Start and end time of the windows, (n_window x 2); see
+            EM1DSurveyTD.time_gate
+        """
+        return np.c_[self.WindowTimeStart, self.WindowTimeEnd]
+
+    @property
+    def gate_weighting(self):
+        """
+            EM1DSurveyTD.gate_weighting of the window weighting scheme
+        """
+        return {
+            "Boxcar": "boxcar", "LinearTaper": "linear_taper"
+        }[self.WindowWeightingScheme]
+
     def save(self, fname=None):
         data = self.serialize()
         if fname is None:
@@ -0,0 +1,209 @@
+import numpy as np
+from scipy.constants import mu_0
+
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+    prange = range
+
+
+def jit(**kwargs):
+    """
+        numba.njit when numba is installed; otherwise the functions
+        below run as plain (slow) python.
+    """
+    if njit is None:
+        return lambda fun: fun
+    return njit(**kwargs)
+
+
+@jit(cache=True)
+def rTE_point(n_layer, omega, lamda, sig, c1, thick, sensitivity, drTE):
+    """
+        Reflection coefficient for Transverse Electric (TE) mode at a
+        single (frequency, wavenumber) point. When `sensitivity` is True,
+        its derivative with respect to the conductivity of each layer is
+        written to drTE[:n_layer]; prefix and suffix products of the
+        propagation matrices keep the cost linear in n_layer.
+
+        Parameters
+        ----------
+        n_layer : int
+            The number layers
+        omega : float
+            Angular frequency (rad/s)
+        lamda : float
+            Wavenumber (1/m)
+        sig: complex, ndarray
+            Conductivity (S/m); size = (n_layer,)
+        c1: float, ndarray
+            1 + susceptibility (SI); size = (n_layer,)
+        thick: float, ndarray
+            Layer thicknesses (m); size = (n_layer-1,)
+
+        Returns
+        -------
+        rTE: complex
+            Reflection coefficient
+    """
+    u = np.empty(n_layer, dtype=np.complex128)
+    for k in range(n_layer):
+        u[k] = np.sqrt(lamda**2 + 1j*omega*mu_0*c1[k]*sig[k])
+
+    # Propagation matrices, M[k] depends on u[k-1] and u[k]
+    M00 = np.empty(n_layer, dtype=np.complex128)
+    M01 = np.empty(n_layer, dtype=np.complex128)
+    M10 = np.empty(n_layer, dtype=np.complex128)
+    M11 = np.empty(n_layer, dtype=np.complex128)
+
+    c = u[0]/(c1[0]*lamda)
+    M00[0] = 0.5*(1.+c)
+    M01[0] = 0.5*(1.-c)
+    M10[0] = 0.5*(1.-c)
+    M11[0] = 0.5*(1.+c)
+    S00, S01, S10, S11 = M00[0], M01[0], M10[0], M11[0]
+
+    for k in range(1, n_layer):
+        c = c1[k-1]*u[k]/(c1[k]*u[k-1])
+        e = np.exp(-2.*u[k-1]*thick[k-1])
+        M00[k] = 0.5*(1.+c)*e
+        M01[k] = 0.5*(1.-c)*e
+        M10[k] = 0.5*(1.-c)
+        M11[k] = 0.5*(1.+c)
+        S00, S01, S10, S11 = (
+            S00*M00[k] + S01*M10[k], S00*M01[k] + S01*M11[k],
+            S10*M00[k] + S11*M10[k], S10*M01[k] + S11*M11[k]
+        )
+
+    rTE = S01/S11
+    if not sensitivity:
+        return rTE
+
+    # Suffix products, q[k] = M[k+2] ... M[n_layer-1] * [0, 1]
+    q0 = np.zeros(n_layer, dtype=np.complex128)
+    q1 = np.ones(n_layer, dtype=np.complex128)
+    for k in range(n_layer-3, -1, -1):
+        q0[k] = M00[k+2]*q0[k+1] + M01[k+2]*q1[k+1]
+        q1[k] = M10[k+2]*q0[k+1] + M11[k+2]*q1[k+1]
+
+    # Prefix products, P = M[0] ... M[k-1]
+    P00, P01, P10, P11 = 1.+0j, 0j, 0j, 1.+0j
+
+    for k in range(n_layer):
+        # dM[k]/du[k]
+        a = 0.5*(M00[k]-M01[k])/u[k]
+        b = 0.5*(M11[k]-M10[k])/u[k]
+        dJ00, dJ01, dJ10, dJ11 = a, -a, -b, b
+
+        if k < n_layer-1:
+            # dM[k+1]/du[k]
+            a = 0.5*(M00[k+1]-M01[k+1])/u[k]
+            b = 0.5*(M11[k+1]-M10[k+1])/u[k]
+            d00 = -a - 2.*thick[k]*M00[k+1]
+            d01 = a - 2.*thick[k]*M01[k+1]
+            d10 = b
+            d11 = -b
+            dJ00, dJ01, dJ10, dJ11 = (
+                dJ00*M00[k+1] + dJ01*M10[k+1] + M00[k]*d00 + M01[k]*d10,
+                dJ00*M01[k+1] + dJ01*M11[k+1] + M00[k]*d01 + M01[k]*d11,
+                dJ10*M00[k+1] + dJ11*M10[k+1] + M10[k]*d00 + M11[k]*d10,
+                dJ10*M01[k+1] + dJ11*M11[k+1] + M10[k]*d01 + M11[k]*d11
+            )
+
+        t0 = dJ00*q0[k] + dJ01*q1[k]
+        t1 = dJ10*q0[k] + dJ11*q1[k]
+        dudsig = 0.5j*omega*mu_0*c1[k]/u[k]
+        dS0 = dudsig*(P00*t0 + P01*t1)
+        dS1 = dudsig*(P10*t0 + P11*t1)
+        drTE[k] = (dS0*S11 - S01*dS1)/S11**2
+
+        P00, P01, P10, P11 = (
+            P00*M00[k] + P01*M10[k], P00*M01[k] + P01*M11[k],
+            P10*M00[k] + P11*M10[k], P10*M01[k] + P11*M11[k]
+        )
+
+    return rTE
+
+
+@jit(cache=True, parallel=True)
+def rTEfunfwd(f, lamda, sig, chi, depth, HalfSwitch, rTE):
+    """
+        Reflection coefficients; size of rTE = (n_frequency x n_filter)
+    """
+    n_layer = sig.shape[0]
+    n_frequency, n_filter = lamda.shape
+    n = 1 if HalfSwitch else n_layer
+    c1 = 1. + chi
+    thick = depth[:-1] - depth[1:]
+    for i in prange(n_frequency):
+        drTE = np.empty(0, dtype=np.complex128)
+        for j in range(n_filter):
+            rTE[i, j] = rTE_point(
+                n, 2*np.pi*f[i, j], lamda[i, j], sig[:, i], c1, thick,
+                False, drTE
+            )
+
+
+@jit(cache=True, parallel=True)
+def rTEfunjac(f, lamda, sig, chi, depth, HalfSwitch, rTE, drTE):
+    """
+        Reflection coefficients and their sensitivity;
+        size of drTE = (n_layer x n_frequency x n_filter)
+    """
+    n_layer = sig.shape[0]
+    n_frequency, n_filter = lamda.shape
+    n = 1 if HalfSwitch else n_layer
+    c1 = 1. + chi
+    thick = depth[:-1] - depth[1:]
+    for i in prange(n_frequency):
+        drTE_point = np.zeros(n_layer, dtype=np.complex128)
+        for j in range(n_filter):
+            rTE[i, j] = rTE_point(
+                n, 2*np.pi*f[i, j], lamda[i, j], sig[:, i], c1, thick,
+                True, drTE_point
+            )
+            drTE[:, i, j] = drTE_point
+
+
+@jit(cache=True, parallel=True)
+def rTEfunjvec(f, lamda, sig, chi, depth, HalfSwitch, v, drTEv):
+    """
+        sum_k drTE[k, :, :]*v[k]; size of drTEv = (n_frequency x n_filter)
+    """
+    n_layer = sig.shape[0]
+    n_frequency, n_filter = lamda.shape
+    n = 1 if HalfSwitch else n_layer
+    c1 = 1. + chi
+    thick = depth[:-1] - depth[1:]
+    for i in prange(n_frequency):
+        drTE = np.zeros(n_layer, dtype=np.complex128)
+        for j in range(n_filter):
+            rTE_point(
+                n, 2*np.pi*f[i, j], lamda[i, j], sig[:, i], c1, thick,
+                True, drTE
+            )
+            drTEv[i, j] = np.sum(drTE*v)
+
+
+@jit(cache=True, parallel=True)
+def rTEfunjtvec(f, lamda, sig, chi, depth, HalfSwitch, g, Jtv):
+    """
+        sum_{i, j} drTE[:, i, j]*g[i, j]; size of Jtv = (n_layer,)
+    """
+    n_layer = sig.shape[0]
+    n_frequency, n_filter = lamda.shape
+    n = 1 if HalfSwitch else n_layer
+    c1 = 1. + chi
+    thick = depth[:-1] - depth[1:]
+    Jtv_frequency = np.zeros((n_frequency, n_layer), dtype=np.complex128)
+    for i in prange(n_frequency):
+        drTE = np.zeros(n_layer, dtype=np.complex128)
+        for j in range(n_filter):
+            rTE_point(
+                n, 2*np.pi*f[i, j], lamda[i, j], sig[:, i], c1, thick,
+                True, drTE
+            )
+            Jtv_frequency[i, :] += drTE*g[i, j]
+    for i in range(n_frequency):
+        Jtv += Jtv_frequency[i, :]
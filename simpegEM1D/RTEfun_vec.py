@@ -17,7 +17,7 @@ def rTEfunfwd(n_layer, f, lamda, sig, chi, depth, HalfSwitch):
         lamda : complex, ndarray
             Frequency (Hz); size = (n_frequency x n_filter)
         sig: compelx, ndarray
-            Conductivity (S/m); size = (n_layer x n_frequency x n_filter)
+            Conductivity (S/m); size = (n_layer x n_frequency)
         chi: compelx, ndarray
             Susceptibility (SI); size = (n_layer,)
         depth: float, ndarray
@@ -33,6 +33,9 @@ def rTEfunfwd(n_layer, f, lamda, sig, chi, depth, HalfSwitch):
     """
 
     n_frequency, n_filter = lamda.shape
+    if sig.ndim == 2:
+        # Same conductivity for every wavenumber
+        sig = sig[:, :, np.newaxis]
 
     Mtemp00 = np.zeros((n_frequency, n_filter), dtype=complex)
     Mtemp10 = np.zeros((n_frequency, n_filter), dtype=complex)
@@ -144,7 +147,7 @@ def rTEfunjac(n_layer, f, lamda, sig, chi, depth, HalfSwitch):
         lamda : complex, ndarray
             Frequency (Hz); size = (n_frequency x n_finlter)
         sig: compelx, ndarray
-            Conductivity (S/m); size = (n_layer x 1)
+            Conductivity (S/m); size = (n_layer x n_frequency)
         chi: compelx, ndarray
             Susceptibility (SI); size = (n_layer x 1)
         depth: float, ndarray
@@ -160,6 +163,9 @@ def rTEfunjac(n_layer, f, lamda, sig, chi, depth, HalfSwitch):
     """
     # Initializing arrays
     n_frequency, n_filter = lamda.shape
+    if sig.ndim == 2:
+        # Same conductivity for every wavenumber
+        sig = sig[:, :, np.newaxis]
 
     Mtemp00 = np.zeros((n_frequency, n_filter), dtype=complex)
     Mtemp10 = np.zeros((n_frequency, n_filter), dtype=complex)
@@ -372,7 +378,7 @@ def rTEfunjac(n_layer, f, lamda, sig, chi, depth, HalfSwitch):
         dJ1sum01 = dudsig*dj0Mtemp01
         dJ1sum11 = dudsig*dj0Mtemp11
 
-        drTE = dJ1sum01/M1sum11 - M1sum01/(M1sum11**2)*dJ1sum11
+        drTE[0, :, :] = dJ1sum01/M1sum11 - M1sum01/(M1sum11**2)*dJ1sum11
 
     else:
 
@@ -418,6 +424,11 @@ def rTEfunjac(n_layer, f, lamda, sig, chi, depth, HalfSwitch):
 
             if i == 0:
 
+                dJ1sum00 = dJ00[i]
+                dJ1sum10 = dJ10[i]
+                dJ1sum01 = dJ01[i]
+                dJ1sum11 = dJ11[i]
+
                 for j in range(n_layer-2):
 
                     if j == 0:
@@ -508,3 +519,202 @@ def rTEfunjac(n_layer, f, lamda, sig, chi, depth, HalfSwitch):
     # Still worthwhile to output both?
     # return rTE, drTE
 
+
+
+def drTEfun_frequency(n_layer, w, lamda, sig, chi, depth, HalfSwitch):
+    """
+        Sensitivity of reflection coefficients at a single frequency.
+        Prefix and suffix products of the propagation matrices keep the
+        cost linear in the number of layers.
+
+        Parameters
+        ----------
+        n_layer : int
+            The number layers
+        w : float
+            Angular frequency (rad/s)
+        lamda : float, ndarray
+            Wavenumber (1/m); size = (n_filter,)
+        sig: compelx, ndarray
+            Conductivity (S/m); size = (n_layer x 1)
+        chi: compelx, ndarray
+            Susceptibility (SI); size = (n_layer,)
+        depth: float, ndarray
+            Top boundary of the layers; size = (n_layer,)
+        HalfSwitch: bool
+            Switch for halfspace
+
+        Returns
+        -------
+        drTE: compex, ndarray
+            Derivative of reflection coefficients;
+            size = (n_layer x n_filter)
+    """
+
+    drTE = np.zeros((n_layer, lamda.size), dtype=complex)
+    if HalfSwitch:
+        n_layer = 1
+
+    c1 = (1+chi[:n_layer]).reshape([-1, 1])
+    thick = (-np.diff(depth[:n_layer])).reshape([-1, 1])
+
+    u = np.sqrt(lamda**2+1j*w*mu_0*c1*sig[:n_layer, :])
+    dudsig = 0.5*1j*w*mu_0*c1/u
+
+    # Propagation matrices, M[k] depends on u[k-1] and u[k]
+    const = np.empty_like(u)
+    e = np.ones_like(u)
+    const[0] = u[0]/(c1[0]*lamda)
+    const[1:] = c1[:-1]*u[1:]/(c1[1:]*u[:-1])
+    e[1:] = np.exp(-2.*u[:-1]*thick)
+
+    M00 = 0.5*(1.+const)*e
+    M01 = 0.5*(1.-const)*e
+    M10 = 0.5*(1.-const)
+    M11 = 0.5*(1.+const)
+
+    M1sum00, M1sum10, M1sum01, M1sum11 = M00[0], M10[0], M01[0], M11[0]
+    for k in range(1, n_layer):
+        M1sum00, M1sum10, M1sum01, M1sum11 = matmul(
+            M1sum00, M1sum10, M1sum01, M1sum11,
+            M00[k], M10[k], M01[k], M11[k]
+        )
+
+    # Suffix products, q[k] = M[k+2] ... M[n_layer-1] * [0, 1]
+    q0 = np.zeros_like(u)
+    q1 = np.ones_like(u)
+    for k in range(n_layer-3, -1, -1):
+        q0[k] = M00[k+2]*q0[k+1] + M01[k+2]*q1[k+1]
+        q1[k] = M10[k+2]*q0[k+1] + M11[k+2]*q1[k+1]
+
+    # dM[k]/du[k]
+    dj0Mtemp00 = 0.5*(M00-M01)/u
+    dj0Mtemp11 = 0.5*(M11-M10)/u
+
+    # Prefix products, P = M[0] ... M[k-1]
+    P00 = np.ones_like(lamda, dtype=complex)
+    P10 = np.zeros_like(P00)
+    P01 = np.zeros_like(P00)
+    P11 = np.ones_like(P00)
+
+    for k in range(n_layer):
+
+        dJ00, dJ10 = dj0Mtemp00[k], -dj0Mtemp11[k]
+        dJ01, dJ11 = -dj0Mtemp00[k], dj0Mtemp11[k]
+
+        if k < n_layer-1:
+            # dM[k+1]/du[k]
+            const0 = 0.5*(M00[k+1]-M01[k+1])/u[k]
+            const1 = 0.5*(M11[k+1]-M10[k+1])/u[k]
+            dj1Mtemp00 = -const0-2.*thick[k]*M00[k+1]
+            dj1Mtemp01 = const0-2.*thick[k]*M01[k+1]
+
+            dJ00, dJ10, dJ01, dJ11 = matmul(
+                dJ00, dJ10, dJ01, dJ11,
+                M00[k+1], M10[k+1], M01[k+1], M11[k+1]
+            )
+            dJ01Mtemp00, dJ01Mtemp10, dJ01Mtemp01, dJ01Mtemp11 = matmul(
+                M00[k], M10[k], M01[k], M11[k],
+                dj1Mtemp00, const1, dj1Mtemp01, -const1
+            )
+            dJ00 = dJ00 + dJ01Mtemp00
+            dJ10 = dJ10 + dJ01Mtemp10
+            dJ01 = dJ01 + dJ01Mtemp01
+            dJ11 = dJ11 + dJ01Mtemp11
+
+        dJq0 = dJ00*q0[k] + dJ01*q1[k]
+        dJq1 = dJ10*q0[k] + dJ11*q1[k]
+        dJ1sum01 = dudsig[k]*(P00*dJq0 + P01*dJq1)
+        dJ1sum11 = dudsig[k]*(P10*dJq0 + P11*dJq1)
+
+        drTE[k, :] = dJ1sum01/M1sum11 - M1sum01/(M1sum11**2)*dJ1sum11
+
+        P00, P10, P01, P11 = matmul(
+            P00, P10, P01, P11, M00[k], M10[k], M01[k], M11[k]
+        )
+
+    return drTE
+
+
+def rTEfunjvec(n_layer, f, lamda, sig, chi, depth, HalfSwitch, v):
+    """
+        Compute sensitivity of reflection coefficients times a vector,
+        sum_k drTE[k, :, :]*v[k], without forming the sensitivity of
+        all frequencies at once.
+
+        Parameters
+        ----------
+        n_layer : int
+            The number layers
+        f : complex, ndarray
+            Frequency (Hz); size = (n_frequency x n_filter)
+        lamda : complex, ndarray
+            Frequency (Hz); size = (n_frequency x n_filter)
+        sig: compelx, ndarray
+            Conductivity (S/m); size = (n_layer x n_frequency)
+        chi: compelx, ndarray
+            Susceptibility (SI); size = (n_layer,)
+        depth: float, ndarray
+            Top boundary of the layers; size = (n_ayer,)
+        HalfSwitch: bool
+            Switch for halfspace
+        v: ndarray
+            Vector; size = (n_layer,)
+
+        Returns
+        -------
+        drTEv: compex, ndarray
+            size = (n_frequency x n_filter)
+    """
+    n_frequency, n_filter = lamda.shape
+    w = 2*np.pi*f
+    drTEv = np.zeros((n_frequency, n_filter), dtype=complex)
+    for i in range(n_frequency):
+        drTE = drTEfun_frequency(
+            n_layer, w[i, 0], lamda[i, :], sig[:, i, np.newaxis], chi, depth,
+            HalfSwitch
+        )
+        drTEv[i, :] = np.dot(v, drTE)
+    return drTEv
+
+
+def rTEfunjtvec(n_layer, f, lamda, sig, chi, depth, HalfSwitch, g):
+    """
+        Compute adjoint of the sensitivity of reflection coefficients,
+        sum_{i, j} drTE[:, i, j]*g[i, j], without forming the sensitivity
+        of all frequencies at once.
+
+        Parameters
+        ----------
+        n_layer : int
+            The number layers
+        f : complex, ndarray
+            Frequency (Hz); size = (n_frequency x n_filter)
+        lamda : complex, ndarray
+            Frequency (Hz); size = (n_frequency x n_filter)
+        sig: compelx, ndarray
+            Conductivity (S/m); size = (n_layer x n_frequency)
+        chi: compelx, ndarray
+            Susceptibility (SI); size = (n_layer,)
+        depth: float, ndarray
+            Top boundary of the layers; size = (n_ayer,)
+        HalfSwitch: bool
+            Switch for halfspace
+        g: complex, ndarray
+            Vector; size = (n_frequency x n_filter)
+
+        Returns
+        -------
+        Jtv: compex, ndarray
+            size = (n_layer,)
+    """
+    n_frequency, n_filter = lamda.shape
+    w = 2*np.pi*f
+    Jtv = np.zeros(n_layer, dtype=complex)
+    for i in range(n_frequency):
+        drTE = drTEfun_frequency(
+            n_layer, w[i, 0], lamda[i, :], sig[:, i, np.newaxis], chi, depth,
+            HalfSwitch
+        )
+        Jtv += np.dot(drTE, g[i, :])
+    return Jtv
@@ -4,7 +4,9 @@ import scipy.sparse as sp
 from scipy.constants import mu_0
 from .EM1DAnalytics import ColeCole
 from .DigFilter import (
-    transFilt, transFiltImpulse, transFiltInterp, transFiltImpulseInterp
+    transFilt, transFiltImpulse, transFiltInterp, transFiltImpulseInterp,
+    get_ffht_weights, get_ffht_integral_weights, get_ffht_sampling,
+    FFHT_PTS_PER_DEC
 )
 from .Waveform import CausalConv
 from scipy.interpolate import interp1d
@@ -12,7 +14,42 @@ import properties
 from empymod import filters
 from empymod.utils import check_time
 from empymod.transform import ffht
-from .Waveforms import piecewise_pulse, piecewise_pulse_fast, butterworth_type_filter, butter_lowpass_filter
+from .Waveforms import piecewise_pulse, piecewise_pulse_fast, piecewise_pulse_segments, butterworth_type_filter, butter_lowpass_filter, gate_integration_operator
+
+
+def dipole_coupling(src_orientation, rx_orientation, x, y):
+    """
+        Coefficients of the Hankel transforms
+        T0 = int rTE exp(-u0(z+h)) lambd^2 J0(lambd r) dlambd,
+        T1 = int rTE exp(-u0(z+h)) lambd^2 J1(lambd r) dlambd and
+        T2 = int rTE exp(-u0(z+h)) lambd J1(lambd r) dlambd
+        in the secondary H of a unit magnetic dipole, for each pair of
+        source and receiver orientations ('x', 'y' or 'z', z upward) and
+        horizontal receiver offset (x, y); size = (3 x n)
+    """
+    x, y = np.broadcast_arrays(
+        np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    )
+    x, y = x.ravel(), y.ravel()
+    r = np.sqrt(x**2+y**2)
+    unit = {'x': x/r, 'y': y/r}
+
+    coefficient = np.zeros((3, x.size))
+    for i, (src, rx) in enumerate(zip(src_orientation, rx_orientation)):
+        if src == 'z' and rx == 'z':
+            coefficient[0, i] = 1.
+        elif src == 'z':
+            coefficient[1, i] = unit[rx][i]
+        elif rx == 'z':
+            coefficient[1, i] = -unit[src][i]
+        else:
+            # Horizontal source and receiver
+            coefficient[0, i] = unit[src][i]*unit[rx][i]
+            coefficient[2, i] = (
+                float(src == rx) - 2*unit[src][i]*unit[rx][i]
+            )/r[i]
+
+    return coefficient/(4*np.pi)
 
 
 class BaseEM1DSurvey(Survey.BaseSurvey, properties.HasProperties):
@@ -79,6 +116,14 @@ class BaseEM1DSurvey(Survey.BaseSurvey, properties.HasProperties):
         """
         return self.z - self.h
 
+    @property
+    def coils(self):
+        """
+            True for coil configurations other than HCP
+            (see EM1DSurveyFD)
+        """
+        return False
+
     @property
     def n_layer(self):
         """
@@ -138,6 +183,24 @@ class EM1DSurveyFD(BaseEM1DSurvey):
         choices=["all", "real", "imag"]
     )
 
+    # Coil configurations of the VMD source type, offset along x:
+    # HCP (z, z), VCA or coaxial (x, x), VCP (y, y),
+    # perpendicular (e.g. x, z)
+    src_orientation = properties.List(
+        "Source dipole orientation for each frequency (z by default)",
+        prop=properties.StringChoice(
+            "Dipole orientation", choices=["x", "y", "z"]
+        ),
+        coerce=True
+    )
+    rx_orientation = properties.List(
+        "Receiver component for each frequency (z by default)",
+        prop=properties.StringChoice(
+            "Dipole orientation", choices=["x", "y", "z"]
+        ),
+        coerce=True
+    )
+
     def __init__(self, **kwargs):
         BaseEM1DSurvey.__init__(self, **kwargs)
 
@@ -148,6 +211,50 @@ class EM1DSurveyFD(BaseEM1DSurvey):
             if self.offset.size == 1:
                 self.offset = self.offset * np.ones(self.n_frequency)
 
+    def dipole_orientations(self):
+        """
+            Source and receiver orientations for each frequency; a single
+            orientation applies to all frequencies
+        """
+        orientations = []
+        for orientation in [self.src_orientation, self.rx_orientation]:
+            if orientation is None:
+                orientation = ['z']
+            if len(orientation) == 1:
+                orientation = list(orientation) * self.n_frequency
+            if len(orientation) != self.n_frequency:
+                raise Exception(
+                    "Give one dipole orientation for each frequency"
+                )
+            orientations.append(orientation)
+        return orientations
+
+    @property
+    def coils(self):
+        """
+            True if the VMD source type has coil configurations other
+            than HCP
+        """
+        if self.src_type != 'VMD':
+            return False
+        src_orientation, rx_orientation = self.dipole_orientations()
+        return any(
+            orientation != 'z'
+            for orientation in src_orientation + rx_orientation
+        )
+
+    @property
+    def coupling_coefficients(self):
+        """
+            Coefficients of the T0, T1 and T2 Hankel transforms
+            (see dipole_coupling) in H of each frequency;
+            size = (3 x n_frequency)
+        """
+        src_orientation, rx_orientation = self.dipole_orientations()
+        return dipole_coupling(
+            src_orientation, rx_orientation, self.offset, 0.
+        )
+
     @property
     def nD(self):
         """
@@ -163,9 +270,14 @@ class EM1DSurveyFD(BaseEM1DSurvey):
 
     @property
     def hz_primary(self):
-        # Assumes HCP only at the moment
+        # Free space field of the coils, offset along x
         if self.src_type == 'VMD':
-            return -1./(4*np.pi*self.offset**3)
+            src_orientation, rx_orientation = self.dipole_orientations()
+            coupling = np.array([
+                3.*(src == 'x')*(rx == 'x') - float(src == rx)
+                for src, rx in zip(src_orientation, rx_orientation)
+            ])
+            return coupling/(4*np.pi*self.offset**3)
         elif self.src_type == 'CircularLoop':
             return self.I/(2*self.a) * np.ones_like(self.frequency)
         else:
@@ -183,7 +295,12 @@ class EM1DSurveyFD(BaseEM1DSurvey):
         if self.rx_type == 'Hz':
             factor = 1.
         elif self.rx_type == 'ppm':
-            factor = 1./self.hz_primary * 1e6
+            if np.any(self.hz_primary == 0.):
+                raise Exception(
+                    "ppm needs coils coupled by the primary field"
+                )
+            # Keep the precision of u
+            factor = (1./self.hz_primary * 1e6).astype(u.real.dtype)
 
         if self.switch_real_imag == 'all':
             ureal = (u.real).copy()
@@ -210,6 +327,97 @@ class EM1DSurveyFD(BaseEM1DSurvey):
 
         return resp
 
+    def projectFieldsAdjoint(self, v):
+        """
+            Adjoint of projectFields: complex w (n_frequency,) such that
+            v.dot(projectFields(u)) = Re(w.dot(u)) for any u.
+        """
+
+        if self.rx_type == 'Hz':
+            factor = 1.
+        elif self.rx_type == 'ppm':
+            factor = 1./self.hz_primary * 1e6
+
+        if self.switch_real_imag == 'all':
+            w = factor*(v[:self.n_frequency] - 1j*v[self.n_frequency:])
+        elif self.switch_real_imag == 'real':
+            w = v.astype(complex)
+        elif self.switch_real_imag == 'imag':
+            w = -1j*v
+        else:
+            raise NotImplementedError()
+
+        return w
+
+
+class TimeTransformPlan(object):
+    """
+        Model independent arrays of the frequency to time transform of a
+        TD system: the interpolation times, the frequencies of the sine
+        DLF, the low pass filter (if used) and the projection operator.
+        EM1DSurveyTD.transform_plan keeps one plan across model updates.
+    """
+
+    def __init__(
+        self, system, time_int, frequency, ftarg, lowpass_filter,
+        projection_operator, sampling=None
+    ):
+        self.system = tuple(
+            np.copy(value) if isinstance(value, np.ndarray) else value
+            for value in system
+        )
+        self.time_int = time_int
+        self.frequency = frequency
+        self.ftarg = ftarg
+        self.lowpass_filter = lowpass_filter
+        self.projection_operator = projection_operator
+        self.sampling = sampling
+        self._projection_operator_single = None
+
+    def matches(self, system):
+        """
+            True if the plan was built for this system
+        """
+        return len(self.system) == len(system) and all(
+            np.array_equal(a, b) for a, b in zip(self.system, system)
+        )
+
+    def projection_operator_single(self):
+        """
+            Projection operator in single precision
+        """
+        if self._projection_operator_single is None:
+            self._projection_operator_single = (
+                self.projection_operator.astype(np.float32)
+            )
+        return self._projection_operator_single
+
+
+class TransformPlanCache(object):
+    """
+        Transform plans shared by the surveys of the same system, e.g.
+        the soundings of GlobalEM1DProblemTD; passed to each survey as
+        transform_plans by the owner of the surveys. At most n_plan plans
+        are kept, the oldest plan is dropped first.
+    """
+
+    def __init__(self, n_plan=8):
+        self.n_plan = n_plan
+        self.plans = []
+
+    def get(self, survey, system):
+        """
+            Transform plan of the system; built by the survey if no
+            survey built it yet
+        """
+        for plan in self.plans:
+            if plan.matches(system):
+                return plan
+        plan = survey.get_transform_plan(system)
+        self.plans.append(plan)
+        del self.plans[:-self.n_plan]
+        return plan
+
 
 class EM1DSurveyTD(BaseEM1DSurvey):
     """docstring for EM1DSurveyTD"""
@@ -234,6 +442,14 @@ class EM1DSurveyTD(BaseEM1DSurvey):
         "The number of pulses",
     )
 
+    n_pulse_exact = properties.Integer(
+        "Number of pulses of the train summed exactly; the tail of longer "
+        "trains is approximated with about 1e-4 relative error for 8 "
+        "pulses (see Waveforms.pulse_train_weights). Every pulse is "
+        "summed exactly if None",
+        min=1
+    )
+
     base_frequency = properties.Float(
         "Base frequency (Hz)"
     )
@@ -254,9 +470,50 @@ class EM1DSurveyTD(BaseEM1DSurvey):
         "High cut frequency for low pass filter (Hz)", default=1e5
     )
 
+    transform_accuracy = properties.Float(
+        "Relative accuracy of the frequency to time transform; the filter "
+        "and the points per decade are chosen from it (see "
+        "DigFilter.get_ffht_sampling). key_81_CosSin_2009 with 3 points "
+        "per decade if None"
+    )
+
+    # Gauss-Legendre points of the short segments (see
+    # get_spectral_convolution)
+    n_quadrature = 4
+
+    time_gate = properties.Array(
+        "Start and end time (s) of the gate of each time channel, "
+        "(n_time x 2); the responses are averaged over the gates (see "
+        "gate_weighting) instead of sampled at the time channels",
+        dtype=float, shape=('*', 2)
+    )
+
+    gate_weighting = properties.StringChoice(
+        "Weighting of the responses over the time gates",
+        default="boxcar",
+        choices=["boxcar", "linear_taper"]
+    )
+
+    # Gauss-Legendre points (in log time) of each part of a gate (see
+    # Waveforms.gate_integration_operator)
+    n_gate_quadrature = 4
+
+    convolution = properties.StringChoice(
+        "Waveform convolution: Gauss-Legendre quadrature of the "
+        "interpolated step-off responses or analytic ramp integrals in the "
+        "frequency domain",
+        default="quadrature",
+        choices=["quadrature", "spectral"]
+    )
+
     # Predicted data
     _pred = None
 
+    # TransformPlanCache shared with other surveys, or None (see
+    # set_frequency)
+    transform_plans = None
+    _transform_plan = None
+
     # ------------- For dual moment ------------- #
 
     time_dual_moment = properties.Array(
@@ -275,7 +532,14 @@ class EM1DSurveyTD(BaseEM1DSurvey):
         "Base frequency for the dual moment (Hz)"
     )
 
+    time_gate_dual_moment = properties.Array(
+        "Start and end time (s) of the gates of the dual moment, "
+        "(n_time_dual_moment x 2)",
+        dtype=float, shape=('*', 2)
+    )
+
     def __init__(self, **kwargs):
+        self.transform_plans = kwargs.pop('transform_plans', None)
         BaseEM1DSurvey.__init__(self, **kwargs)
         if self.time is None:
             raise Exception("time is required!")
@@ -288,36 +552,12 @@ class EM1DSurveyTD(BaseEM1DSurvey):
             if self.offset is None:
                 raise Exception("offset is required!")
 
-            if self.offset.size == 1:
-                self.offset = self.offset * np.ones(self.n_frequency)
-
     @property
     def time_int(self):
         """
         Time channels (s) for interpolation"
         """
-        if getattr(self, '_time_int', None) is None:
-
-            if self.moment_type == "single":
-                time = self.time
-
-            # Dual moment
-            else:
-                time = np.unique(np.r_[self.time, self.time_dual_moment])
-
-            tmin = time.min()
-            if self.n_pulse == 1:
-                tmax = time.max() + self.pulse_period
-            elif self.n_pulse == 2:
-                tmax = time.max() + self.pulse_period + self.period/2.
-            else:
-                raise NotImplementedError("n_pulse must be either 1 or 2")
-            n_time = int((np.log10(tmax)-np.log10(tmin))*10+1)
-            self._time_int = np.logspace(
-                np.log10(tmin), np.log10(tmax), n_time
-            )
-
-        return self._time_int
+        return self.transform_plan.time_int
 
     @property
     def n_time(self):
@@ -366,150 +606,365 @@ class EM1DSurveyTD(BaseEM1DSurvey):
         """
             Low pass filter values
         """
-        if getattr(self, '_lowpass_filter', None) is None:
-            self._lowpass_filter = butterworth_type_filter(
+        lowpass_filter = self.transform_plan.lowpass_filter
+        if lowpass_filter is None:
+            # Not part of the transform
+            lowpass_filter = butterworth_type_filter(
                 self.frequency, self.high_cut_frequency
             )
+        return lowpass_filter
 
-            # For actual butterworth filter
+    @property
+    def system(self):
+        """
+            Settings of the frequency to time transform: time channels and
+            gates, waveforms, base frequencies, number of pulses, receiver
+            type and filters. Settings of an unused waveform are left out.
+        """
+        system = (
+            self.wave_type, self.moment_type, self.rx_type, self.time,
+            self.use_lowpass_filter, self.transform_accuracy,
+            self.time_gate, self.gate_weighting, self.n_gate_quadrature
+        )
+        if self.use_lowpass_filter:
+            system += (self.high_cut_frequency,)
+        if self.transform_accuracy is None:
+            system += (self.fftfilt.name,)
+        if self.wave_type == 'general':
+            system += (
+                self.convolution, self.n_quadrature,
+                self.n_pulse, self.n_pulse_exact, self.base_frequency,
+                self.time_input_currents, self.input_currents
+            )
+            if self.moment_type == 'dual':
+                system += (
+                    self.time_dual_moment, self.base_frequency_dual_moment,
+                    self.time_input_currents_dual_moment,
+                    self.input_currents_dual_moment,
+                    self.time_gate_dual_moment
+                )
+        return system
 
-            # filter_frequency, values = butter_lowpass_filter(
-            #     self.high_cut_frequency
-            # )
-            # lowpass_func = interp1d(
-            #     filter_frequency, values, fill_value='extrapolate'
-            # )
-            # self._lowpass_filter = lowpass_func(self.frequency)
+    @property
+    def transform_plan(self):
+        """
+            Transform plan of the current system, built by set_frequency.
+            A plan is only looked up again, from transform_plans or built,
+            when the time channels, waveforms or filter settings change;
+            fftfilt is only the filter of the default sampling
+            (transform_accuracy None) and is not changed by the plan.
+        """
+        plan = self._transform_plan
+        if plan is None or not plan.matches(self.system):
+            plan = self.set_frequency()
+        return plan
 
-        return self._lowpass_filter
+    @property
+    def frequency(self):
+        """
+            Frequencies (Hz) of the sine DLF of the transform plan
+        """
+        return self.transform_plan.frequency
 
-    def set_frequency(self):
+    @property
+    def ftarg(self):
         """
-        Compute Frequency reqired for frequency to time transform
+            Filter and points per decade of the sine DLF of the transform
+            plan
         """
-        if self.wave_type == "general":
-            _, frequency, ft, ftarg = check_time(
-                self.time_int, 0, 'sin',
-                {'pts_per_dec': 3, 'fftfilt': self.fftfilt}, 0
+        return self.transform_plan.ftarg
+
+    @property
+    def transform_sampling(self):
+        """
+            Filter, points per decade, number of frequencies and estimated
+            relative error (adaptive sampling only) of the frequency to
+            time transform
+        """
+        return self.transform_plan.sampling
+
+    def get_waveforms(self):
+        """
+            Time channels, times of the input currents, input currents and
+            period of each moment; the first moment goes first
+        """
+        waveforms = [(
+            self.time, self.time_input_currents, self.input_currents,
+            self.period
+        )]
+        if self.moment_type == "dual":
+            waveforms.append((
+                self.time_dual_moment, self.time_input_currents_dual_moment,
+                self.input_currents_dual_moment, self.period_dual_moment
+            ))
+        return waveforms
+
+    def get_spectral_convolution(
+        self, time, t_currents, currents, period, frequency, ftarg
+    ):
+        """
+            Weights (n_time x n_frequency) of the response to the piecewise
+            linear waveform, with the integral of the step-off response
+            over each segment computed in the frequency domain: the
+            difference of the analytic integrals of the sine transform
+            (get_ffht_integral_weights) for segments longer than their
+            start time, Gauss-Legendre quadrature of the sine transform at
+            the nodes otherwise. Nothing is interpolated in time.
+        """
+        lags, segment_weights = piecewise_pulse_segments(
+            t_currents, currents, period, n_pulse=self.n_pulse,
+            n_exact=self.n_pulse_exact
+        )
+        t_start = time.reshape([-1, 1]) + lags[:, 0]
+        t_end = time.reshape([-1, 1]) + lags[:, 1]
+        weights = np.zeros((time.size, frequency.size))
+
+        # Long segments: no cancellation between the integrals
+        i_time, i_segment = np.nonzero(t_end > 2*t_start)
+        integral = (
+            get_ffht_integral_weights(
+                ftarg[0], t_end[i_time, i_segment], frequency, ftarg[1]
+            ) -
+            get_ffht_integral_weights(
+                ftarg[0], t_start[i_time, i_segment], frequency, ftarg[1]
             )
-        elif self.wave_type == "stepoff":
-            _, frequency, ft, ftarg = check_time(
-                self.time, 0, 'sin',
-                {'pts_per_dec': 3, 'fftfilt': self.fftfilt}, 0
+        )
+        np.add.at(
+            weights, i_time, segment_weights[i_segment, None]*integral
+        )
+
+        # Short segments: smooth step-off response
+        i_time, i_segment = np.nonzero(t_end <= 2*t_start)
+        x, w = np.polynomial.legendre.leggauss(self.n_quadrature)
+        dt = t_end[i_time, i_segment] - t_start[i_time, i_segment]
+        t_node = (
+            t_start[i_time, i_segment].reshape([-1, 1]) +
+            dt.reshape([-1, 1])*0.5*(x+1.)
+        )
+        integral = np.tensordot(
+            w,
+            get_ffht_weights(
+                ftarg[0], t_node.flatten(), frequency, ftarg[1]
+            ).reshape(t_node.shape+(frequency.size,)),
+            axes=(0, 1)
+        ) * 0.5*dt.reshape([-1, 1])
+        np.add.at(
+            weights, i_time, segment_weights[i_segment, None]*integral
+        )
+        return weights
+
+    def get_gate_operators(self):
+        """
+            Times (s) at which the responses of each moment are evaluated,
+            with the sparse operator averaging them over the time gates
+            (Waveforms.gate_integration_operator); the time channels and
+            None without gates.
+        """
+        moments = [(self.time, self.time_gate)]
+        if self.wave_type == "general" and self.moment_type == "dual":
+            moments.append((self.time_dual_moment, self.time_gate_dual_moment))
+        gate_operators = []
+        for time, time_gate in moments:
+            if time_gate is None:
+                gate_operators.append((time, None))
+                continue
+            if time_gate.shape[0] != time.size:
+                raise Exception(
+                    "time gates must be given for every time channel"
+                )
+            gate_operators.append(
+                gate_integration_operator(
+                    time_gate, self.gate_weighting, self.n_gate_quadrature
+                )
             )
-        else:
-            raise Exception("wave_type must be either general or stepoff")
+        return gate_operators
 
-        self.frequency = frequency
-        self.ftarg = ftarg
+    def get_time_int(self):
+        """
+            Time channels (s) of the step responses interpolated by the
+            waveform convolution
+        """
+        time = np.hstack([time for time, _ in self.get_gate_operators()])
 
-    def projectFields(self, u):
+        tmin = time.min()
+        tmax = (
+            time.max() + self.pulse_period + (self.n_pulse-1)*self.period/2.
+        )
+        n_time = int((np.log10(tmax)-np.log10(tmin))*10+1)
+        return np.logspace(np.log10(tmin), np.log10(tmax), n_time)
+
+    def get_transform_plan(self, system):
         """
-            Transform frequency domain responses to time domain responses
+            Build the transform plan of the system: frequencies of the sine
+            DLF (empymod.utils.check_time), low pass filter and projection
+            operator
         """
-        # Compute frequency domain reponses right at filter coefficient values
-        # Src waveform: Step-off
+        gate_operators = self.get_gate_operators()
+        if self.wave_type == "general":
+            time_int = self.get_time_int()
+            time = time_int
+        elif self.wave_type == "stepoff":
+            time_int = None
+            time = np.hstack([time for time, _ in gate_operators])
+        else:
+            raise Exception("wave_type must be either general or stepoff")
+
+        if self.transform_accuracy is None:
+            _, frequency, ft, ftarg = check_time(
+                time, 0, 'sin', {'pts_per_dec': 3, 'fftfilt': self.fftfilt},
+                0
+            )
+            error = None
+        else:
+            # The spectral convolution evaluates the transform between
+            # the times, which needs the splined DLF
+            if self.wave_type == 'general' and self.convolution == 'spectral':
+                pts_per_dec = [n for n in FFHT_PTS_PER_DEC if n > 0]
+            else:
+                pts_per_dec = FFHT_PTS_PER_DEC
+            frequency, ftarg, error = get_ffht_sampling(
+                time, self.transform_accuracy, pts_per_dec=pts_per_dec
+            )
+        sampling = {
+            'filter': ftarg[0].name, 'pts_per_dec': int(ftarg[1]),
+            'n_frequency': frequency.size, 'error': error
+        }
 
         if self.use_lowpass_filter:
-            factor = self.lowpass_filter.copy()
+            lowpass_filter = butterworth_type_filter(
+                frequency, self.high_cut_frequency
+            )
+
+            # For actual butterworth filter
+
+            # filter_frequency, values = butter_lowpass_filter(
+            #     self.high_cut_frequency
+            # )
+            # lowpass_func = interp1d(
+            #     filter_frequency, values, fill_value='extrapolate'
+            # )
+            # lowpass_filter = lowpass_func(frequency)
+
+            factor = lowpass_filter.copy()
         else:
-            factor = np.ones_like(self.frequency, dtype=complex)
+            lowpass_filter = None
+            factor = np.ones_like(frequency, dtype=complex)
 
         if self.rx_type == 'Bz':
-            factor *= 1./(2j*np.pi*self.frequency)
+            factor *= 1./(2j*np.pi*frequency)
 
         if self.wave_type == 'stepoff':
-            # Compute EM responses
-            if u.size == self.n_frequency:
-                resp, _ = ffht(
-                    u.flatten()*factor, self.time,
-                    self.frequency, self.ftarg
-                )
-            # Compute EM sensitivities
-            else:
-                resp = np.zeros(
-                    (self.n_time, self.n_layer), dtype=np.float64, order='F')
-                # )
-                # TODO: remove for loop
-                for i in range(self.n_layer):
-                    resp_i, _ = ffht(
-                        u[:, i]*factor, self.time,
-                        self.frequency, self.ftarg
-                    )
-                    resp[:, i] = resp_i
-
-        # Evaluate piecewise linear input current waveforms
-        # Using Fittermann's approach (19XX) with Gaussian Quadrature
-        elif self.wave_type == 'general':
-            # Compute EM responses
-            if u.size == self.n_frequency:
-                resp_int, _ = ffht(
-                    u.flatten()*factor, self.time_int,
-                    self.frequency, self.ftarg
-                )
-                step_func = interp1d(
-                    self.time_int, resp_int
+            waveforms = [(None, None, None)]
+        else:
+            waveforms = [waveform[1:] for waveform in self.get_waveforms()]
+            if self.convolution == 'quadrature':
+                # Interpolation of the unit step responses at time_int;
+                # columns go first in the convolution
+                step_func = interp1d(time_int, np.eye(time_int.size))
+                weights_int = get_ffht_weights(
+                    ftarg[0], time_int, frequency, ftarg[1]
                 )
 
-                resp = piecewise_pulse_fast(
-                    step_func, self.time,
-                    self.time_input_currents, self.input_currents,
-                    self.period, n_pulse=self.n_pulse
+        weights = []
+        for (time, gate_operator), (t_currents, currents, period) in zip(
+            gate_operators, waveforms
+        ):
+            # Transform DLF of the responses at the filter frequencies
+            if self.wave_type == 'stepoff':
+                weights_moment = get_ffht_weights(
+                    ftarg[0], time, frequency, ftarg[1]
                 )
 
-                # Compute response for the dual moment
-                if self.moment_type == "dual":
-                    resp_dual_moment = piecewise_pulse_fast(
-                        step_func, self.time_dual_moment,
-                        self.time_input_currents_dual_moment,
-                        self.input_currents_dual_moment,
-                        self.period_dual_moment,
-                        n_pulse=self.n_pulse
-                    )
-                    # concatenate dual moment response
-                    # so, ordering is the first moment data
-                    # then the second moment data.
-                    resp = np.r_[resp, resp_dual_moment]
+            # Evaluate piecewise linear input current waveforms
+            # Directly in the frequency domain (see
+            # get_spectral_convolution)
+            elif self.convolution == 'spectral':
+                weights_moment = self.get_spectral_convolution(
+                    time, t_currents, currents, period, frequency, ftarg
+                )
 
-            # Compute EM sensitivities
+            # Using Fittermann's approach (19XX) with Gaussian Quadrature
             else:
-                if self.moment_type == "single":
-                    resp = np.zeros(
-                        (self.n_time, self.n_layer), dtype=np.float64, order='F')
-                else:
-                    # For dual moment
-                    resp = np.zeros(
-                        (self.n_time+self.n_time_dual_moment, self.n_layer),
-                        dtype=np.float64, order='F')
-
-                # TODO: remove for loop
-                for i in range(self.n_layer):
-                    resp_int_i, _ = ffht(
-                        u[:, i]*factor, self.time_int,
-                        self.frequency, self.ftarg
-                    )
-                    step_func = interp1d(
-                        self.time_int, resp_int_i
-                    )
-                    resp_i = piecewise_pulse_fast(
-                        step_func, self.time,
-                        self.time_input_currents, self.input_currents,
-                        self.period, n_pulse=self.n_pulse
-                    )
+                convolution = piecewise_pulse_fast(
+                    step_func, time, t_currents, currents, period,
+                    n_pulse=self.n_pulse, n_exact=self.n_pulse_exact
+                ).T
+                weights_moment = np.dot(convolution, weights_int)
+
+            # Average over the time gates
+            if gate_operator is not None:
+                weights_moment = gate_operator * weights_moment
+            weights.append(weights_moment)
+        weights = np.vstack(weights)
+
+        # Im(factor*u) = Im(factor)*Re(u) + Re(factor)*Im(u)
+        projection_operator = np.hstack(
+            (weights*factor.imag, weights*factor.real)
+        )
+
+        return TimeTransformPlan(
+            system, time_int, frequency, ftarg, lowpass_filter,
+            projection_operator * (-2.0/np.pi) * mu_0, sampling
+        )
+
+    def set_frequency(self):
+        """
+        Compute Frequency reqired for frequency to time transform: the
+        transform plan of the current system, from transform_plans if the
+        survey shares them, or built otherwise
+        """
+        system = self.system
+        if self.transform_plans is None:
+            plan = self.get_transform_plan(system)
+        else:
+            plan = self.transform_plans.get(self, system)
+        self._transform_plan = plan
+        return plan
+
+    def projectFields(self, u):
+        """
+            Transform frequency domain responses to time domain responses.
+            The responses (n_frequency,) or the sensitivities
+            (n_frequency x n_column) are transformed by a single product
+            with the projection operator.
+        """
+        if u.dtype == np.complex64:
+            return self.projectFields_single_precision(u)
+
+        if u.size == self.n_frequency:
+            u = u.flatten()
+            return np.dot(self.projection_operator, np.r_[u.real, u.imag])
+        return np.dot(self.projection_operator, np.vstack((u.real, u.imag)))
+
+    @property
+    def projection_operator(self):
+        """
+            Dense real operator of projectFields, P (nD x 2*n_frequency),
+            such that projectFields(u) = P.dot(np.r_[u.real, u.imag]).
+            It chains the low pass filter, the Bz factor, the sine
+            transform DLF, the interpolation at the time channels, the
+            waveform convolution and the averaging over the time gates
+            (see transform_plan).
+        """
+        return self.transform_plan.projection_operator
 
-                    if self.moment_type == "single":
-                        resp[:, i] = resp_i
-                    else:
-                        resp_dual_moment_i = piecewise_pulse_fast(
-                            step_func,
-                            self.time_dual_moment,
-                            self.time_input_currents_dual_moment,
-                            self.input_currents_dual_moment,
-                            self.period_dual_moment,
-                            n_pulse=self.n_pulse
-                        )
-                        resp[:, i] = np.r_[resp_i, resp_dual_moment_i]
-        return resp * (-2.0/np.pi) * mu_0
+    def projectFields_single_precision(self, u):
+        """
+            projectFields of complex64 responses (see EM1D.precision),
+            a float32 product with the projection operator
+        """
+        return np.dot(
+            self.transform_plan.projection_operator_single(),
+            np.r_[u.real, u.imag]
+        )
+
+    def projectFieldsAdjoint(self, v):
+        """
+            Adjoint of projectFields: complex w (n_frequency,) such that
+            v.dot(projectFields(u)) = Re(w.dot(u)) for any u.
+        """
+        Ptv = np.dot(self.projection_operator.T, v)
+        return Ptv[:self.n_frequency] - 1j*Ptv[self.n_frequency:]
 
     @Utils.requires('prob')
     def dpred(self, m, f=None):
@@ -1,4 +1,5 @@
 from .EM1D import EM1D
+from .Backends import available_backends, get_backend, register_backend
 from .Survey import BaseEM1DSurvey, EM1DSurveyFD, EM1DSurveyTD
 from .DigFilter import *
 from .EM1DAnalytics import *
@@ -25,7 +26,8 @@ from .GlobalEM1D import (
 from .EM1DSimulation import (
     get_vertical_discretization_frequency,
     get_vertical_discretization_time,
-    set_mesh_1d, run_simulation_FD, run_simulation_TD
+    set_mesh_1d, run_simulation_FD, run_simulation_FD_multiple,
+    run_simulation_TD, run_simulation_TD_multiple
 )
 from .Regularization import (
     LateralConstraint, get_2d_mesh
@@ -0,0 +1,192 @@
+import os
+import time
+import unittest
+import warnings
+from SimPEG import *
+from scipy import io
+from simpegEM1D import EM1D, EM1DSurveyFD
+from simpegEM1D.Backends import available_backends, NumbaBackend
+import numpy as np
+
+
+class EM1D_FD_BackendTests(unittest.TestCase):
+
+    def setUp(self):
+
+        hx = np.r_[np.ones(3)*10]
+        mesh1D = Mesh.TensorMesh([hx], [0.])
+        depth = -mesh1D.gridN[:-1]
+        topo = np.r_[0., 0., 100.]
+
+        # Three layer model of the em1dfm reference data
+        mat = io.loadmat(
+            os.path.join(os.path.dirname(__file__), 'em1dfm', 'VMD_3lay.mat')
+        )
+        frequency = mat['data'][:, 0]
+
+        FDsurvey = EM1DSurveyFD(
+            rx_location=np.array([0., 0., 110.+1e-5]),
+            src_location=np.array([0., 0., 110.+1e-5]),
+            field_type='secondary',
+            depth=depth,
+            topo=topo,
+            frequency=frequency,
+            offset=10. * np.ones(frequency.size)
+        )
+
+        self.survey = FDsurvey
+        self.mesh1D = mesh1D
+        self.m_1D = np.log(np.array([0.01, 0.1, 0.01]))
+        self.Hzanal = mat['data'][:, 1] + 1j*mat['data'][:, 2]
+        self.backends = available_backends()
+        if 'numpy' not in self.backends:
+            self.backends.append('numpy')
+
+    def get_problem(self, kernel_backend):
+        if self.survey.ispaired:
+            self.survey.unpair()
+        prob = EM1D(
+            self.mesh1D, sigmaMap=Maps.ExpMap(self.mesh1D),
+            chi=np.zeros(self.survey.n_layer),
+            kernel_backend=kernel_backend
+        )
+        prob.pair(self.survey)
+        return prob
+
+    def test_EM1DFDfwd_Backends_Parity(self):
+        prob = self.get_problem(self.backends[0])
+        Hz_ref = prob.forward(self.m_1D)
+        J_ref = prob.forward(self.m_1D, output_type='sensitivity_sigma')
+
+        for kernel_backend in self.backends:
+            prob = self.get_problem(kernel_backend)
+            self.assertEqual(prob.backend.name, kernel_backend)
+            Hz = prob.forward(self.m_1D)
+            J = prob.forward(self.m_1D, output_type='sensitivity_sigma')
+
+            # Low frequency secondary fields suffer from cancellation;
+            # compare relative to the norm of the response
+            self.assertTrue(
+                np.linalg.norm(Hz-Hz_ref) < 1e-10*np.linalg.norm(Hz_ref)
+            )
+            self.assertTrue(
+                np.linalg.norm(J-J_ref) < 1e-10*np.linalg.norm(J_ref)
+            )
+
+            err = (
+                np.linalg.norm(Hz-self.Hzanal)/np.linalg.norm(self.Hzanal)
+            )
+            self.assertTrue(err < 0.08)
+            print ("EM1DFD {} backend works".format(kernel_backend))
+
+        # Missing backends fall back to the first available one
+        with warnings.catch_warnings(record=True) as w:
+            warnings.simplefilter("always")
+            prob = self.get_problem('missing')
+            Hz = prob.forward(self.m_1D)
+        self.assertTrue(len(w) > 0)
+        self.assertEqual(prob.backend.name, self.backends[0])
+        self.assertTrue(np.allclose(Hz, Hz_ref))
+
+    def test_EM1DFD_NumbaKernels(self):
+        # The numba kernels also run as plain python without numba
+        prob = self.get_problem(self.backends[0])
+        prob.model = self.m_1D
+        r, lambd, f, h, z, chi, sig = prob.kernel_inputs()
+        lambd, f, sig = lambd[:5, :], f[:5, :], sig[:, :5]
+        depth = self.survey.depth
+        v = np.random.randn(self.survey.n_layer)
+        g = np.random.randn(*lambd.shape) + 1j*np.random.randn(*lambd.shape)
+        numba_backend = NumbaBackend()
+
+        for half_switch in [False, True]:
+            rTE, drTE = prob.backend.rte_forward_sensitivity(
+                f, lambd, sig, chi, depth, half_switch
+            )
+            rTE_nb, drTE_nb = numba_backend.rte_forward_sensitivity(
+                f, lambd, sig, chi, depth, half_switch
+            )
+            drTEv = numba_backend.rte_jvec(
+                f, lambd, sig, chi, depth, half_switch, v
+            )
+            Jtg = numba_backend.rte_jtvec(
+                f, lambd, sig, chi, depth, half_switch, g
+            )
+            self.assertTrue(
+                np.linalg.norm(rTE-rTE_nb) < 1e-10*np.linalg.norm(rTE)
+            )
+            self.assertTrue(
+                np.linalg.norm(drTE-drTE_nb) < 1e-10*np.linalg.norm(drTE)
+            )
+            self.assertTrue(
+                np.allclose(drTEv, np.tensordot(v, drTE, axes=1))
+            )
+            self.assertTrue(
+                np.allclose(Jtg, np.tensordot(drTE, g, axes=2))
+            )
+        print ("EM1DFD numba kernels work")
+
+    def test_EM1DFD_Backends_Stack(self):
+        # A stack of soundings shares the wavenumbers and frequencies;
+        # only sig and chi carry the sounding axis
+        prob = self.get_problem(self.backends[0])
+        prob.model = self.m_1D
+        r, lambd, f, h, z, chi, sig = prob.kernel_inputs()
+        depth = self.survey.depth
+        scale = np.r_[1., 2., 0.5]
+        sig_stack = np.asfortranarray(
+            sig[:, :, np.newaxis] * scale
+        )
+        chi_stack = np.asfortranarray(np.tile(chi[:, np.newaxis], (1, 3)))
+
+        for kernel_backend in self.backends:
+            backend = self.get_problem(kernel_backend).backend
+            rTE, drTE = backend.rte_forward_sensitivity(
+                f, lambd, sig_stack, chi_stack, depth, False
+            )
+            self.assertEqual(rTE.shape, lambd.shape+(3,))
+            self.assertEqual(drTE.shape, (sig.shape[0],)+lambd.shape+(3,))
+            for i, s in enumerate(scale):
+                sig_i = np.asfortranarray(sig*s)
+                rTE_i = backend.rte_forward(
+                    f, lambd, sig_i, chi, depth, False
+                )
+                drTE_i = backend.rte_sensitivity(
+                    f, lambd, sig_i, chi, depth, False
+                )
+                self.assertTrue(np.allclose(rTE[:, :, i], rTE_i))
+                self.assertTrue(np.allclose(drTE[..., i], drTE_i))
+            self.assertTrue(np.allclose(
+                backend.rte_forward(
+                    f, lambd, sig_stack, chi_stack, depth, False
+                ), rTE
+            ))
+        print ("EM1DFD stacks of soundings work")
+
+    def test_EM1DFDfwd_Backends_Benchmark(self):
+        n_repeat = 5
+        for kernel_backend in self.backends:
+            prob = self.get_problem(kernel_backend)
+            # Warm up (JIT compilation)
+            prob.forward(self.m_1D, output_type='sensitivity_sigma')
+
+            t_start = time.time()
+            for i in range(n_repeat):
+                prob.forward(self.m_1D)
+            t_forward = (time.time()-t_start)/n_repeat
+
+            t_start = time.time()
+            for i in range(n_repeat):
+                prob.forward(self.m_1D, output_type='sensitivity_sigma')
+            t_sensitivity = (time.time()-t_start)/n_repeat
+
+            print (
+                ">> {:>8s} backend: forward {:.2e} s, "
+                "sensitivity {:.2e} s".format(
+                    kernel_backend, t_forward, t_sensitivity
+                )
+            )
+
+
+if __name__ == '__main__':
+    unittest.main()
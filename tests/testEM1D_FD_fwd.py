@@ -4,6 +4,7 @@ import matplotlib.pyplot as plt
 from simpegEM1D import EM1D, EM1DAnalytics, EM1DSurveyFD
 import numpy as np
 from scipy.constants import mu_0
+import empymod
 
 
 class EM1D_FD_FwdProblemTests(unittest.TestCase):
@@ -188,6 +189,365 @@ class EM1D_FD_FwdProblemTests(unittest.TestCase):
         self.assertTrue(err < 1e-5)
         print ("EM1DFD-CircularLoop for complex conductivity works")
 
+    def test_EM1DFDfwd_VMD_Threads(self):
+        from multiprocessing.pool import ThreadPool
+        self.prob.survey.src_type = 'VMD'
+        m_1D = np.log(np.linspace(1e-3, 1e-1, self.prob.survey.n_layer))
+
+        self.prob.set_num_threads(1)
+        Hz = self.prob.forward(m_1D)
+        J = self.prob.forward(m_1D, output_type='sensitivity_sigma')
+
+        # OpenMP threads inside the kernels
+        self.prob.set_num_threads(2)
+        Hz_omp = self.prob.forward(m_1D)
+        J_omp = self.prob.forward(m_1D, output_type='sensitivity_sigma')
+        self.prob.set_num_threads(1)
+
+        # Python threads driving the kernels, one problem per thread
+        # (EM1D keeps the model, rTE and Hankel plan of its last call)
+        def forward_thread(m):
+            survey = EM1DSurveyFD(
+                rx_location=self.survey.rx_location,
+                src_location=self.survey.src_location,
+                field_type='secondary',
+                depth=self.survey.depth,
+                topo=self.survey.topo,
+                frequency=self.survey.frequency,
+                offset=self.survey.offset
+            )
+            survey.rx_type = 'Hz'
+            prob = EM1D(self.mesh1D, sigmaMap=Maps.ExpMap(self.mesh1D))
+            prob.pair(survey)
+            prob.chi = np.zeros(survey.n_layer)
+            return prob.forward(m)
+
+        m_threads = [m_1D + np.log(scale) for scale in [1., 2., 0.5, 4.]]
+        Hz_serial = [self.prob.forward(m) for m in m_threads]
+        pool = ThreadPool(2)
+        Hz_pool = pool.map(forward_thread, m_threads)
+        pool.close()
+        pool.join()
+
+        self.assertTrue(np.allclose(Hz, Hz_omp, rtol=1e-12, atol=0.))
+        self.assertTrue(np.allclose(J, J_omp, rtol=1e-12, atol=0.))
+        for Hz_ref, Hz_thread in zip(Hz_serial, Hz_pool):
+            self.assertTrue(
+                np.allclose(Hz_ref, Hz_thread, rtol=1e-12, atol=0.)
+            )
+        print ("EM1DFD-VMD with threads works")
+
+    def test_EM1DFD_kernel_releases_gil(self):
+        import threading
+        import time
+        from simpegEM1D.Backends import FortranBackend, rte_fortran
+        if rte_fortran is None:
+            self.skipTest("m_rTE_Fortran is not compiled")
+        backend = FortranBackend()
+        backend.set_num_threads(1)
+        n_frequency, n_filter, n_layer = 100, 801, 30
+        f = np.asfortranarray(
+            np.logspace(1, 5, n_frequency).reshape([-1, 1]) *
+            np.ones(n_filter)
+        )
+        lamda = np.asfortranarray(
+            np.ones((n_frequency, 1)) * np.logspace(-6, 0, n_filter)
+        )
+        sig = np.ones((n_layer, n_frequency), dtype=complex, order='F')*1e-2
+        chi = np.zeros(n_layer)
+        depth = -np.arange(n_layer) * 5.
+        args = (f, lamda, sig, chi, depth, False)
+
+        start = time.time()
+        backend.rte_forward(*args)
+        duration = time.time() - start
+
+        # The main thread keeps running while the other thread is in
+        # the kernel; holding the GIL would stall it for the whole call
+        thread = threading.Thread(target=backend.rte_forward, args=args)
+        ticks = [time.time()]
+        thread.start()
+        while thread.is_alive():
+            ticks.append(time.time())
+        thread.join()
+        gap = np.diff(ticks).max()
+        print ("Kernel {:.3f} s, longest stall {:.3f} s".format(duration, gap))
+        self.assertTrue(gap < duration/2)
+        print ("EM1DFD kernel releasing the GIL works")
+
+    def test_EM1DFDfwd_VMD_LaggedSplinedDLF(self):
+        # Three offsets per frequency share the wavenumbers of
+        # the lagged convolution and splined DLF
+        frequency = np.repeat(np.logspace(1, 8, 21), 3)
+        offset = np.tile(np.r_[5., 10., 20.], 21)
+        sig_half = 0.01
+        m_1D = np.log(np.ones(self.survey.n_layer)*sig_half)
+        Hzanal = EM1DAnalytics.Hzanal(
+            sig_half, frequency, offset, 'secondary'
+        )
+
+        for hankel_pts_per_dec in [-1, 10]:
+            survey = EM1DSurveyFD(
+                rx_location=np.array([0., 0., 100.+1e-5]),
+                src_location=np.array([0., 0., 100.+1e-5]),
+                field_type='secondary',
+                depth=self.survey.depth,
+                topo=self.survey.topo,
+                frequency=frequency,
+                offset=offset
+            )
+            prob = EM1D(
+                self.mesh1D, sigmaMap=Maps.ExpMap(self.mesh1D),
+                chi=np.zeros(survey.n_layer),
+                hankel_pts_per_dec=hankel_pts_per_dec
+            )
+            prob.pair(survey)
+            Hz = prob.forward(m_1D)
+
+            r, lambd, f, h, z, chi, sig = prob.kernel_inputs()
+            self.assertEqual(lambd.shape[0], 21)
+            self.assertTrue(lambd.size < frequency.size * prob.n_filter)
+
+            err = np.linalg.norm(Hz-Hzanal)/np.linalg.norm(Hzanal)
+            self.assertTrue(err < 1e-4)
+
+            # Receiver plans keep their own DLF weights
+            z = survey.src_location[2]
+            H = prob.forward_receivers(
+                m_1D, np.array([[10., 0., z]]), 'z'
+            )
+            self.assertTrue(np.allclose(H[0, 1::3], Hz[1::3], rtol=1e-10))
+            self.assertTrue(np.allclose(prob.forward(m_1D), Hz, rtol=1e-10))
+        print ("EM1DFD-VMD with lagged and splined DLF works")
+
+    def test_EM1DFDfwd_VMD_HankelPlan(self):
+        self.prob.survey.src_type = 'VMD'
+        sig_half = 0.01
+        m_1D = np.log(np.ones(self.prob.survey.n_layer)*sig_half)
+
+        # Model updates reuse the plan
+        self.prob.forward(m_1D*1.1)
+        plan = self.prob.hankel_plan()
+        Hz = self.prob.forward(m_1D)
+        self.assertTrue(self.prob.hankel_plan() is plan)
+
+        # A height change only updates the propagation factors
+        self.prob.survey.src_location = np.array([0., 0., 130.+1e-5])
+        self.prob.survey.rx_location = np.array([0., 0., 130.+1e-5])
+        Hz_height = self.prob.forward(m_1D)
+        self.assertTrue(self.prob.hankel_plan() is plan)
+        self.assertTrue(np.allclose(plan.h, 30.+1e-5))
+        self.prob._hankel_plan = None
+        Hz_new = self.prob.forward(m_1D)
+        self.assertTrue(np.allclose(Hz_height, Hz_new, rtol=1e-12, atol=0.))
+        self.assertFalse(np.allclose(Hz, Hz_height))
+        plan = self.prob.hankel_plan()
+
+        # A geometry change rebuilds it
+        self.prob.survey.offset = np.ones(self.prob.survey.n_frequency) * 20.
+        Hz_offset = self.prob.forward(m_1D)
+        self.assertFalse(self.prob.hankel_plan() is plan)
+        self.prob._hankel_plan = None
+        Hz_new = self.prob.forward(m_1D)
+        self.assertTrue(np.allclose(Hz_offset, Hz_new, rtol=1e-12, atol=0.))
+        self.assertFalse(np.allclose(Hz_height, Hz_offset))
+        print ("EM1DFD-VMD Hankel plan works")
+
+    def test_EM1DFDfwd_SinglePrecision(self):
+        sig = np.ones(self.survey.n_layer)*0.01
+        sig[5:10] = 0.1
+        m_1D = np.log(sig)
+
+        for kernel_backend in ['fortran', 'numpy']:
+            for src_type in ['VMD', 'CircularLoop']:
+                for hankel_pts_per_dec in [0, -1]:
+                    if self.survey.ispaired:
+                        self.survey.unpair()
+                    self.survey.src_type = src_type
+                    prob = EM1D(
+                        self.mesh1D, sigmaMap=Maps.ExpMap(self.mesh1D),
+                        chi=np.zeros(self.survey.n_layer),
+                        hankel_pts_per_dec=hankel_pts_per_dec,
+                        kernel_backend=kernel_backend
+                    )
+                    prob.pair(self.survey)
+                    Hz = prob.forward(m_1D)
+                    prob.precision = 'single'
+                    Hz_single = prob.forward(m_1D)
+
+                    self.assertEqual(Hz_single.dtype, np.complex64)
+                    err = (
+                        np.linalg.norm(Hz_single-Hz)/np.linalg.norm(Hz)
+                    )
+                    self.assertTrue(err < 1e-3)
+
+                    # Sensitivities stay in double precision
+                    J = prob.forward(m_1D, output_type='sensitivity_sigma')
+                    self.assertEqual(J.dtype, np.complex128)
+        print ("EM1DFD single precision works")
+
+    def test_EM1DFDfwd_InterpolatedRTE(self):
+        sig = np.ones(self.survey.n_layer)*0.01
+        sig[5:10] = 0.1
+        m_1D = np.log(sig)
+        v = np.random.randn(self.survey.n_layer)
+        w = np.random.randn(self.survey.nD)
+
+        for src_type in ['VMD', 'CircularLoop']:
+            for hankel_pts_per_dec in [0, -1]:
+                if self.survey.ispaired:
+                    self.survey.unpair()
+                self.survey.src_type = src_type
+                prob = EM1D(
+                    self.mesh1D, sigmaMap=Maps.ExpMap(self.mesh1D),
+                    chi=np.zeros(self.survey.n_layer),
+                    hankel_pts_per_dec=hankel_pts_per_dec
+                )
+                prob.pair(self.survey)
+                Hz = prob.forward(m_1D)
+                J = prob.forward(m_1D, output_type='sensitivity_sigma')
+
+                tol = 1e-3
+                prob.rte_interpolation_tol = tol
+                Hz_interp = prob.forward(m_1D)
+                self.assertTrue(prob.rte_interpolation_error <= tol)
+                # The refined grid is kept on the plan, the setting of the
+                # problem is left alone
+                print (
+                    "rTE interpolated with {} points per decade".format(
+                        prob.hankel_plan().rte_pts_per_dec
+                    )
+                )
+                self.assertEqual(prob.rte_pts_per_dec, EM1D.rte_pts_per_dec)
+                self.assertTrue(
+                    prob.hankel_plan().rte_pts_per_dec > prob.rte_pts_per_dec
+                )
+                # The coarse grid is coarser than the filter
+                self.assertTrue(
+                    prob.rte_interpolation(prob.hankel_plan().lambd)
+                    is not None
+                )
+                J_interp = prob.forward(m_1D, output_type='sensitivity_sigma')
+
+                # The VMD Hankel DLF amplifies the error of the kernels
+                err = np.linalg.norm(Hz_interp-Hz)/np.linalg.norm(Hz)
+                self.assertTrue(err < 20*tol)
+                err = np.linalg.norm(J_interp-J)/np.linalg.norm(J)
+                self.assertTrue(err < 20*tol)
+
+                # Matrix-free sensitivities use the same interpolation
+                Jv = prob.Jvec(m_1D, v)
+                prob.matrix_free = True
+                Jv_free = prob.Jvec(m_1D, v)
+                Jtw_free = prob.Jtvec(m_1D, w)
+                self.assertTrue(np.allclose(Jv, Jv_free, rtol=1e-8, atol=0.))
+                self.assertTrue(np.allclose(w.dot(Jv_free), v.dot(Jtw_free)))
+        print ("EM1DFD interpolated rTE works")
+
+    def test_EM1DFDfwd_VMD_MultipleReceivers(self):
+        self.prob.survey.src_type = 'VMD'
+        self.prob.survey.offset = np.ones(self.prob.survey.n_frequency) * 10.
+        sig = np.ones(self.prob.survey.n_layer)*0.01
+        sig[3] = 0.1
+        m_1D = np.log(sig)
+        Hz = self.prob.forward(m_1D)
+        J = self.prob.forward(m_1D, output_type='sensitivity_sigma')
+
+        # Hz of receivers at the offset of the survey
+        z = self.prob.survey.src_location[2]
+        rx_locations = np.array([[10., 0., z], [0., -10., z], [6., 8., z]])
+        H = self.prob.forward_receivers(m_1D, rx_locations, 'z')
+        dHdsig = self.prob.forward_receivers(
+            m_1D, rx_locations, 'z', output_type='sensitivity_sigma'
+        )
+        for i in range(3):
+            self.assertTrue(np.allclose(H[i, :], Hz, rtol=1e-10, atol=0.))
+            self.assertTrue(np.allclose(dHdsig[i], J, rtol=1e-10, atol=0.))
+
+        # The secondary field is divergence free above the earth
+        dx = 1e-2
+        x0 = np.r_[6., 4., z+5.]
+        rx_locations, rx_components = [], []
+        for i, component in enumerate(['x', 'y', 'z']):
+            for sign in [1., -1.]:
+                rx_locations.append(x0 + sign*dx*np.eye(3)[i])
+                rx_components.append(component)
+        H = self.prob.forward_receivers(
+            m_1D, np.array(rx_locations), rx_components
+        )
+        dH = (H[::2, :] - H[1::2, :])/(2*dx)
+        div = dH.sum(axis=0)
+        self.assertTrue(np.all(abs(div) < 1e-4*abs(dH).max(axis=0)))
+        print ("EM1DFD-VMD multiple receivers works")
+
+    def test_EM1DFDfwd_Coils(self):
+        # HCP, VCA, VCP and perpendicular coils at each frequency
+        frequency = np.repeat([900., 5000.], 5)
+        src_orientation = ['z', 'x', 'y', 'x', 'z'] * 2
+        rx_orientation = ['z', 'x', 'y', 'z', 'x'] * 2
+        hx = np.r_[10., 10., 10.]
+        mesh1D = Mesh.TensorMesh([hx], [0.])
+        depth = -mesh1D.gridN[:-1]
+        sig = np.r_[0.01, 0.1, 0.02]
+
+        for hankel_pts_per_dec in [0, -1]:
+            survey = EM1DSurveyFD(
+                rx_location=np.array([8., 0., 30.]),
+                src_location=np.array([0., 0., 30.]),
+                topo=np.r_[0., 0., 0.],
+                field_type='secondary',
+                depth=depth,
+                frequency=frequency,
+                offset=8. * np.ones(frequency.size),
+                src_orientation=src_orientation,
+                rx_orientation=rx_orientation
+            )
+            self.assertTrue(survey.coils)
+            prob = EM1D(
+                mesh1D, sigmaMap=Maps.IdentityMap(mesh1D),
+                chi=np.zeros(3), hankel_pts_per_dec=hankel_pts_per_dec
+            )
+            prob.pair(survey)
+            H = prob.forward(sig)
+
+            # HCP coils as without coil configurations
+            survey.src_orientation = ['z']
+            survey.rx_orientation = ['z']
+            self.assertFalse(survey.coils)
+            Hz = prob.forward(sig)
+            hcp = np.array(rx_orientation) == 'z'
+            hcp &= np.array(src_orientation) == 'z'
+            self.assertTrue(np.allclose(H[hcp], Hz[hcp], rtol=1e-10))
+
+            # Coupling relative to HCP against empymod (z downward)
+            res = np.r_[2e14, 1./sig]
+            res_air = 2e14*np.ones(4)
+            ab = {
+                ('z', 'z'): 66, ('x', 'x'): 44, ('y', 'y'): 55,
+                ('x', 'z'): -64, ('z', 'x'): -46
+            }
+            H_empymod = np.zeros(frequency.size, dtype=complex)
+            for i in range(frequency.size):
+                ab_i = ab[(src_orientation[i], rx_orientation[i])]
+                for resistivity, sign in [(res, 1.), (res_air, -1.)]:
+                    H_empymod[i] += sign*np.sign(ab_i)*empymod.dipole(
+                        [0., 0., -30.], [8., 0., -30.], np.r_[0., 10., 20.],
+                        resistivity, frequency[i], ab=abs(ab_i),
+                        xdirect=True, htarg='key_101_2009', verb=0
+                    )
+            i_hcp = np.repeat([0, 5], 5)
+            self.assertTrue(np.allclose(
+                H/H[i_hcp], H_empymod/H_empymod[i_hcp], rtol=1e-3
+            ))
+
+        # Free space coupling of the coils
+        survey.src_orientation = src_orientation
+        survey.rx_orientation = rx_orientation
+        self.assertTrue(np.allclose(
+            survey.hz_primary*4*np.pi*8.**3, [-1., 2., -1., 0., 0.]*2
+        ))
+        print ("EM1DFD coil configurations work")
+
     # def test_EM1DFDfwd_VMD_EM1D_sigchi(self):
 
     #     self.survey.rx_location = np.array([0., 0., 110.+1e-5])
@@ -2,6 +2,7 @@ import unittest
 from SimPEG import *
 import matplotlib.pyplot as plt
 from simpegEM1D import EM1D, EM1DAnalytics, DigFilter, EM1DSurveyFD
+from simpegEM1D.RTEfun_vec import rTEfunjvec, rTEfunjtvec
 import numpy as np
 
 
@@ -130,6 +131,200 @@ class EM1D_FD_Jac_layers_ProblemTests(unittest.TestCase):
         if passed:
             print ("EM1DFD-layers Jtvec works")
 
+    def test_EM1DFDJvec_Jtvec_MatrixFree(self):
+
+        sig = np.ones(self.prob.survey.n_layer)*0.01
+        sig[3] = 0.1
+        m_1D = np.log(sig)
+        v = np.random.randn(self.prob.survey.n_layer)
+        w = np.random.randn(self.prob.survey.nD)
+
+        for src_type in ['CircularLoop', 'VMD']:
+            self.prob.survey.src_type = src_type
+            self.prob.survey.offset = 10.*np.ones(self.prob.survey.n_frequency)
+            self.prob.matrix_free = False
+            self.prob._Jmatrix_sigma = None
+
+            Jv = self.prob.Jvec(m_1D, v)
+            Jtw = self.prob.Jtvec(m_1D, w)
+
+            self.prob.matrix_free = True
+            Jv_free = self.prob.Jvec(m_1D, v)
+            Jtw_free = self.prob.Jtvec(m_1D, w)
+
+            self.assertTrue(np.allclose(Jv, Jv_free, rtol=1e-8, atol=0.))
+            self.assertTrue(np.allclose(Jtw, Jtw_free, rtol=1e-8, atol=0.))
+
+        # Vectorized python version of the adjoint kernels
+        r, lambd, f, h, z, chi, sig_c = self.prob.kernel_inputs()
+        n_layer = self.prob.survey.n_layer
+        depth = self.prob.survey.depth
+        g = np.random.randn(*lambd.shape) + 1j*np.random.randn(*lambd.shape)
+
+        drTEv = self.prob.compute_drTE_vec(f, lambd, sig_c, chi, depth, v)
+        Jtg = self.prob.compute_drTE_tvec(f, lambd, sig_c, chi, depth, g)
+        drTEv_vec = rTEfunjvec(n_layer, f, lambd, sig_c, chi, depth, False, v)
+        Jtg_vec = rTEfunjtvec(n_layer, f, lambd, sig_c, chi, depth, False, g)
+
+        self.assertTrue(np.allclose(drTEv, drTEv_vec, rtol=1e-10, atol=0.))
+        self.assertTrue(np.allclose(Jtg, Jtg_vec, rtol=1e-10, atol=0.))
+        print ("EM1DFD-layers matrix-free Jvec and Jtvec work")
+
+    def test_EM1DFDJvec_Jtvec_LaggedDLF(self):
+
+        self.prob.unpair()
+        prob = EM1D(
+            self.mesh1D, sigmaMap=Maps.ExpMap(self.mesh1D),
+            chi=np.zeros(self.survey.n_layer), hankel_pts_per_dec=-1
+        )
+        prob.pair(self.survey)
+
+        sig = np.ones(prob.survey.n_layer)*0.01
+        sig[3] = 0.1
+        m_1D = np.log(sig)
+        v = np.random.randn(prob.survey.n_layer)
+        w = np.random.randn(prob.survey.nD)
+
+        derChk = lambda m: [
+            prob.survey.dpred(m), lambda mx: prob.Jvec(m, mx)
+        ]
+        passed = Tests.checkDerivative(
+            derChk, m_1D, num=4, dx=m_1D*0.5, plotIt=False, eps=1e-15
+        )
+        self.assertTrue(passed)
+
+        prob._Jmatrix_sigma = None
+        Jv = prob.Jvec(m_1D, v)
+        Jtw = prob.Jtvec(m_1D, w)
+        prob.matrix_free = True
+        self.assertTrue(
+            np.allclose(Jv, prob.Jvec(m_1D, v), rtol=1e-8, atol=0.)
+        )
+        self.assertTrue(
+            np.allclose(Jtw, prob.Jtvec(m_1D, w), rtol=1e-8, atol=0.)
+        )
+        self.assertTrue(np.allclose(w.dot(Jv), v.dot(Jtw)))
+        print ("EM1DFD-layers Jvec and Jtvec with lagged DLF work")
+
+    def test_EM1DFDJvec_Height(self):
+
+        self.prob.unpair()
+        n_layer = self.survey.n_layer
+        wires = Maps.Wires(('sigma', n_layer), ('h', 1))
+        sig = np.ones(n_layer)*0.01
+        sig[3] = 0.1
+        m_1D = np.r_[np.log(sig), 50.]
+
+        for src_type, field_type in [
+            ('VMD', 'secondary'), ('CircularLoop', 'total')
+        ]:
+            if self.survey.ispaired:
+                self.survey.unpair()
+            self.survey.src_type = src_type
+            self.survey.field_type = field_type
+            self.survey.offset = 10.*np.ones(self.survey.n_frequency)
+            prob = EM1D(
+                self.mesh1D, sigmaMap=Maps.ExpMap(self.mesh1D)*wires.sigma,
+                hMap=wires.h, chi=np.zeros(n_layer)
+            )
+            prob.pair(self.survey)
+
+            dm = np.r_[np.zeros(n_layer), 10.]
+            derChk = lambda m: [
+                prob.survey.dpred(m), lambda mx: prob.Jvec(m, mx)
+            ]
+            passed = Tests.checkDerivative(
+                derChk, m_1D, num=4, dx=dm, plotIt=False, eps=1e-15
+            )
+            self.assertTrue(passed)
+
+            # The height sensitivity reuses rTE of the response
+            prob.forward(m_1D*1.1)
+            Hz = prob.forward(m_1D)
+            compute_rTE = prob.compute_rTE
+            prob.compute_rTE = None
+            dHzdh = prob.forward(m_1D, output_type='sensitivity_height')
+            prob.compute_rTE = compute_rTE
+
+            prob._rTE = None
+            pred, J_height = prob.forward_and_height(m_1D)
+            d = prob.survey.projectFields(Hz)
+            J = prob.survey.projectFields(dHzdh)
+            self.assertTrue(
+                np.linalg.norm(pred-d) < 1e-10*np.linalg.norm(d)
+            )
+            self.assertTrue(
+                np.linalg.norm(J_height[:, 0]-J) < 1e-10*np.linalg.norm(J)
+            )
+        print ("EM1DFD-layers J height works")
+
+    def test_EM1DFDJvec_Coils(self):
+
+        self.prob.unpair()
+        n_layer = self.survey.n_layer
+        n_frequency = self.survey.n_frequency
+        frequency = self.survey.frequency
+        sig = np.ones(n_layer)*0.01
+        sig[3] = 0.1
+        wires = Maps.Wires(('sigma', n_layer), ('h', 1))
+        m_1D = np.r_[np.log(sig), 50.]
+        v = np.random.randn(n_layer+1)
+
+        # HCP and VCA coils, ppm of the primary field of each
+        survey = EM1DSurveyFD(
+            rx_location=np.array([10., 0., 150.]),
+            src_location=np.array([0., 0., 150.]),
+            topo=np.r_[0., 0., 100.],
+            field_type='secondary',
+            rx_type='ppm',
+            depth=self.survey.depth,
+            frequency=frequency,
+            offset=10.*np.ones(n_frequency),
+            src_orientation=['z', 'x']*(n_frequency//2),
+            rx_orientation=['z', 'x']*(n_frequency//2)
+        )
+
+        for hankel_pts_per_dec in [0, -1]:
+            if survey.ispaired:
+                survey.unpair()
+            prob = EM1D(
+                self.mesh1D, sigmaMap=Maps.ExpMap(self.mesh1D)*wires.sigma,
+                hMap=wires.h, chi=np.zeros(n_layer),
+                hankel_pts_per_dec=hankel_pts_per_dec
+            )
+            prob.pair(survey)
+
+            derChk = lambda m: [
+                prob.survey.dpred(m), lambda mx: prob.Jvec(m, mx)
+            ]
+            passed = Tests.checkDerivative(
+                derChk, m_1D, num=4, dx=np.abs(m_1D)*0.1, plotIt=False,
+                eps=1e-15
+            )
+            self.assertTrue(passed)
+
+            w = np.random.randn(survey.nD)
+            prob._Jmatrix_sigma = None
+            prob._Jmatrix_height = None
+            Jv = prob.Jvec(m_1D, v)
+            Jtw = prob.Jtvec(m_1D, w)
+            self.assertTrue(np.allclose(w.dot(Jv), v.dot(Jtw)))
+            prob.matrix_free = True
+            self.assertTrue(
+                np.allclose(Jv, prob.Jvec(m_1D, v), rtol=1e-8, atol=0.)
+            )
+            self.assertTrue(
+                np.allclose(Jtw, prob.Jtvec(m_1D, w), rtol=1e-8, atol=0.)
+            )
+
+            # All coils of a stack of soundings from one kernel call
+            Hz = prob.forward(m_1D)
+            Hz_multiple = prob.forward_multiple(
+                np.vstack([sig, sig]), np.r_[50., 50.], np.r_[50., 50.]
+            )
+            self.assertTrue(np.allclose(Hz_multiple[1], Hz, rtol=1e-10))
+        print ("EM1DFD-layers J of coil configurations works")
+
 
 if __name__ == '__main__':
     unittest.main()
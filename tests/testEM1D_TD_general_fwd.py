@@ -1,8 +1,11 @@
+import time
 import unittest
 from SimPEG import Mesh, Maps, Utils
 import matplotlib.pyplot as plt
 from simpegEM1D import EM1D, EM1DSurveyTD, EM1DAnalytics
-from simpegEM1D.Waveforms import piecewise_ramp
+from simpegEM1D.Waveforms import (
+    piecewise_ramp, piecewise_pulse, pulse_train_weights
+)
 import numpy as np
 from scipy import io
 from scipy.interpolate import interp1d
@@ -128,5 +131,145 @@ class EM1D_TD_FwdProblemTests(unittest.TestCase):
         print ("EM1DTD-CirculurLoop-general for real conductivity works")
 
 
+    def test_em1dtd_single_precision(self):
+        sig = np.ones(self.survey.n_layer)*1e-2
+        sig[5:10] = 1e-1
+        m_1D = np.log(sig)
+        bz = self.survey.dpred(m_1D)
+
+        self.prob.precision = 'single'
+        bz_single = self.survey.dpred(m_1D)
+        self.prob.precision = 'double'
+
+        self.assertEqual(bz_single.dtype, np.float32)
+        err = np.linalg.norm(bz_single-bz)/np.linalg.norm(bz)
+        print ('Bz single precision error = ', err)
+        self.assertTrue(err < 1e-3)
+
+    def test_em1dtd_convolution_benchmark(self):
+        # Quadrature of the interpolated step-off responses versus the
+        # convolution in the frequency domain, for both pulses
+        sig_half = 1e-2
+        m_1D = np.log(np.ones(self.survey.n_layer)*sig_half)
+        n_repeat = 5
+
+        def step_func_Bz(time):
+            return EM1DAnalytics.BzAnalCircT(self.survey.a, time, sig_half)
+
+        BzTD_analytic = piecewise_pulse(
+            step_func_Bz, self.survey.time,
+            self.survey.time_input_currents, self.survey.input_currents,
+            self.survey.period, n_pulse=self.survey.n_pulse
+        )
+
+        f = self.prob.forward(m_1D)
+        err = {}
+        for convolution in ['quadrature', 'spectral']:
+            self.survey.convolution = convolution
+            t_start = time.time()
+            self.survey.get_transform_plan(self.survey.system)
+            t_plan = time.time()-t_start
+            BzTD = self.survey.projectFields(f)
+            t_start = time.time()
+            for i in range(n_repeat):
+                self.survey.projectFields(f)
+            t_project = (time.time()-t_start)/n_repeat
+
+            err[convolution] = (
+                np.linalg.norm(BzTD-BzTD_analytic) /
+                np.linalg.norm(BzTD_analytic)
+            )
+            print (
+                ">> {:>10s} convolution: error {:.2e}, median relative "
+                "error {:.2e}, plan {:.2e} s, projection {:.2e} s".format(
+                    convolution, err[convolution],
+                    np.median(abs((BzTD-BzTD_analytic)/BzTD_analytic)),
+                    t_plan, t_project
+                )
+            )
+        self.survey.convolution = 'quadrature'
+        self.assertTrue(err['spectral'] < err['quadrature'])
+        self.assertTrue(err['spectral'] < 1e-2)
+
+    def test_em1dtd_pulse_train_weights(self):
+        # Direct sum by default; with n_exact, Boole summation of the tail
+        # beyond n_exact+6 pulses, checked against the direct sum of long
+        # trains
+        decays = [
+            lambda k: (1.+k)**-1.5, lambda k: np.exp(-0.1*k),
+            lambda k: (k+0.3)**-0.5
+        ]
+        for n_pulse in [2, 14, 15, 20, 200, 2000]:
+            k = np.arange(n_pulse)
+            weights_sum = (-1.)**k
+            weights_sum[-1] *= 0.5
+            for n_exact in [None, 8]:
+                pulses, weights = pulse_train_weights(n_pulse, n_exact)
+                for decay in decays:
+                    r_sum = np.sum(weights_sum*decay(k))
+                    err = (
+                        abs(np.sum(weights*decay(pulses))-r_sum) /
+                        abs(r_sum)
+                    )
+                    if n_exact is None or n_pulse <= n_exact+6:
+                        self.assertEqual(pulses.size, n_pulse)
+                        self.assertTrue(err < 1e-13)
+                    else:
+                        self.assertTrue(pulses.size <= n_exact+5)
+                        self.assertTrue(err < 2e-4)
+        print ("Pulse train weights work")
+
+    def test_em1dtd_pulse_train(self):
+        # Long train of alternating pulses, summed exactly or with the
+        # tail approximated (n_pulse_exact)
+        sig_half = 1e-2
+        m_1D = np.log(np.ones(self.survey.n_layer)*sig_half)
+        n_pulse = 100
+
+        def step_func_Bz(time):
+            return EM1DAnalytics.BzAnalCircT(self.survey.a, time, sig_half)
+
+        BzTD_analytic = piecewise_pulse(
+            step_func_Bz, self.survey.time,
+            self.survey.time_input_currents, self.survey.input_currents,
+            self.survey.period, n_pulse=n_pulse
+        )
+        BzTD_sum = np.zeros(self.survey.n_time)
+        for i_pulse in range(n_pulse):
+            weight = (-1.)**i_pulse
+            if i_pulse == n_pulse-1:
+                weight *= 0.5
+            BzTD_sum += weight * piecewise_ramp(
+                step_func_Bz, self.survey.time+i_pulse*self.survey.period/2.,
+                self.survey.time_input_currents, self.survey.input_currents
+            )
+        err = (
+            np.linalg.norm(BzTD_analytic-BzTD_sum) /
+            np.linalg.norm(BzTD_sum)
+        )
+        print ('Pulse train error = ', err)
+        self.assertTrue(err < 1e-4)
+
+        self.survey.n_pulse = n_pulse
+        for convolution in ['quadrature', 'spectral']:
+            self.survey.convolution = convolution
+            BzTD = self.prob.survey.dpred(m_1D)
+            err = (
+                np.linalg.norm(BzTD-BzTD_analytic) /
+                np.linalg.norm(BzTD_analytic)
+            )
+            print ('Bz error ({}) = '.format(convolution), err)
+            self.assertTrue(err < 3e-2)
+            self.survey.n_pulse_exact = 8
+            err = (
+                np.linalg.norm(self.prob.survey.dpred(m_1D)-BzTD) /
+                np.linalg.norm(BzTD)
+            )
+            print ('Bz error of the tail ({}) = '.format(convolution), err)
+            self.assertTrue(err < 1e-3)
+            del self.survey.n_pulse_exact
+        print ("EM1DTD-CirculurLoop for a pulse train works")
+
+
 if __name__ == '__main__':
     unittest.main()
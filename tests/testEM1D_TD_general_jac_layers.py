@@ -107,5 +107,63 @@ class EM1D_TD_general_Jac_layers_ProblemTests(unittest.TestCase):
         if passed:
             print ("EM1DTD-layers Jtvec works")
 
+    def test_EM1DTDJvec_Jtvec_MatrixFree(self):
+        sig = np.ones(self.prob.survey.n_layer)*self.sig_half
+        sig[3] = 0.1
+        m_1D = np.log(sig)
+        v = np.random.randn(self.prob.survey.n_layer)
+        w = np.random.randn(self.prob.survey.nD)
+
+        Jv = self.prob.Jvec(m_1D, v)
+        Jtw = self.prob.Jtvec(m_1D, w)
+
+        self.prob.matrix_free = True
+        Jv_free = self.prob.Jvec(m_1D, v)
+        Jtw_free = self.prob.Jtvec(m_1D, w)
+
+        self.assertTrue(np.allclose(Jv, Jv_free, rtol=1e-8, atol=0.))
+        self.assertTrue(np.allclose(Jtw, Jtw_free, rtol=1e-8, atol=0.))
+        print ("EM1DTD-layers matrix-free Jvec and Jtvec work")
+
+    def test_EM1DTD_ProjectFields_Columns(self):
+        # All columns of the sensitivity are transformed at once
+        n_frequency = self.survey.n_frequency
+        u = (
+            np.random.randn(n_frequency, 4) +
+            1j*np.random.randn(n_frequency, 4)
+        )
+        resp = self.survey.projectFields(u)
+        self.assertEqual(resp.shape, (self.survey.nD, 4))
+        for i in range(u.shape[1]):
+            resp_i = self.survey.projectFields(u[:, i])
+            self.assertTrue(np.allclose(resp[:, i], resp_i, rtol=1e-10))
+        print ("EM1DTD-layers projectFields of columns works")
+
+    def test_EM1DTD_TransformPlan(self):
+        # The projection operator is kept until the system changes
+        P = self.survey.projection_operator
+        self.prob.Jvec(self.m_1D, np.ones(self.survey.n_layer))
+        self.assertTrue(self.survey.projection_operator is P)
+        self.assertEqual(
+            P.shape, (self.survey.nD, 2*self.survey.n_frequency)
+        )
+
+        time = self.survey.time
+        self.survey.time = time[::2]
+        P_new = self.survey.projection_operator
+        self.assertTrue(P_new is not P)
+        # The frequencies are read from the plan, never assigned by it
+        self.assertTrue(
+            self.survey.frequency is self.survey.transform_plan.frequency
+        )
+        self.assertEqual(
+            P_new.shape, (self.survey.nD, 2*self.survey.n_frequency)
+        )
+        self.survey.time = time
+        self.assertTrue(
+            np.allclose(self.survey.projection_operator, P, rtol=1e-12)
+        )
+        print ("EM1DTD-layers transform plan works")
+
 if __name__ == '__main__':
     unittest.main()
@@ -4,6 +4,7 @@ from SimPEG import Maps, Utils, Mesh
 import matplotlib.pyplot as plt
 from simpegEM1D import EM1D, EM1DAnalytics, EM1DSurveyTD
 from scipy import io
+from scipy.integrate import quad
 from simpegEM1D.DigFilter import setFrequency
 
 
@@ -145,5 +146,86 @@ class EM1D_TD_FwdProblemTests(unittest.TestCase):
         self.assertTrue(err < 1e-2)
         print ("EM1DTD-CirculurLoop for Complex conductivity works")
 
+    def test_EM1DTDfwd_CirLoop_TransformAccuracy(self):
+        n_frequency = self.survey.n_frequency
+        n_frequency_default = n_frequency
+        Bzanal = EM1DAnalytics.BzAnalCircT(
+            self.survey.a, self.survey.time, self.sig_half
+        )
+        for accuracy in [1e-2, 1e-4]:
+            self.survey.transform_accuracy = accuracy
+            sampling = self.survey.transform_sampling
+            print ('Sampling = ', sampling)
+            self.assertTrue(sampling['error'] <= accuracy)
+            BzTD = self.prob.survey.dpred(self.m_1D)
+            err = np.linalg.norm(BzTD-Bzanal)/np.linalg.norm(Bzanal)
+            print ('Bz error = ', err)
+            self.assertTrue(err < 1e-2)
+            if accuracy == 1e-2:
+                self.assertTrue(sampling['n_frequency'] <= n_frequency)
+
+        # Narrow band gate sets need fewer frequencies
+        self.survey.transform_accuracy = 1e-2
+        n_frequency = self.survey.transform_sampling['n_frequency']
+        self.survey.time = self.survey.time[30:34]
+        sampling = self.survey.transform_sampling
+        print ('Sampling = ', sampling)
+        self.assertTrue(sampling['n_frequency'] < n_frequency)
+        self.survey.time = np.logspace(-5, -2, 64)
+
+        # The default sampling does not depend on the adaptive one
+        self.survey.transform_accuracy = 1e-4
+        self.survey.transform_sampling
+        del self.survey.transform_accuracy
+        sampling = self.survey.transform_sampling
+        self.assertEqual(sampling['filter'], 'Key 81 CosSin (2009)')
+        self.assertEqual(sampling['pts_per_dec'], 3)
+        self.assertEqual(sampling['n_frequency'], n_frequency_default)
+        print ("EM1DTD-CirculurLoop transform accuracy works")
+
+    def test_EM1DTDfwd_CirLoop_TimeGates(self):
+        # Wide gates around every other time channel
+        time = self.survey.time[::2]
+        time_gate = np.c_[time/1.5, time*1.5]
+        self.survey.time = time
+
+        def step_func_Bz(time):
+            return EM1DAnalytics.BzAnalCircT(
+                self.survey.a, np.r_[time], self.sig_half
+            )[0]
+
+        Bz_center = EM1DAnalytics.BzAnalCircT(
+            self.survey.a, time, self.sig_half
+        )
+        for gate_weighting in ['boxcar', 'linear_taper']:
+            Bz_gate = []
+            for t_start, t_end in time_gate:
+                if gate_weighting == 'boxcar':
+                    taper = 0.
+                else:
+                    taper = 0.5*min(t_end-t_start, t_start)
+                t_taper = [t_start-taper, t_start, t_end, t_end+taper]
+                Bz_gate.append(quad(
+                    lambda t: step_func_Bz(t)*np.interp(
+                        t, t_taper, [0., 1., 1., 0.]
+                    ), t_taper[0], t_taper[-1], points=t_taper[1:3],
+                    limit=200
+                )[0] / (t_end-t_start+taper))
+            Bz_gate = np.array(Bz_gate)
+
+            self.survey.time_gate = time_gate
+            self.survey.gate_weighting = gate_weighting
+            BzTD = self.prob.survey.dpred(self.m_1D)
+            err = np.linalg.norm(BzTD-Bz_gate)/np.linalg.norm(Bz_gate)
+            err_center = (
+                np.linalg.norm(Bz_center-Bz_gate)/np.linalg.norm(Bz_gate)
+            )
+            print ('Bz error ({}) = '.format(gate_weighting), err)
+            print ('Bz error of the gate centres = ', err_center)
+            self.assertTrue(err < 1e-2)
+            self.assertTrue(err < err_center)
+            self.assertEqual(self.survey.projection_operator.shape[0], 32)
+        print ("EM1DTD-CirculurLoop for time gates works")
+
 if __name__ == '__main__':
     unittest.main()
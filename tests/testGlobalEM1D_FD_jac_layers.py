@@ -1,9 +1,16 @@
 from __future__ import print_function
+import gc
+import pickle
 import unittest
 import numpy as np
+import scipy.sparse as sp
 from simpegEM1D import (
     GlobalEM1DProblemFD, GlobalEM1DSurveyFD,
-    get_vertical_discretization_frequency
+    get_vertical_discretization_frequency, run_simulation_FD,
+    run_simulation_FD_multiple
+)
+from simpegEM1D.GlobalEM1D import (
+    init_worker, run_chunk, _worker, SharedSoundingBuffers, shared_memory
 )
 from SimPEG import (
     Regularization, Inversion, InvProblem,
@@ -200,5 +207,359 @@ class GlobalEM1DFD_Height(unittest.TestCase):
         )
         self.assertTrue(passed)
 
+
+class GlobalEM1DFD_Batch(unittest.TestCase):
+
+    def get_problem(
+        self, batch_soundings, invert_height, fused_jacobian=False,
+        precision='double'
+    ):
+        frequency = np.array([900, 7200, 56000], dtype=float)
+        hz = get_vertical_discretization_frequency(
+            frequency, sigma_background=1./10., n_layer=5
+        )
+        n_sounding = 4
+        x = np.arange(n_sounding) * 20.
+        y = np.zeros_like(x)
+        z = 30. + np.arange(n_sounding)
+        rx_locations = np.c_[x, y, z]
+        src_locations = np.c_[x, y, z]
+        topo = np.c_[x, y, z-30.].astype(float)
+
+        survey = GlobalEM1DSurveyFD(
+            rx_locations=rx_locations,
+            src_locations=src_locations,
+            frequency=frequency,
+            offset=np.ones_like(frequency) * 8.,
+            src_type="VMD",
+            rx_type="ppm",
+            field_type='secondary',
+            topo=topo
+        )
+        n_layer = hz.size
+        sigma = np.random.rand(n_sounding, n_layer) * 0.1 + 0.01
+        if invert_height:
+            wires = Maps.Wires(
+                ('sigma', n_sounding*n_layer), ('h', n_sounding)
+            )
+            sigmaMap = Maps.ExpMap(nP=n_sounding*n_layer) * wires.sigma
+            problem = GlobalEM1DProblemFD(
+                [], sigmaMap=sigmaMap, hMap=wires.h, hz=hz,
+                batch_soundings=batch_soundings,
+                fused_jacobian=fused_jacobian, precision=precision
+            )
+            m = np.r_[np.log(sigma.flatten()), z-2.]
+        else:
+            problem = GlobalEM1DProblemFD(
+                [], sigmaMap=Maps.ExpMap(nP=n_sounding*n_layer), hz=hz,
+                batch_soundings=batch_soundings,
+                fused_jacobian=fused_jacobian, precision=precision
+            )
+            m = np.log(sigma.flatten())
+        problem.pair(survey)
+        return problem, m
+
+    def test_batch_soundings(self):
+        np.random.seed(1)
+        for invert_height in [False, True]:
+            p_serial, m = self.get_problem(False, invert_height)
+            p_batch, _ = self.get_problem(True, invert_height)
+            d_serial = p_serial.forward(m)
+            d_batch = p_batch.forward(m)
+            self.assertTrue(
+                np.allclose(d_serial, d_batch, rtol=1e-10, atol=0.)
+            )
+            J_serial = p_serial.getJ_sigma(m).toarray()
+            J_batch = p_batch.getJ_sigma(m).toarray()
+            self.assertTrue(np.allclose(J_serial, J_batch, rtol=1e-10))
+            if invert_height:
+                J_serial = p_serial.getJ_height(m).toarray()
+                J_batch = p_batch.getJ_height(m).toarray()
+                self.assertTrue(np.allclose(J_serial, J_batch, rtol=1e-10))
+
+    def test_fused_jacobian(self):
+        for batch_soundings in [False, True]:
+            for invert_height in [False, True]:
+                np.random.seed(1)
+                p_ref, m = self.get_problem(False, invert_height)
+                np.random.seed(1)
+                p_fused, _ = self.get_problem(
+                    batch_soundings, invert_height, fused_jacobian=True
+                )
+                d_ref = p_ref.survey.dpred(m)
+                d_fused = p_fused.survey.dpred(m)
+                self.assertTrue(
+                    np.allclose(d_ref, d_fused, rtol=1e-10, atol=0.)
+                )
+                # Only the first J request runs the fused pass
+                self.assertTrue(p_fused._Jmatrix_sigma is None)
+                J_ref = p_ref.getJ_sigma(m).toarray()
+                J_fused = p_fused.getJ_sigma(m).toarray()
+                self.assertTrue(np.allclose(J_ref, J_fused, rtol=1e-10))
+                if invert_height:
+                    # Filled by the fused pass
+                    self.assertTrue(p_fused._Jmatrix_height is not None)
+                    J_ref = p_ref.getJ_height(m).toarray()
+                    J_fused = p_fused.getJ_height(m).toarray()
+                    self.assertTrue(
+                        np.allclose(J_ref, J_fused, rtol=1e-10)
+                    )
+
+
+    def test_forward_and_height(self):
+        for batch_soundings in [False, True]:
+            np.random.seed(1)
+            p, m = self.get_problem(batch_soundings, True)
+            d = p.forward(m)
+            # Only on request
+            self.assertTrue(p._Jmatrix_height is None)
+            p.fused_height = True
+            self.assertTrue(np.allclose(d, p.forward(m), rtol=1e-10))
+            # Filled by the forward pass, from the same rTE evaluation
+            self.assertTrue(p._Jmatrix_height is not None)
+            J_forward = p.getJ_height(m).toarray()
+            p._Jmatrix_height = None
+            J_height = p.getJ_height(m).toarray()
+            self.assertTrue(np.allclose(J_forward, J_height, rtol=1e-10))
+            self.assertTrue(np.allclose(d, p.forward(m), rtol=1e-10))
+
+    def test_single_precision(self):
+        for batch_soundings in [False, True]:
+            np.random.seed(1)
+            p_ref, m = self.get_problem(batch_soundings, False)
+            np.random.seed(1)
+            p_single, _ = self.get_problem(
+                batch_soundings, False, precision='single'
+            )
+            d_ref = p_ref.forward(m)
+            d_single = p_single.forward(m)
+            self.assertEqual(d_single.dtype, np.float32)
+            err = np.linalg.norm(d_single-d_ref)/np.linalg.norm(d_ref)
+            self.assertTrue(err < 1e-3)
+
+    def test_worker_pool(self):
+        np.random.seed(1)
+        p_serial, m = self.get_problem(False, True)
+        np.random.seed(1)
+        p_parallel, _ = self.get_problem(False, True)
+        p_parallel.parallel = True
+        p_parallel.n_cpu = 2
+        with p_parallel:
+            pool = p_parallel.pool
+            for m_i in [m, m*1.1]:
+                p_serial.model = m_i
+                p_parallel.model = m_i
+                self.assertTrue(np.allclose(
+                    p_serial.forward(m_i), p_parallel.forward(m_i),
+                    rtol=1e-10, atol=0.
+                ))
+                J_serial = p_serial.getJ_sigma(m_i).toarray()
+                J_parallel = p_parallel.getJ_sigma(m_i).toarray()
+                self.assertTrue(np.allclose(J_serial, J_parallel, rtol=1e-10))
+                # The same workers serve every call
+                self.assertTrue(p_parallel.pool is pool)
+            # Outputs written by the workers in shared memory
+            self.assertTrue(p_parallel._sounding_buffers is not None)
+            p_serial.model = m
+            d_serial = p_serial.forward_and_jacobian(m)
+            J_serial = p_serial.getJ_height(m).toarray()
+            p_parallel.model = m
+            d_parallel = p_parallel.forward_and_jacobian(m)
+            J_parallel = p_parallel.getJ_height(m).toarray()
+            self.assertTrue(np.allclose(d_serial, d_parallel, rtol=1e-10))
+            self.assertTrue(np.allclose(J_serial, J_parallel, rtol=1e-10))
+            # Tasks only carry the index and the model of a sounding,
+            # not the problem of the bound run_simulation
+            task = pickle.dumps(p_parallel.chunk_task([0], 'forward'))
+            args = pickle.dumps(p_parallel.input_args(0, 'forward'))
+            problem = pickle.dumps(p_parallel.run_simulation)
+            print('Task {} bytes, input_args {} bytes, problem {} '
+                  'bytes'.format(len(task), len(args), len(problem)))
+            self.assertTrue(len(task) < len(args))
+            self.assertTrue(len(task) < len(problem)/10)
+        self.assertTrue(p_parallel._pool is None)
+        self.assertTrue(p_parallel._sounding_buffers is None)
+
+    def test_worker_pool_release(self):
+        # Pools of problems that are not shut down are terminated when
+        # the problem is garbage collected
+        np.random.seed(1)
+        p_parallel, m = self.get_problem(False, True)
+        p_parallel.parallel = True
+        p_parallel.n_cpu = 2
+        p_parallel.forward(m)
+        workers = list(p_parallel.pool._pool)
+        self.assertTrue(all(worker.is_alive() for worker in workers))
+        buffers = p_parallel._sounding_buffers
+        names = [] if buffers is None else [
+            shm.name for shm in buffers.shared_memory.values()
+        ]
+        # Copies of the problem do not own the pool or its buffers
+        state = p_parallel.__getstate__()
+        self.assertTrue('_pool' not in state)
+        self.assertTrue('_sounding_buffers' not in state)
+        del p_parallel, buffers, state
+        gc.collect()
+        self.assertFalse(any(worker.is_alive() for worker in workers))
+        # The shared memory is unlinked
+        for name in names:
+            with self.assertRaises(FileNotFoundError):
+                shared_memory.SharedMemory(name=name)
+
+    def test_worker_output_size(self):
+        # Outputs that do not match data_index are not written in the
+        # rows of the next sounding
+        if shared_memory is None:
+            return
+        np.random.seed(1)
+        p, m = self.get_problem(False, False)
+        p.model = m
+        data_index = [index[:-1] for index in p.data_index]
+        buffers = SharedSoundingBuffers(data_index, p.n_layer, False)
+        init_worker(
+            p.simulation_function, p.static_args(), p.model_args_index,
+            p.jac_switch_index, buffers.layout
+        )
+        try:
+            with self.assertRaises(Exception):
+                run_chunk(p.chunk_task([0], 'forward'))
+            self.assertTrue(np.all(buffers.arrays['pred'] == 0.))
+        finally:
+            for shm, _, _ in _worker['buffers'].values():
+                shm.close()
+            _worker.clear()
+            buffers.close()
+
+    def test_chunked_soundings(self):
+        np.random.seed(1)
+        p_serial, m = self.get_problem(False, True)
+        np.random.seed(1)
+        p_parallel, _ = self.get_problem(False, True)
+        p_parallel.parallel = True
+        p_parallel.n_cpu = 2
+        # All soundings share their static arguments
+        self.assertEqual(
+            p_parallel.sounding_groups(), [list(range(p_parallel.n_sounding))]
+        )
+        self.assertTrue(p_parallel.get_chunk_size() >= 1)
+        d_serial = p_serial.forward_and_jacobian(m)
+        J_sigma_serial = p_serial.getJ_sigma(m).toarray()
+        J_height_serial = p_serial.getJ_height(m).toarray()
+        for chunk_size in [1, 3, p_parallel.n_sounding]:
+            p_parallel.chunk_size = chunk_size
+            chunks = p_parallel.get_chunks()
+            self.assertEqual(
+                sum(chunks, []), list(range(p_parallel.n_sounding))
+            )
+            self.assertTrue(max(len(chunk) for chunk in chunks) <= chunk_size)
+            with p_parallel:
+                p_parallel.model = m
+                d_parallel = p_parallel.forward_and_jacobian(m)
+                err_d = np.linalg.norm(d_serial-d_parallel)
+                err_sigma = np.linalg.norm(
+                    J_sigma_serial-p_parallel.getJ_sigma(m).toarray()
+                )
+                err_height = np.linalg.norm(
+                    J_height_serial-p_parallel.getJ_height(m).toarray()
+                )
+            self.assertTrue(err_d < 1e-10*np.linalg.norm(d_serial))
+            self.assertTrue(err_sigma < 1e-10*np.linalg.norm(J_sigma_serial))
+            self.assertTrue(
+                err_height < 1e-10*np.linalg.norm(J_height_serial)
+            )
+            print ("Chunks of {} soundings work".format(chunk_size))
+
+    def test_worker_simulations(self):
+        # Soundings of the same system share one problem, moved to their
+        # locations, in the workers and in the serial simulations
+        np.random.seed(1)
+        p, m = self.get_problem(False, False)
+        # Different heights above the topography
+        p.survey.topo = p.survey.topo - np.arange(p.n_sounding)[:, None]
+        p.model = m
+        d = np.hstack([
+            p.simulation_function(p.input_args(i_sounding))
+            for i_sounding in range(p.n_sounding)
+        ])
+        J_sigma = sp.block_diag([
+            p.simulation_function(
+                p.input_args(i_sounding, jac_switch='sensitivity_sigma')
+            ) for i_sounding in range(p.n_sounding)
+        ]).toarray()
+        err = np.linalg.norm(p.forward(m)-d)
+        self.assertTrue(err < 1e-10*np.linalg.norm(d))
+        self.assertEqual(len(p._simulations.simulations), 1)
+
+        init_worker(
+            p.simulation_function, p.static_args(), p.model_args_index,
+            p.jac_switch_index, None, p.simulation_function_multiple,
+            p.simulation_cache()
+        )
+        chunks = [[0, 1], [2], [3]]
+        for m_i in [m, m*1.1]:
+            p.model = m_i
+            if m_i is not m:
+                d = p.forward(m_i)
+                J_sigma = p.getJ_sigma(m_i).toarray()
+            for jac_switch in ['forward', 'sensitivity_sigma']:
+                result = [
+                    output for chunk in chunks
+                    for output in run_chunk(p.chunk_task(chunk, jac_switch))
+                ]
+                if jac_switch == 'forward':
+                    err = np.linalg.norm(np.hstack(result)-d)
+                    self.assertTrue(err < 1e-10*np.linalg.norm(d))
+                else:
+                    err = np.linalg.norm(
+                        sp.block_diag(result).toarray()-J_sigma
+                    )
+                    self.assertTrue(err < 1e-10*np.linalg.norm(J_sigma))
+            if m_i is m:
+                simulations = list(_worker['simulations'].simulations)
+        # One problem for the four soundings, built once
+        self.assertEqual(len(simulations), 1)
+        self.assertTrue(
+            _worker['simulations'].simulations[0][1] is simulations[0][1]
+        )
+        _worker.clear()
+
+        # Least recently used problems are dropped beyond n_simulation
+        cache = p.simulation_cache()
+        cache.n_simulation = 2
+        args = p.input_args(0)
+        args_offset = [
+            args[:4] + (args[4]*scale,) + args[5:] for scale in [1., 2., 3.]
+        ]
+        probs = [cache.get(args_i) for args_i in args_offset]
+        self.assertEqual(len(cache.simulations), 2)
+        self.assertTrue(cache.get(args_offset[2]) is probs[2])
+        self.assertTrue(cache.get(args_offset[1]) is probs[1])
+        self.assertTrue(cache.get(args_offset[0]) is not probs[0])
+        print ("Worker simulations work")
+
+    def test_batch_args(self):
+        # The batch entry point checks that its soundings share the system
+        np.random.seed(1)
+        p, m = self.get_problem(False, False)
+        p.model = m
+        args_list = [
+            p.input_args(i_sounding) for i_sounding in range(p.n_sounding)
+        ]
+        d = run_simulation_FD_multiple(args_list)
+        for args, d_sounding in zip(args_list, d):
+            self.assertTrue(np.allclose(
+                d_sounding, run_simulation_FD(args), rtol=1e-10, atol=0.
+            ))
+
+        args = args_list[1]
+        args_offset = args[:4] + (args[4]*2.,) + args[5:]
+        with self.assertRaises(Exception):
+            run_simulation_FD_multiple([args_list[0], args_offset])
+        args_jac = args[:15] + ('sensitivity_sigma',) + args[16:]
+        with self.assertRaises(Exception):
+            run_simulation_FD_multiple([args_list[0], args_jac])
+        print ("Batch arguments work")
+
+
 if __name__ == '__main__':
     unittest.main()
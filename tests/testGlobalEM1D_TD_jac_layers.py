@@ -145,6 +145,32 @@ class GlobalEM1DTD(unittest.TestCase):
         )
         self.assertTrue(passed)
 
+    def test_shared_transform_plan(self):
+        # The soundings fly one system and share one transform plan, also
+        # with the problems of another discretization; the plan of the
+        # adaptive sampling is the only one built
+        self.survey.transform_accuracy = 1e-2
+        self.p._simulations = None
+        d = self.p.forward(self.m0)
+        transform_plans = (
+            self.p._simulations.simulation_kwargs['transform_plans']
+        )
+        self.assertEqual(len(transform_plans.plans), 1)
+        plan = transform_plans.plans[0]
+        args = self.p.input_args(0)
+        prob = self.p.get_simulation(args[:3] + (args[3][::2],) + args[4:])
+        self.assertEqual(len(self.p._simulations.simulations), 2)
+        self.assertTrue(prob.survey.transform_plan is plan)
+        self.assertTrue(prob.survey.frequency is plan.frequency)
+        self.assertTrue(np.allclose(self.p.forward(self.m0), d))
+        self.assertEqual(len(transform_plans.plans), 1)
+        # The plans are kept by the problem, not shared between problems
+        self.assertEqual(
+            self.p.simulation_cache().simulation_kwargs[
+                'transform_plans'
+            ].plans, []
+        )
+
 class GlobalEM1DTD_Height(unittest.TestCase):
 
     def setUp(self, parallel=False):
@@ -269,5 +295,114 @@ class GlobalEM1DTD_Height(unittest.TestCase):
         )
         self.assertTrue(passed)
 
+
+class GlobalEM1DTD_Batch(unittest.TestCase):
+
+    def get_problem(self, n_layer, batch_soundings, fused_jacobian=False):
+        time = np.logspace(-5, -3, 11)
+        if n_layer == 1:
+            hz = np.r_[1.]
+        else:
+            hz = get_vertical_discretization_time(
+                time, facter_tmax=0.5, factor_tmin=10., n_layer=n_layer
+            )
+        n_sounding = 4
+        x = np.arange(n_sounding) * 20.
+        y = np.zeros_like(x)
+        z = np.ones_like(x) * 30.
+        rx_locations = np.c_[x, y, z]
+        src_locations = np.c_[x, y, z]
+        topo = np.c_[x, y, z-30.].astype(float)
+
+        def repeat(value):
+            return np.array([value]).repeat(n_sounding, axis=0)
+
+        survey = GlobalEM1DSurveyTD(
+            rx_locations=rx_locations,
+            src_locations=src_locations,
+            topo=topo,
+            time=[time for i in range(n_sounding)],
+            src_type=repeat("CircularLoop"),
+            rx_type=repeat("dBzdt"),
+            field_type=repeat('secondary'),
+            wave_type=repeat('general'),
+            a=repeat(13.),
+            input_currents=[
+                wave.currents[-7:] for i in range(n_sounding)
+            ],
+            time_input_currents=[
+                wave.current_times[-7:] for i in range(n_sounding)
+            ],
+            half_switch=n_layer == 1
+        )
+        wires = Maps.Wires(
+            ('sigma', n_sounding*n_layer), ('h', n_sounding)
+        )
+        problem = GlobalEM1DProblemTD(
+            [], sigmaMap=Maps.ExpMap(nP=n_sounding*n_layer) * wires.sigma,
+            hMap=wires.h, hz=hz, batch_soundings=batch_soundings,
+            fused_jacobian=fused_jacobian
+        )
+        problem.pair(survey)
+        sigma = np.random.rand(n_sounding, n_layer) * 0.1 + 0.01
+        m = np.r_[np.log(sigma.flatten()), 30. + np.arange(n_sounding)]
+        return problem, m
+
+    def test_batch_soundings(self):
+        # Including a half-space, whose sensitivity is one column
+        for n_layer in [5, 1]:
+            for fused_jacobian in [False, True]:
+                np.random.seed(1)
+                p_serial, m = self.get_problem(n_layer, False)
+                np.random.seed(1)
+                p_batch, _ = self.get_problem(
+                    n_layer, True, fused_jacobian=fused_jacobian
+                )
+                d_serial = p_serial.forward(m)
+                d_batch = p_batch.forward(m)
+                self.assertTrue(
+                    np.allclose(d_serial, d_batch, rtol=1e-10, atol=0.)
+                )
+                J_serial = p_serial.getJ_sigma(m).toarray()
+                J_batch = p_batch.getJ_sigma(m).toarray()
+                self.assertEqual(J_batch.shape, (d_serial.size, 4*n_layer))
+                self.assertTrue(np.allclose(J_serial, J_batch, rtol=1e-10))
+                J_serial = p_serial.getJ_height(m).toarray()
+                J_batch = p_batch.getJ_height(m).toarray()
+                self.assertTrue(np.allclose(J_serial, J_batch, rtol=1e-10))
+                v = np.random.rand(m.size)
+                self.assertTrue(np.allclose(
+                    p_serial.Jvec(m, v), p_batch.Jvec(m, v), rtol=1e-10
+                ))
+
+    def test_worker_pool(self):
+        for n_layer in [5, 1]:
+            for batch_soundings in [False, True]:
+                np.random.seed(1)
+                p_serial, m = self.get_problem(n_layer, False)
+                np.random.seed(1)
+                p_parallel, _ = self.get_problem(n_layer, batch_soundings)
+                p_parallel.parallel = True
+                p_parallel.n_cpu = 2
+                with p_parallel:
+                    for m_i in [m, m*1.1]:
+                        p_serial.model = m_i
+                        p_parallel.model = m_i
+                        self.assertTrue(np.allclose(
+                            p_serial.forward(m_i), p_parallel.forward(m_i),
+                            rtol=1e-10, atol=0.
+                        ))
+                        J_serial = p_serial.getJ_sigma(m_i).toarray()
+                        J_parallel = p_parallel.getJ_sigma(m_i).toarray()
+                        self.assertTrue(
+                            np.allclose(J_serial, J_parallel, rtol=1e-10)
+                        )
+                        J_serial = p_serial.getJ_height(m_i).toarray()
+                        J_parallel = p_parallel.getJ_height(m_i).toarray()
+                        self.assertTrue(
+                            np.allclose(J_serial, J_parallel, rtol=1e-10)
+                        )
+
+
 if __name__ == '__main__':
     unittest.main()